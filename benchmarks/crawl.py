@@ -0,0 +1,219 @@
+"""
+Benchmarks whole crawls: the ``artist``, ``bookmarks`` and ``illust``
+commands run end to end through the real ``Client`` against a local stand-in
+for the Pixiv API and image host (see ``mockpixiv.py``), with configurable
+latency, bandwidth and error injection.
+
+Each scenario runs in a fresh process with its own config, database and
+download directory, and reports its illustrations and megabytes per second,
+peak RSS, and the SQLite write statements and commits it made.
+
+    $ poetry run python benchmarks/crawl.py --illustrations 300 --jobs 8
+    $ poetry run python benchmarks/crawl.py --latency 50 --bandwidth 5 \\
+          --error-rate 0.02 --engine async --jobs 32 --json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from mockpixiv import ServerOptions, serve
+
+SCENARIOS = ("artist", "bookmarks", "illust")
+
+# The artist whose illustrations the mock server lists.
+ARTIST_ID = 2
+
+
+def main():
+    args = parse_args()
+
+    options = ServerOptions(
+        illustrations=args.illustrations,
+        pages=args.pages,
+        image_size=args.image_size * 1024,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1e6,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    # Spawned processes start from a fresh interpreter, so each scenario's
+    # peak RSS is its own.
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(
+        target=serve, args=(args.port, options, ready), daemon=True
+    )
+    server.start()
+    ready.wait()
+
+    try:
+        results = [run_in_process(context, scenario, args) for scenario in args.only]
+    finally:
+        server.terminate()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print_table(results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--illustrations", type=int, default=300)
+    parser.add_argument("--pages", type=int, default=1, help="Pages per illustration.")
+    parser.add_argument("--image-size", type=int, default=512, help="Size in KiB.")
+    parser.add_argument("--latency", type=float, default=0, help="In milliseconds.")
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="Per connection, in MB/s. 0 is unlimited.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="The fraction of GET requests failed with a 503.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread")
+    parser.add_argument("--dedupe", choices=["hardlink", "reflink"])
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--json", action="store_true", help="Print JSON lines.")
+    return parser.parse_args()
+
+
+def run_in_process(context, scenario, args):
+    results = context.Queue()
+    process = context.Process(target=run_scenario, args=(scenario, args, results))
+    process.start()
+    process.join()
+    if process.exitcode:
+        sys.exit(f"The {scenario} scenario failed.")
+    return results.get()
+
+
+def run_scenario(scenario, args, results):
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["XDG_CONFIG_HOME"] = str(Path(home) / "config")
+        os.environ["XDG_DATA_HOME"] = str(Path(home) / "data")
+        downloads = Path(home) / "downloads"
+        downloads.mkdir()
+
+        host = f"http://127.0.0.1:{args.port}"
+        command = _command(scenario, args, Path(home))
+        results.put(_crawl(host, command, downloads, args))
+
+
+def _command(scenario, args, home):
+    options = ["--jobs", str(args.jobs), "--quiet"]
+    if scenario == "artist":
+        return ["artist", str(ARTIST_ID), "--engine", args.engine, *options]
+    if scenario == "bookmarks":
+        return ["bookmarks", "-v", "public", "--engine", args.engine, *options]
+
+    ids = home / "ids.txt"
+    ids.write_text("".join(f"{id_}\n" for id_ in range(1, args.illustrations + 1)))
+    return ["illust", "--from-file", str(ids), *options]
+
+
+def _crawl(host, command, downloads, args):
+    # pixi finds its config and database through the environment set above,
+    # so it's only imported now.
+    import pixivapi.client
+
+    from pixi import database, make_app_directories
+    from pixi.__main__ import run
+    from pixi.config import CONFIG_PATH, DEFAULT_CONFIG
+    from pixi.progress import progress
+
+    pixivapi.client.BASE_URL = host
+    pixivapi.client.AUTH_URL = f"{host}/auth/token"
+
+    make_app_directories()
+    config = ConfigParser()
+    config.read_dict(DEFAULT_CONFIG)
+    config["pixi"].update(
+        refresh_token="benchmark",
+        download_directory=str(downloads),
+        dedupe=args.dedupe or "",
+        api_requests_per_second="0",
+        image_requests_per_second="0",
+    )
+    with CONFIG_PATH.open("w") as f:
+        config.write(f)
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        _run_pixi(run, ["migrate"])
+
+        statements = []
+        database._connect().set_trace_callback(statements.append)
+        start = time.perf_counter()
+        _run_pixi(run, command)
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    return {
+        "scenario": command[0],
+        "illustrations": progress.counts["finished"],
+        "failed": progress.counts["failed"],
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(progress.counts["finished"] / elapsed, 2),
+        "mb_per_second": round(progress.bytes / elapsed / 1e6, 2),
+        "peak_rss_mb": round(peak_rss / 2**20, 1),
+        "sqlite_writes": sum(1 for sql in statements if _is_write(sql)),
+        "sqlite_commits": statements.count("COMMIT"),
+    }
+
+
+def _run_pixi(run, command):
+    sys.argv = ["pixi"] + command
+    try:
+        run()
+    except SystemExit:
+        pass
+
+
+def _is_write(sql):
+    return sql.lstrip().split(None, 1)[0].upper() in ("INSERT", "UPDATE", "DELETE")
+
+
+def print_table(results):
+    columns = [
+        ("scenario", "Scenario", "{}"),
+        ("illustrations", "Done", "{}"),
+        ("failed", "Failed", "{}"),
+        ("items_per_second", "Items/s", "{:.1f}"),
+        ("mb_per_second", "MB/s", "{:.1f}"),
+        ("peak_rss_mb", "Peak RSS (MiB)", "{:.1f}"),
+        ("sqlite_writes", "SQLite writes", "{}"),
+        ("sqlite_commits", "Commits", "{}"),
+    ]
+    rows = [[title for _, title, _ in columns]] + [
+        [fmt.format(result[key]) for key, _, fmt in columns] for result in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        print("  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
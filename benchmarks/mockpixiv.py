@@ -0,0 +1,198 @@
+"""
+A local stand-in for the Pixiv app API and its i.pximg.net image host, for
+benchmarks. It serves the OAuth token endpoint, the paginated user
+illustration and bookmark listings, illustration details and the images
+themselves, all over plain HTTP on one port.
+
+Every response can be delayed by a fixed latency, image bodies are streamed
+at a capped bandwidth per connection, and a fraction of requests can be
+failed with a 503 to exercise the retry paths.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# The number of illustrations on each page of a listing, as on Pixiv.
+PAGE_SIZE = 30
+
+# The size of the blocks image bodies are written in.
+WRITE_BLOCK_SIZE = 64 * 1024
+
+# The account the mock server authenticates every refresh token as.
+ACCOUNT = {
+    "profile_image_urls": {},
+    "account": "benchmark",
+    "id": 1,
+    "name": "Benchmark",
+    "mail_address": "benchmark@example.com",
+    "is_premium": False,
+    "x_restrict": 0,
+    "is_mail_authorized": True,
+}
+
+ServerOptions = namedtuple(
+    "ServerOptions",
+    "illustrations, pages, image_size, latency, bandwidth, error_rate, seed",
+)
+
+
+def serve(port, options, ready):
+    """Serve the mock API on ``port`` forever, setting ``ready`` once bound."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(port, options))
+    server.daemon_threads = True
+    ready.set()
+    server.serve_forever()
+
+
+def illustration(id_, host, pages=1):
+    """Return the API's JSON for an illustration with images under ``host``."""
+    urls = [f"{host}/img/{id_}_p{page}.jpg" for page in range(pages)]
+    return {
+        "caption": "",
+        "create_date": "2020-01-01T00:00:00+09:00",
+        "height": 1000,
+        "id": id_,
+        "image_urls": {"square_medium": urls[0], "medium": urls[0], "large": urls[0]},
+        "is_bookmarked": False,
+        "is_muted": False,
+        "meta_pages": (
+            [{"image_urls": {"original": url}} for url in urls] if pages > 1 else []
+        ),
+        "meta_single_page": {} if pages > 1 else {"original_image_url": urls[0]},
+        "page_count": pages,
+        "restrict": 0,
+        "sanity_level": 2,
+        "series": None,
+        "tags": [{"name": f"tag{id_ % 10}", "translated_name": None}],
+        "title": f"Illustration {id_}",
+        "tools": [],
+        "total_bookmarks": 0,
+        "total_view": 0,
+        "type": "illust",
+        "user": {
+            "account": "artist",
+            "id": 2,
+            "name": "Artist",
+            "profile_image_urls": {},
+        },
+        "visible": True,
+        "width": 1000,
+        "x_restrict": 0,
+    }
+
+
+def _handler(port, options):
+    image = bytes(range(256)) * (options.image_size // 256 + 1)
+    return type(
+        "Handler",
+        (MockPixivHandler,),
+        {
+            "host": f"http://127.0.0.1:{port}",
+            "options": options,
+            "image": image[: options.image_size],
+            "rng": random.Random(options.seed),
+            "rng_lock": threading.Lock(),
+        },
+    )
+
+
+class MockPixivHandler(BaseHTTPRequestHandler):
+    """Serves the mock API, as configured by the attributes ``_handler`` sets."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(self.options.latency)
+        with self.rng_lock:
+            failed = self.rng.random() < self.options.error_rate
+        if failed:
+            return self._send(503, b"")
+
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.startswith("/img/"):
+            self._send_image()
+        elif url.path == "/v1/illust/detail":
+            id_ = int(query["illust_id"])
+            self._send_json({"illust": self._illustration(id_)})
+        elif url.path == "/v1/user/illusts":
+            self._send_page(int(query.get("offset", 0)), "offset")
+        elif url.path == "/v1/user/bookmarks/illust":
+            # Bookmarks are listed newest first and paged by ID.
+            max_id = int(query.get("max_bookmark_id", self.options.illustrations))
+            self._send_page(self.options.illustrations - max_id, "max_bookmark_id")
+        else:
+            self._send(404, b"")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.options.latency)
+        # Token requests aren't failed, as they aren't retried.
+        if urlsplit(self.path).path != "/auth/token":
+            return self._send(404, b"")
+        self._send_json(
+            {
+                "response": {
+                    "user": ACCOUNT,
+                    "access_token": "access",
+                    "refresh_token": "refresh",
+                }
+            }
+        )
+
+    def _illustration(self, id_):
+        return illustration(id_, self.host, self.options.pages)
+
+    def _send_page(self, offset, param):
+        """
+        Send the page of the listing that starts ``offset`` illustrations in,
+        linking to the next page by ``param`` like the API does.
+        """
+        total = self.options.illustrations
+        ids = range(total - offset, max(total - offset - PAGE_SIZE, 0), -1)
+
+        next_url = None
+        if offset + PAGE_SIZE < total:
+            next_value = offset + PAGE_SIZE if param == "offset" else ids[-1] - 1
+            next_url = f"{self.host}{urlsplit(self.path).path}?{param}={next_value}"
+
+        self._send_json(
+            {
+                "illusts": [self._illustration(id_) for id_ in ids],
+                "next_url": next_url,
+            }
+        )
+
+    def _send_image(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.image)))
+        self.end_headers()
+
+        bandwidth = self.options.bandwidth
+        start = time.monotonic()
+        for sent in range(0, len(self.image), WRITE_BLOCK_SIZE):
+            if bandwidth:
+                delay = start + sent / bandwidth - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            end = sent + WRITE_BLOCK_SIZE
+            self.wfile.write(self.image[sent:end])
+
+    def _send_json(self, body):
+        self._send(200, json.dumps(body).encode(), "application/json")
+
+    def _send(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
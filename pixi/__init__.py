@@ -1,3 +1,4 @@
+import importlib
 from pathlib import Path
 
 import click
@@ -9,7 +10,70 @@ CONFIG_DIR = Path(user_config_dir("pixi", "azuline"))
 DATA_DIR = Path(user_data_dir("pixi", "azuline"))
 
 
-@click.group()
+# Each command's module and short help. Download commands live in
+# pixi.commands, which imports the whole Pixiv client stack, so the cheap
+# commands in pixi.manage are kept apart from them.
+COMMANDS = {
+    "artist": ("pixi.commands", "Download illustrations of an artist by URL or ID."),
+    "auth": ("pixi.commands", "Log into Pixiv and generate a refresh token."),
+    "bookmarks": ("pixi.commands", "Download illustrations bookmarked by a user."),
+    "config": ("pixi.manage", "Edit the config file."),
+    "failed": ("pixi.manage", "View illustrations that failed to download."),
+    "illust": ("pixi.commands", "Download illustrations by URL or ID."),
+    "migrate": ("pixi.manage", "Upgrade the database to the latest migration."),
+    "reindex": (
+        "pixi.manage",
+        "Record the illustrations in a directory as downloaded.",
+    ),
+    "relayout": (
+        "pixi.commands",
+        "Move downloaded illustrations into the configured layout.",
+    ),
+    "retry-failed": (
+        "pixi.commands",
+        "Retry downloading the illustrations that failed.",
+    ),
+    "search": ("pixi.manage", "Search the catalog of downloaded illustrations."),
+    "wipe": ("pixi.manage", "Wipe the saved history of downloaded illustrations."),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    A command group that imports a command's module only when that command
+    is run, and lists commands in ``--help`` without importing any of them.
+    """
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            importlib.import_module(self.lazy_commands[name][0])
+        return self.commands.get(name)
+
+    def format_commands(self, ctx, formatter):
+        names = self.list_commands(ctx)
+        if not names:
+            return
+
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                rows.append((name, self.commands[name].get_short_help_str(limit)))
+            else:
+                rows.append((name, self.lazy_commands[name][1]))
+
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 def commandgroup():
     pass
 
@@ -2,10 +2,9 @@ import traceback
 
 import click
 
-import pixi.commands  # noqa
 from pixi import commandgroup, make_app_directories
 from pixi.config import write_default_config
-from pixi.database import confirm_database_is_updated, create_database_if_nonexistent
+from pixi.database import check_database, close_database
 from pixi.errors import DownloadFailed, GoAuthenticate, InvalidConfig, PixiError
 
 
@@ -13,8 +12,7 @@ def run():
     try:
         make_app_directories()
         write_default_config()
-        create_database_if_nonexistent()
-        confirm_database_is_updated()
+        check_database()
         commandgroup()
     except GoAuthenticate:
         click.echo("Invalid token. Re-authenticate with `pixi auth`.")
@@ -25,6 +23,8 @@ def run():
         traceback.print_exc()
     except PixiError as e:
         click.echo(e)
+    finally:
+        close_database()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import os
+import sqlite3
+from pathlib import Path
+
+from pixi.database import database
+from pixi.errors import PixiError
+from pixi.timing import timings
+
+# The ways search results can be counted instead of listed.
+COUNT_BY = ("artist", "tag")
+
+
+@timings.timed("record_illustration")
+def record_illustration(illustration, path):
+    """
+    Add a downloaded illustration's metadata to the catalog, replacing what
+    was recorded about it before. ``path`` is its file, or its folder if it
+    has multiple pages, and is used to record its size on disk.
+    """
+    tags = [(tag["name"], tag.get("translated_name")) for tag in illustration.tags]
+    with database() as (conn, cursor):
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO illustrations (
+                id,
+                artist_id,
+                artist,
+                title,
+                page_count,
+                width,
+                height,
+                created,
+                size
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                illustration.id,
+                illustration.user.id,
+                illustration.user.name,
+                illustration.title,
+                illustration.page_count,
+                illustration.width,
+                illustration.height,
+                illustration.create_date.isoformat(),
+                disk_size(path),
+            ),
+        )
+        cursor.execute("DELETE FROM tags WHERE illustration = ?", (illustration.id,))
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO tags (illustration, name, translated_name)
+            VALUES (?, ?, ?)
+            """,
+            [(illustration.id, name, translated) for name, translated in tags],
+        )
+        cursor.execute(
+            "DELETE FROM illustrations_search WHERE rowid = ?", (illustration.id,)
+        )
+        cursor.execute(
+            "INSERT INTO illustrations_search (rowid, title, tags) VALUES (?, ?, ?)",
+            (
+                illustration.id,
+                illustration.title,
+                " ".join(name for tag in tags for name in tag if name),
+            ),
+        )
+
+
+def search(query=None, artist_id=None, tag=None, since=None, limit=None):
+    """
+    Return the cataloged illustrations, newest downloads first, with their
+    recorded paths. ``query`` is a full-text query of titles and tags, ``tag``
+    matches a tag or its translation exactly, and ``since`` (a ``timedelta``)
+    keeps only illustrations downloaded within that long.
+    """
+    where, params = _filters(query, artist_id, tag, since)
+    return _query(
+        f"""
+        SELECT illustrations.*, downloaded.path
+        FROM illustrations
+        LEFT JOIN downloaded ON downloaded.id = illustrations.id
+        WHERE {where}
+        ORDER BY illustrations.time DESC
+        LIMIT ?
+        """,
+        params + [limit or -1],
+    )
+
+
+def count(by, query=None, artist_id=None, tag=None, since=None, limit=None):
+    """
+    Count the cataloged illustrations matching the same filters as ``search``
+    by artist or by tag, returning rows of a ``name``, the number of
+    illustrations and, for artists, their total size, most illustrations
+    first.
+    """
+    where, params = _filters(query, artist_id, tag, since)
+    if by == "artist":
+        sql = f"""
+            SELECT
+                artist || ' (' || artist_id || ')' AS name,
+                COUNT(*) AS illustrations,
+                SUM(size) AS size
+            FROM illustrations
+            WHERE {where}
+            GROUP BY artist_id
+        """
+    else:
+        # Tags are counted off their own index; looking up every tagged
+        # illustration for its size would make this many times slower.
+        if params:
+            where = f"illustration IN (SELECT id FROM illustrations WHERE {where})"
+        sql = f"""
+            SELECT name, COUNT(*) AS illustrations, NULL AS size
+            FROM tags
+            WHERE {where}
+            GROUP BY name
+        """
+
+    return _query(
+        f"{sql} ORDER BY illustrations DESC, name LIMIT ?", params + [limit or -1]
+    )
+
+
+def disk_size(path):
+    """Return the size in bytes of a file, or of the files in a folder."""
+    path = Path(path)
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+        return sum(
+            entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+        )
+    except OSError:
+        return None
+
+
+def _filters(query, artist_id, tag, since):
+    clauses = []
+    params = []
+
+    if query:
+        clauses.append(
+            """
+            illustrations.id IN (
+                SELECT rowid FROM illustrations_search
+                WHERE illustrations_search MATCH ?
+            )
+            """
+        )
+        params.append(query)
+    if artist_id is not None:
+        clauses.append("illustrations.artist_id = ?")
+        params.append(artist_id)
+    if tag:
+        clauses.append(
+            """
+            illustrations.id IN (
+                SELECT illustration FROM tags WHERE name = ?
+                UNION
+                SELECT illustration FROM tags WHERE translated_name = ?
+            )
+            """
+        )
+        params.extend([tag, tag])
+    if since:
+        clauses.append("illustrations.time >= datetime('now', ?)")
+        params.append(f"-{int(since.total_seconds())} seconds")
+
+    return " AND ".join(clauses) or "1", params
+
+
+def _query(sql, params):
+    with database() as (conn, cursor):
+        try:
+            cursor.execute(sql, params)
+        except sqlite3.OperationalError as e:
+            # Malformed full-text queries are only caught when they run.
+            raise PixiError(f"Invalid search query ({e}).")
+        return cursor.fetchall()
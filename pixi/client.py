@@ -1,12 +1,42 @@
-from math import ceil
+import hashlib
+import re
+import threading
+import time
+from json import JSONDecodeError
 
+from pixivapi import BadApiResponse
 from pixivapi import Client as BaseClient
-from pixivapi import LoginError
+from pixivapi import LoginError, User
+from requests import RequestException
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
-from pixi.config import Config
+from pixi.config import DEFAULT_CONFIG, Config, get_setting
 from pixi.errors import GoAuthenticate
-from pixi.util import rename_duplicate_file
+from pixi.failures import is_expired_token
+from pixi.layout import layout_template
+from pixi.progress import progress
+from pixi.ratelimit import THROTTLED_STATUSES, RateLimiter, retry_after
+from pixi.storage import (
+    HashingWriter,
+    dedupe_mode,
+    hash_file,
+    link_known_file,
+    new_hash,
+    store_file,
+)
+from pixi.timing import timings
+from pixi.util import move_into_place
+
+# The minimum number of seconds between progress bar updates of a download.
+PROGRESS_INTERVAL = 0.1
+
+# The methods of requests that are safe to retry.
+RETRY_METHODS = frozenset(["GET", "HEAD"])
+
+# Pixiv's access tokens last an hour. They are refreshed a few minutes early.
+ACCESS_TOKEN_LIFETIME = 3600
+ACCESS_TOKEN_MARGIN = 300
 
 
 class Client:
@@ -30,35 +60,325 @@ class _PixivClient(BaseClient):
 
     def __init__(self, authenticate=True):
         super().__init__()
+        self._auth_lock = threading.Lock()
+        self._config = None
+        self.access_token_expiry = None
 
-        if authenticate:
+        if not authenticate:
+            self._configure_session(DEFAULT_CONFIG)
+            self._configure_rate_limits(DEFAULT_CONFIG)
+        else:
             config = Config()
+            self._configure_session(config)
+            self._configure_rate_limits(config)
             if not config["pixi"]["refresh_token"]:
                 raise GoAuthenticate
 
+            self._config = config
+            if self._load_cached_token(config):
+                return
+
             try:
                 self.authenticate(config["pixi"]["refresh_token"])
             except LoginError:
                 raise GoAuthenticate
+            self.cache_token(config)
 
-    def download(self, url, destination, referer="https://pixiv.net"):
-        response = self.session.get(url, headers={"Referer": referer}, stream=True)
-        destination = rename_duplicate_file(destination)
+    def _configure_session(self, config):
+        """
+        Size the session's connection pools and retries, and read the download
+        settings: the chunk size, dedupe mode and layout.
+        """
+        self.chunk_size = get_setting(config, "chunk_size") * 1024
+        self.dedupe = dedupe_mode(config)
+        self.layout = layout_template(config)
 
-        try:
-            total = ceil(int(response.headers["Content-Length"]) / 16384)
-        except (KeyError, ValueError):
-            total = None
+        pool_size = get_setting(config, "pool_size")
+        retry = _retry(
+            get_setting(config, "max_retries"),
+            get_setting(config, "retry_backoff", float),
+        )
+
+        # Reconfigure the existing adapters rather than mounting new ones, as
+        # cloudscraper's adapter carries its own TLS settings.
+        for adapter in self.session.adapters.values():
+            adapter.max_retries = retry
+            adapter._pool_connections = pool_size
+            adapter._pool_maxsize = pool_size
+            adapter.init_poolmanager(pool_size, pool_size)
+
+    def _configure_rate_limits(self, config):
+        """
+        Create the rate limiters for the API and the image server. Every
+        request passes through one of them, including those of the async
+        engine.
+        """
+        self.max_retries = get_setting(config, "max_retries")
+        self.api_limiter = RateLimiter(
+            get_setting(config, "api_requests_per_second", float),
+            get_setting(config, "api_bytes_per_second", float),
+        )
+        self.image_limiter = RateLimiter(
+            get_setting(config, "image_requests_per_second", float),
+            get_setting(config, "image_bytes_per_second", float),
+        )
 
+    def _make_auth_request(self, data):
+        super()._make_auth_request(data)
+        self.access_token_expiry = time.time() + ACCESS_TOKEN_LIFETIME
+
+    def _load_cached_token(self, config):
+        """
+        Reuse the access token cached in the config, if it isn't about to
+        expire and was issued for the configured refresh token, instead of
+        authenticating again.
+        """
+        section = config["pixi"]
         try:
-            with destination.open("wb") as f:
-                for chunk in tqdm(
-                    iterable=response.iter_content(chunk_size=16384),
-                    total=total,
-                    unit="KB",
-                    unit_scale=True,
+            expiry = float(section.get("access_token_expiry"))
+            account_id = int(section.get("account_id"))
+        except (TypeError, ValueError):
+            return False
+
+        access_token = section.get("access_token")
+        if not access_token or expiry - ACCESS_TOKEN_MARGIN < time.time():
+            return False
+        if section.get("refresh_token_hash") != _hash_token(section["refresh_token"]):
+            return False
+
+        self.access_token = access_token
+        self.access_token_expiry = expiry
+        self.refresh_token = section["refresh_token"]
+        self.account = User(
+            account=section.get("account_name", ""),
+            id=account_id,
+            name=section.get("account_name", ""),
+            profile_image_urls={},
+        )
+        self.session.headers.update({"Authorization": f"Bearer {access_token}"})
+        return True
+
+    def cache_token(self, config):
+        """
+        Save the access token, its expiry and the account it belongs to in
+        the config, so that later runs can skip authenticating.
+        """
+        if not self.access_token or self.account is None:
+            return
+
+        section = config["pixi"]
+        section["access_token"] = self.access_token
+        section["access_token_expiry"] = str(int(self.access_token_expiry))
+        section["account_id"] = str(self.account.id)
+        section["account_name"] = self.account.account
+        # The access token was issued for the configured refresh token; if
+        # that is changed, it belongs to another account.
+        section["refresh_token_hash"] = _hash_token(section["refresh_token"])
+        config.save()
+
+    def reauthenticate(self, stale_token=None):
+        """
+        Refresh the access token in place with the refresh token. When
+        ``stale_token`` is given and another thread has already replaced it,
+        this does nothing.
+        """
+        with self._auth_lock:
+            if stale_token is not None and self.access_token != stale_token:
+                return
+            try:
+                self.authenticate(self.refresh_token)
+            except LoginError:
+                raise GoAuthenticate
+            if self._config is not None:
+                self.cache_token(self._config)
+
+    def _request_json(self, method, url, params=None, headers=None, data=None):
+        """
+        Make a rate limited API request, retrying throttled requests and
+        refreshing the access token when it expires.
+        """
+        throttled = 0
+        refreshed = False
+        while True:
+            self.api_limiter.wait()
+            token = self.access_token
+            if not refreshed and self._token_expiring():
+                self.reauthenticate(token)
+                refreshed = True
+                token = self.access_token
+            response = self.session.request(
+                method=method,
+                url=url,
+                params=params,
+                headers=headers,
+                data=data,
+            )
+
+            if response.status_code in THROTTLED_STATUSES:
+                self.api_limiter.throttled(retry_after(response.headers))
+                throttled += 1
+                if throttled <= self.max_retries:
+                    continue
+            else:
+                self.api_limiter.succeeded()
+                if not refreshed and is_expired_token(
+                    response.status_code, response.text
                 ):
-                    f.write(chunk)
-        except:  # noqa E722
-            destination.unlink()
-            raise
+                    self.reauthenticate(token)
+                    refreshed = True
+                    continue
+            break
+
+        self.api_limiter.wait_bytes(len(response.content))
+        if response.status_code // 100 == 4:
+            raise BadApiResponse(f"Status code: {response.status_code}", response.text)
+
+        try:
+            return response.json()
+        except JSONDecodeError as e:
+            raise BadApiResponse from e
+
+    def _token_expiring(self):
+        return (
+            self.access_token_expiry is not None
+            and self.access_token_expiry - ACCESS_TOKEN_MARGIN < time.time()
+        )
+
+    def download(self, url, destination, referer="https://pixiv.net"):
+        """
+        Download a file to ``destination``, or a free name next to it, through
+        a resumable ``.part`` file, and return the path it was saved to.
+        """
+        if self.dedupe:
+            linked = link_known_file(url, destination, self.dedupe)
+            if linked is not None:
+                return linked
+
+        partial = destination.with_name(f"{destination.name}.part")
+        offset = partial.stat().st_size if partial.exists() else 0
+
+        headers = {"Referer": referer}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        self.image_limiter.wait()
+        with timings.timer("connect"):
+            response = self.session.get(url, headers=headers, stream=True)
+
+        if response.status_code in THROTTLED_STATUSES:
+            # Leave the retry to the caller; it waits out the backoff first.
+            self.image_limiter.throttled(retry_after(response.headers))
+            response.close()
+            response.raise_for_status()
+        self.image_limiter.succeeded()
+
+        if offset and not is_resumed(response.status_code, response.headers, offset):
+            if response.status_code == 200:
+                # The server sent the whole file, so start over with it.
+                offset = 0
+            else:
+                response.close()
+                partial.unlink()
+                return self.download(url, destination, referer)
+
+        response.raise_for_status()
+
+        hash_ = None
+        if self.dedupe:
+            hash_ = hash_file(partial, new_hash()) if offset else new_hash()
+
+        length = _content_length(response)
+        with partial.open("ab" if offset else "wb") as f, tqdm(
+            total=length,
+            desc=destination.name,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            disable=not progress.bars,
+        ) as bar:
+            if hash_ is not None:
+                f = HashingWriter(f, hash_)
+            self._write_response(response, f, bar)
+
+        if length is not None and partial.stat().st_size != offset + length:
+            raise RequestException(f"Incomplete download of {url}.")
+
+        if hash_ is not None:
+            return store_file(partial, destination, url, hash_.hexdigest(), self.dedupe)
+
+        return move_into_place(partial, destination)
+
+    @timings.timed("transfer")
+    def _write_response(self, response, f, bar):
+        """
+        Stream the response body into ``f`` in chunks of ``chunk_size``
+        bytes, reporting progress at most every ``PROGRESS_INTERVAL`` seconds
+        rather than on every chunk.
+        """
+        unreported = 0
+        last_report = time.monotonic()
+
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            f.write(chunk)
+            self.image_limiter.wait_bytes(len(chunk))
+
+            unreported += len(chunk)
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                _report_bytes(bar, unreported)
+                unreported = 0
+                last_report = time.monotonic()
+
+        _report_bytes(bar, unreported)
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _report_bytes(bar, size):
+    bar.update(size)
+    progress.add_bytes(size)
+
+
+def _is_encoded(response):
+    return response.headers.get("Content-Encoding", "identity") != "identity"
+
+
+def _content_length(response):
+    """
+    Return the number of bytes the response body will write to disk, if the
+    server says so.
+    """
+    if _is_encoded(response):
+        return None
+
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry(total, backoff_factor):
+    kwargs = {
+        "total": total,
+        "backoff_factor": backoff_factor,
+        "status_forcelist": (500, 502, 503, 504),
+        "raise_on_status": False,
+    }
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 before 1.26 calls allowed_methods method_whitelist.
+        return Retry(method_whitelist=RETRY_METHODS, **kwargs)
+
+
+def is_resumed(status, headers, offset):
+    """
+    Check that the server answered a range request with the rest of the
+    file, starting at ``offset``. Shared with the async engine, so it takes
+    the response's status and headers rather than the response.
+    """
+    if status != 206:
+        return False
+
+    match = re.match(r"bytes (\d+)-", headers.get("Content-Range", ""))
+    return bool(match) and int(match.group(1)) == offset
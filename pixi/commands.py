@@ -1,5 +1,5 @@
-import sys
-from datetime import datetime
+import functools
+from contextlib import contextmanager
 from pathlib import Path
 
 import click
@@ -8,17 +8,71 @@ from requests import RequestException
 
 from pixi import commandgroup
 from pixi.client import Client
-from pixi.config import CONFIG_PATH, Config
-from pixi.database import calculate_migrations_needed, database
+from pixi.config import Config
 from pixi.errors import DownloadFailed, PixiError
+from pixi.layout import layout_template
 from pixi.options import (
     allow_duplicates,
     download_directory,
+    engine,
+    jobs,
     page,
+    parse_duration,
+    prefetch,
+    profile,
+    progress_mode,
+    quiet,
+    resume,
+    stats,
     track_download,
+    until_known,
     visibility,
 )
-from pixi.util import download_image, download_pages, parse_id, resolve_track_download
+from pixi.progress import progress
+from pixi.relayout import relayout as _relayout
+from pixi.retry import retry_failed as _retry_failed
+from pixi.sync import SyncState
+from pixi.timing import profiling, timings
+from pixi.util import (
+    download_illustrations,
+    download_image,
+    download_pages,
+    parse_id,
+    resolve_track_download,
+)
+
+
+def _reported(func):
+    """
+    Set up the progress reporting, timings and profiling that a download
+    command's options ask for, around the command.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, progress_mode, quiet, stats, profile, **kwargs):
+        with _reporting(progress_mode, quiet, stats, profile):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def _reporting(progress_mode, quiet, stats, profile):
+    """
+    Report the progress of a download run as asked, then its summary and, with
+    ``stats``, the latencies of each stage, even if the run is interrupted.
+    With ``profile``, the run is profiled to that file.
+    """
+    progress.configure(progress_mode, quiet)
+    timings.configure(stats)
+    try:
+        with profiling(profile):
+            yield
+    finally:
+        progress.finish()
+        if stats:
+            summary = timings.format_summary()
+            progress.event("timings", summary, stages=timings.summary())
 
 
 @commandgroup.command()
@@ -35,62 +89,61 @@ def auth(username, password):
 
     config = Config(validate=False)
     config["pixi"]["refresh_token"] = client.refresh_token
-    config.save()
+    # A login always sets the access token and account, so this also saves
+    # the refresh token.
+    client.cache_token(config)
 
     click.echo("Successfully authenticated; token written to config.")
 
 
-@commandgroup.command()
-def config():
-    """Edit the config file."""
-    with CONFIG_PATH.open("r+") as f:
-        text = click.edit(f.read())
-        if text:
-            f.seek(0)
-            f.truncate(0)
-            f.write(text)
-            click.echo("Edit completed.")
-        else:
-            click.echo("Edit aborted.")
-
-
-@commandgroup.command()
-def migrate():
-    """Upgrade the database to the latest migration."""
-    migrations_needed = calculate_migrations_needed()
-
-    if not migrations_needed:
-        click.echo("Database is up to date.")
-        sys.exit(1)
-
-    with database() as (conn, cursor):
-        for mig in migrations_needed:
-            with mig.path.open() as sql:
-                cursor.executescript(sql.read())
-                cursor.execute(
-                    "INSERT INTO versions (version) VALUES (?)",
-                    (mig.version,),
-                )
-            conn.commit()
-
-
 @commandgroup.command()
 @click.argument(
-    "illustration",
-    nargs=1,
-    callback=lambda ctx, param, value: (
-        parse_id(value, path="/member_illust.php", param="illust_id")
-    ),
+    "illustrations",
+    nargs=-1,
+    callback=lambda ctx, param, value: [_parse_illust_id(v) for v in value],
+)
+@click.option(
+    "--from-file",
+    "-f",
+    type=click.File("r"),
+    help="A file of more URLs or IDs, one per line. Pass - to read stdin.",
 )
 @download_directory
 @allow_duplicates
 @track_download
-def illust(illustration, directory, allow_duplicates, track):
-    """Download an illustration by URL or ID."""
+@jobs
+@progress_mode
+@quiet
+@stats
+@profile
+@_reported
+def illust(illustrations, from_file, directory, allow_duplicates, track, jobs):
+    """Download illustrations by URL or ID."""
+    if from_file:
+        illustrations += [_parse_illust_id(line) for line in from_file if line.strip()]
+    if not illustrations:
+        raise PixiError("No illustrations given.")
+
+    client = Client()
+    download_directory = Path(directory or Config()["pixi"]["download_directory"])
+    # Drop repeated IDs, keeping the order they were given in.
+    illustrations = list(dict.fromkeys(illustrations))
+
+    if len(illustrations) > 1:
+        download_illustrations(
+            client,
+            illustrations,
+            directory=download_directory,
+            allow_duplicates=allow_duplicates,
+            track_download=resolve_track_download(track, directory),
+            jobs=jobs,
+        )
+        return
+
     try:
         download_image(
-            Client().fetch_illustration(illustration),
-            directory=(Path(directory or Config()["pixi"]["download_directory"])),
+            client.fetch_illustration(illustrations[0]),
+            directory=download_directory,
             allow_duplicate=allow_duplicates,
             track_download=resolve_track_download(track, directory),
         )
@@ -98,6 +151,10 @@ def illust(illustration, directory, allow_duplicates, track):
         raise DownloadFailed from e
 
 
+def _parse_illust_id(value):
+    return parse_id(value.strip(), path="/member_illust.php", param="illust_id")
+
+
 @commandgroup.command()
 @click.argument(
     "artist",
@@ -110,23 +167,55 @@ def illust(illustration, directory, allow_duplicates, track):
 @download_directory
 @allow_duplicates
 @track_download
-def artist(artist, page, directory, allow_duplicates, track):
+@jobs
+@prefetch
+@until_known
+@resume
+@engine
+@progress_mode
+@quiet
+@stats
+@profile
+@_reported
+def artist(
+    artist,
+    page,
+    directory,
+    allow_duplicates,
+    track,
+    jobs,
+    prefetch,
+    until_known,
+    resume,
+    engine,
+):
     """Download illustrations of an artist by URL or ID."""
     client = Client()
+    sync = SyncState("artist", artist)
 
     def get_next_response(offset):
         return client.fetch_user_illustrations(artist, offset=offset)
 
+    starting_offset = (page - 1) * 30
+    if resume:
+        starting_offset, page = _resume_point(sync, page) or (starting_offset, page)
+
     download_pages(
         get_next_response,
-        starting_offset=(page - 1) * 30,
+        starting_offset=starting_offset,
         directory=(Path(directory or Config()["pixi"]["download_directory"])),
         allow_duplicates=allow_duplicates,
         track_download=resolve_track_download(track, directory),
         start_page=page,
+        jobs=jobs,
+        prefetch=prefetch,
+        until_known=until_known,
+        checkpoint=sync.page_done,
+        engine=engine,
     )
+    sync.finish()
 
-    click.echo(f"Finished downloading artist {artist}.")
+    progress.echo(f"Finished downloading artist {artist}.")
 
 
 @commandgroup.command()
@@ -148,7 +237,30 @@ def artist(artist, page, directory, allow_duplicates, track):
 @download_directory
 @allow_duplicates
 @track_download
-def bookmarks(user, tag, visibility, page, directory, allow_duplicates, track):
+@jobs
+@prefetch
+@until_known
+@resume
+@engine
+@progress_mode
+@quiet
+@stats
+@profile
+@_reported
+def bookmarks(
+    user,
+    tag,
+    visibility,
+    page,
+    directory,
+    allow_duplicates,
+    track,
+    jobs,
+    prefetch,
+    until_known,
+    resume,
+    engine,
+):
     """Download illustrations bookmarked by a user."""
     client = Client()
 
@@ -158,26 +270,53 @@ def bookmarks(user, tag, visibility, page, directory, allow_duplicates, track):
         visibilities = [Visibility.PUBLIC, Visibility.PRIVATE]
 
     for visi in visibilities:
-        click.echo(f"Downloading {visi.value} bookmarks.\n")
+        progress.echo(f"Downloading {visi.value} bookmarks.\n")
+        user_id = user or client.account.id
+        sync = SyncState("bookmarks", user_id, visi.value, tag)
 
         def get_next_response(offset):
             return client.fetch_user_bookmarks(
-                user_id=user or client.account.id,
+                user_id=user_id,
                 max_bookmark_id=offset,
                 visibility=visi,
                 tag=tag,
             )
 
+        resume_point = _resume_point(sync, page) if resume else None
+        if resume_point:
+            starting_offset, start_page = resume_point
+        else:
+            starting_offset = _get_starting_bookmark_offset(get_next_response, page)
+            start_page = page
+
         download_pages(
             get_next_response,
-            starting_offset=(_get_starting_bookmark_offset(get_next_response, page)),
+            starting_offset=starting_offset,
             directory=(Path(directory or Config()["pixi"]["download_directory"])),
             allow_duplicates=allow_duplicates,
             track_download=resolve_track_download(track, directory),
-            start_page=page,
+            start_page=start_page,
+            jobs=jobs,
+            prefetch=prefetch,
+            until_known=until_known,
+            checkpoint=sync.page_done,
+            engine=engine,
         )
+        sync.finish()
 
-    click.echo("Finished downloading bookmarks.")
+    progress.echo("Finished downloading bookmarks.")
+
+
+def _resume_point(sync, page):
+    if page != 1:
+        raise PixiError("--resume cannot be used with --page.")
+
+    resume_point = sync.resume_point()
+    if resume_point:
+        progress.echo(f"Resuming from page {resume_point[1]}.\n")
+    else:
+        progress.echo("Nothing to resume, starting from the first page.\n")
+    return resume_point
 
 
 def _get_starting_bookmark_offset(get_next_response, page):
@@ -187,52 +326,53 @@ def _get_starting_bookmark_offset(get_next_response, page):
     return max_bookmark_id
 
 
-@commandgroup.command()
-def failed():
-    """View illustrations that failed to download."""
-    with database() as (conn, cursor):
-        cursor.execute(
-            """
-            SELECT
-                id,
-                artist,
-                title,
-                time
-            FROM failed
-            ORDER BY time DESC
-            """
-        )
-        for row in cursor.fetchall():
-            time = datetime.fromisoformat(row["time"]).strftime("%b %d, %Y %H:%M:%S")
-            click.echo(f'{time} | {row["artist"]} - {row["title"]}')
-            click.echo(
-                "URL: https://www.pixiv.net/member_illust.php?mode=medium"
-                f'&illust_id={row["id"]}\n'
-            )
+@commandgroup.command(name="retry-failed")
+@click.option(
+    "--max-age",
+    "-m",
+    help="Only retry illustrations that first failed within this long, e.g. 7d.",
+    callback=lambda ctx, param, value: parse_duration(value) if value else None,
+)
+@download_directory
+@track_download
+@jobs
+@progress_mode
+@quiet
+@stats
+@profile
+@_reported
+def retry_failed(max_age, directory, track, jobs):
+    """Retry downloading the illustrations that failed."""
+    retried, still_failed = _retry_failed(
+        directory=(Path(directory or Config()["pixi"]["download_directory"])),
+        track_download=resolve_track_download(track, directory),
+        jobs=jobs,
+        max_age=max_age,
+    )
+    progress.echo(
+        f"Retried {retried} illustrations: {retried - still_failed} downloaded, "
+        f"{still_failed} still failed."
+    )
 
 
 @commandgroup.command()
 @click.option(
-    "--table",
-    "-t",
-    type=click.Choice(["downloaded", "failed", "all"]),
-    required=True,
-    help="The table to wipe.",
+    "--dry-run",
+    "-n",
+    is_flag=True,
+    default=False,
+    help="Print the moves without making them.",
 )
-def wipe(table):
-    """Wipe the saved history of downloaded illustrations."""
-    tables = ["downloaded", "failed"] if table == "all" else [table]
-    with database() as (conn, cursor):
-        for t in tables:
-            _confirm_table_wipe(t)
-            cursor.execute(f"DELETE FROM {t}")
-            click.echo(f"Wiped the {t} table.")
-        conn.commit()
-
-
-def _confirm_table_wipe(table):
-    confirmation = click.prompt(
-        f'Enter "{table}" to confirm that you wish to wipe {table}'
+@download_directory
+@jobs
+def relayout(dry_run, directory, jobs):
+    """Move downloaded illustrations into the configured layout."""
+    config = Config()
+    moved, missing = _relayout(
+        directory=Path(directory or config["pixi"]["download_directory"]),
+        layout=layout_template(config),
+        jobs=jobs,
+        dry_run=dry_run,
     )
-    if confirmation != table:
-        raise click.Abort
+    verb = "Would move" if dry_run else "Moved"
+    click.echo(f"{verb} {moved} illustrations; {missing} missing from disk.")
@@ -1,19 +1,36 @@
 import os
+import tempfile
 from configparser import ConfigParser
+from contextlib import contextmanager
 
 from pixi import CONFIG_DIR
 from pixi.errors import InvalidConfig
 
 CONFIG_PATH = CONFIG_DIR / "config.ini"
 
-DEFAULT_CONFIG = {"pixi": {"refresh_token": "", "download_directory": ""}}
+DEFAULT_CONFIG = {
+    "pixi": {
+        "refresh_token": "",
+        "download_directory": "",
+        "pool_size": "32",
+        "max_retries": "3",
+        "retry_backoff": "0.5",
+        "chunk_size": "1024",
+        "dedupe": "",
+        "layout": "",
+        "api_requests_per_second": "2",
+        "api_bytes_per_second": "0",
+        "image_requests_per_second": "10",
+        "image_bytes_per_second": "0",
+    }
+}
 
 
 def write_default_config():
     if not CONFIG_PATH.exists():
         parser = ConfigParser()
         parser.read_dict(DEFAULT_CONFIG)
-        with CONFIG_PATH.open("w") as f:
+        with _open_private(CONFIG_PATH) as f:
             parser.write(f)
 
 
@@ -41,10 +58,29 @@ def _load_config():
 
 
 def _save_config(parser):
-    with CONFIG_PATH.open("w") as f:
+    with _open_private(CONFIG_PATH) as f:
         parser.write(f)
 
 
+@contextmanager
+def _open_private(path):
+    """
+    Open a file for writing that only its owner can read, as the config
+    holds the refresh and access tokens. It is written under a temporary
+    name and then moved over ``path``, so that other processes never read a
+    half-written config.
+    """
+    # mkstemp creates the file readable only by its owner.
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            yield f
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
 def _validate_config(config):
     if not config:
         raise InvalidConfig("Empty file")
@@ -55,3 +91,15 @@ def _validate_config(config):
             raise InvalidConfig("Download directory does not exist or is not writeable")
     except KeyError:
         raise InvalidConfig("Download directory not configured")
+
+
+def get_setting(config, key, type_=int):
+    """
+    Read a tunable setting from the pixi section of the config, falling back
+    to its default when it isn't set.
+    """
+    value = config["pixi"].get(key) or DEFAULT_CONFIG["pixi"][key]
+    try:
+        return type_(value)
+    except (TypeError, ValueError):
+        raise InvalidConfig(f"{key} must be a number")
@@ -1,5 +1,8 @@
+import os
 import sqlite3
 import sys
+import threading
+import time
 from collections import namedtuple
 from contextlib import contextmanager
 from pathlib import Path
@@ -7,20 +10,168 @@ from pathlib import Path
 import click
 
 from pixi import DATA_DIR
+from pixi.timing import timings
 
 Migration = namedtuple("Migration", "path, version")
 
 DATABASE_PATH = DATA_DIR / "db.sqlite3"
 MIGRATIONS_DIR = Path(__file__).parent / "migrations"
 
+# The file next to the database that caches its checked schema version.
+SCHEMA_STAMP_NAME = "schema_version"
+
+# The number of seconds that batched writes may go uncommitted.
+BATCH_INTERVAL = 5
+
+_lock = threading.RLock()
+_connection = None
+_connection_path = None
+_batch_depth = 0
+_batch_deadline = None
+_block_depth = 0
+# The number of commits made so far, which tells a block whether its
+# savepoint was committed along with the rest of the batch.
+_commits = 0
+
 
 @contextmanager
 def database():
-    with sqlite3.connect(str(DATABASE_PATH)) as conn:
-        conn.row_factory = sqlite3.Row
+    """
+    Yield the process-wide database connection and a new cursor. The
+    connection is locked to the calling thread for the duration of the block.
+
+    Changes are committed when the block exits, or rolled back if it raises.
+    Inside ``batch_writes``, commits are deferred to the end of the batch
+    instead, and only ``commit_batch`` calls take effect at once. A block
+    that raises inside a batch still has its own changes rolled back, as
+    they are made in a savepoint of the batch's transaction.
+    """
+    global _block_depth
+
+    with timings.timer("database"), _lock:
+        conn = _connect()
         cursor = conn.cursor()
-        yield conn, cursor
-        cursor.close()
+        # Without an open transaction, the block's changes are all there is
+        # to roll back. A savepoint would commit on release if it started one.
+        savepoint = bool(_batch_depth) and conn.in_transaction
+        if savepoint:
+            conn.execute("SAVEPOINT block")
+        commits = _commits
+        _block_depth += 1
+        try:
+            yield conn, cursor
+        except BaseException:
+            if savepoint and commits == _commits:
+                conn.execute("ROLLBACK TO block")
+                conn.execute("RELEASE block")
+            else:
+                conn.rollback()
+            raise
+        else:
+            if savepoint and commits == _commits:
+                conn.execute("RELEASE block")
+            if not _batch_depth:
+                _commit(conn)
+            elif _block_depth == 1 and time.monotonic() >= _batch_deadline:
+                # Not from a nested block, which would commit part of the
+                # block around it.
+                commit_batch()
+        finally:
+            _block_depth -= 1
+            cursor.close()
+
+
+@contextmanager
+def batch_writes():
+    """
+    Group the writes of all ``database`` blocks run in this context into
+    larger transactions, committed every ``BATCH_INTERVAL`` seconds, on each
+    ``commit_batch`` call, and when the context exits (even on an error).
+    """
+    global _batch_depth, _batch_deadline
+
+    with _lock:
+        if not _batch_depth:
+            _batch_deadline = time.monotonic() + BATCH_INTERVAL
+        _batch_depth += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _batch_depth -= 1
+            if not _batch_depth and _connection is not None:
+                _commit(_connection)
+
+
+def commit_batch():
+    global _batch_deadline
+
+    with _lock:
+        if _connection is not None:
+            _commit(_connection)
+        _batch_deadline = time.monotonic() + BATCH_INTERVAL
+
+
+@timings.timed("commit")
+def _commit(conn):
+    global _commits
+
+    conn.commit()
+    _commits += 1
+
+
+def close_database():
+    global _connection, _connection_path
+
+    with _lock:
+        if _connection is not None:
+            _connection.commit()
+            _connection.close()
+        _connection = None
+        _connection_path = None
+
+
+def _connect():
+    """
+    Return the shared connection, (re)opening it if it isn't open to the
+    current database path. Write-ahead logging lets a commit append to the log
+    without an fsync, while keeping committed transactions safe if pixi
+    crashes.
+    """
+    global _connection, _connection_path
+
+    if _connection is None or _connection_path != DATABASE_PATH:
+        if _connection is not None:
+            _connection.close()
+        _connection = sqlite3.connect(str(DATABASE_PATH), check_same_thread=False)
+        _connection.row_factory = sqlite3.Row
+        _connection.execute("PRAGMA journal_mode = WAL")
+        _connection.execute("PRAGMA synchronous = NORMAL")
+        _connection_path = DATABASE_PATH
+
+    return _connection
+
+
+def check_database():
+    """
+    Create the database if it doesn't exist and exit if it needs migrating.
+
+    Once the database is found to be up to date, that is cached in a stamp
+    file of the latest migration's version and the database file's inode,
+    so later runs can skip opening the database while neither changes.
+    """
+    stamp_path = DATABASE_PATH.with_name(SCHEMA_STAMP_NAME)
+    stamp = _schema_stamp()
+    try:
+        if stamp and stamp_path.read_text() == stamp:
+            return
+    except OSError:
+        pass
+
+    create_database_if_nonexistent()
+    confirm_database_is_updated()
+    if _get_version() >= _latest_migration():
+        stamp_path.write_text(_schema_stamp())
 
 
 def create_database_if_nonexistent():
@@ -73,6 +224,24 @@ def _find_migrations():
     return migrations
 
 
+def _latest_migration():
+    """Return the version of the newest migration, without globbing."""
+    versions = [
+        int(name[:-4])
+        for name in os.listdir(MIGRATIONS_DIR)
+        if name.endswith(".sql") and name[:-4].isdigit()
+    ]
+    return max(versions, default=0)
+
+
+def _schema_stamp():
+    try:
+        inode = os.stat(DATABASE_PATH).st_ino
+    except OSError:
+        return None
+    return f"{_latest_migration()} {inode}"
+
+
 def _get_version():
     with database() as (conn, cursor):
         cursor.execute("SELECT MAX(version) FROM versions")
@@ -0,0 +1,411 @@
+"""
+An asyncio download engine, selected with ``--engine async``. It keeps many
+transfers in flight on one event loop instead of a thread per download.
+
+pixiv-api's API client is blocking, so pages are fetched in a background
+thread and awaited from the loop. Images are streamed with aiohttp, and all
+database bookkeeping runs on one dedicated writer thread.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from pixivapi import Size
+
+from pixi.client import Client, is_resumed
+from pixi.database import batch_writes, commit_batch
+from pixi.errors import PixiError
+from pixi.failures import AUTH, PERMANENT, backoff_delay, classify
+from pixi.layout import illustration_path
+from pixi.progress import progress
+from pixi.ratelimit import THROTTLED_STATUSES, retry_after
+from pixi.storage import HashingWriter, hash_file, link_known_file, new_hash, store_file
+from pixi.timing import timings
+from pixi.util import (
+    RETRY_BACKOFF,
+    DuplicateFilter,
+    _referer,
+    clear_failed,
+    discard_partial_files,
+    mark_failed,
+    move_into_place,
+    record_finished,
+    report_failed,
+    report_finished,
+    report_retry,
+    report_started,
+)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+# The number of times to try downloading an illustration.
+TRIES = 3
+
+
+def download_pages_async(
+    get_next_response,
+    starting_offset,
+    directory,
+    allow_duplicates=False,
+    track_download=True,
+    start_page=1,
+    jobs=1,
+    prefetch=1,
+    until_known=None,
+    checkpoint=None,
+):
+    """
+    The asyncio counterpart of ``pixi.util.download_pages``, taking the same
+    arguments. ``jobs`` limits the number of transfers in flight.
+    """
+    if aiohttp is None:
+        raise PixiError("The async engine requires aiohttp. Install pixi[async].")
+
+    duplicates = None
+    if not allow_duplicates:
+        duplicates = DuplicateFilter(track_download, until_known)
+
+    engine = AsyncEngine(Client(), directory, track_download=track_download, jobs=jobs)
+    with batch_writes():
+        asyncio.run(
+            engine.run(
+                get_next_response,
+                starting_offset,
+                start_page=start_page,
+                prefetch=prefetch,
+                duplicates=duplicates,
+                checkpoint=checkpoint,
+            )
+        )
+
+
+class AsyncEngine:
+    """
+    Downloads pages of illustrations as coroutines. Page fetches, transfers
+    and bookkeeping overlap, with at most ``jobs`` transfers in flight and
+    at most ``jobs`` more illustrations queued behind them.
+    """
+
+    def __init__(self, client, directory, track_download=True, jobs=1):
+        self.client = client
+        self.directory = directory
+        self.track_download = track_download
+        self.jobs = jobs
+        self.chunk_size = getattr(client, "chunk_size", 2**20)
+
+        self._api = ThreadPoolExecutor(max_workers=1)
+        self._writer = ThreadPoolExecutor(max_workers=1)
+
+    async def run(
+        self,
+        get_next_response,
+        starting_offset,
+        start_page=1,
+        prefetch=1,
+        duplicates=None,
+        checkpoint=None,
+    ):
+        self._transfers = asyncio.Semaphore(self.jobs)
+        self._queued = asyncio.Semaphore(self.jobs * 2)
+        self._pending = set()
+        last_checkpoint = None
+
+        pages = asyncio.Queue()
+        # The pages the fetcher may fetch: the first, and ``prefetch`` ahead
+        # of the one being worked on.
+        wanted = asyncio.Semaphore(prefetch + 1)
+        fetcher = asyncio.ensure_future(
+            self._fetch_pages(get_next_response, starting_offset, pages, wanted)
+        )
+
+        try:
+            # The access token is left out, as it is refreshed as the run goes
+            # on; ``download`` sends the current one with each request.
+            headers = dict(self.client.session.headers)
+            headers.pop("Authorization", None)
+            async with aiohttp.ClientSession(
+                headers=headers,
+                connector=aiohttp.TCPConnector(limit=self.jobs),
+            ) as http:
+                page = start_page
+                while True:
+                    response = await pages.get()
+                    if isinstance(response, BaseException):
+                        raise response
+                    if page == start_page and not response["illustrations"]:
+                        raise PixiError("No illustrations found.")
+
+                    if page != start_page:
+                        await self._write(commit_batch)
+                    progress.event(
+                        "page",
+                        f"Downloading page {page} of illustrations.\n",
+                        page=page,
+                        illustrations=len(response["illustrations"]),
+                    )
+
+                    tasks = await self._queue_page(http, response, duplicates)
+                    if checkpoint:
+                        last_checkpoint = asyncio.ensure_future(
+                            self._checkpoint(
+                                last_checkpoint, tasks, checkpoint, page, response
+                            )
+                        )
+
+                    if duplicates and duplicates.caught_up:
+                        progress.echo(
+                            f"Found {duplicates.until_known} previously "
+                            "downloaded illustrations in a row, stopping."
+                        )
+                        break
+                    if not response["next"]:
+                        break
+                    page += 1
+                    wanted.release()
+
+                await self._drain(last_checkpoint)
+        finally:
+            fetcher.cancel()
+            for task in self._pending:
+                task.cancel()
+            self._api.shutdown(wait=False)
+            self._writer.shutdown(wait=True)
+
+    async def _fetch_pages(self, get_next_response, cursor, pages, wanted):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                await wanted.acquire()
+                response = await loop.run_in_executor(
+                    self._api, get_next_response, cursor
+                )
+                await pages.put(response)
+                cursor = response["next"]
+                if not cursor:
+                    return
+        except Exception as e:
+            await pages.put(e)
+
+    async def _queue_page(self, http, response, duplicates):
+        illustrations = response["illustrations"]
+        if duplicates:
+            illustrations = await self._write(list, duplicates.filter(illustrations))
+
+        tasks = []
+        for illustration in illustrations:
+            await self._queued.acquire()
+            progress.count("queued")
+            task = asyncio.ensure_future(self.download_image(http, illustration))
+            task.add_done_callback(self._task_done)
+            self._pending.add(task)
+            tasks.append(task)
+        return tasks
+
+    def _task_done(self, task):
+        self._queued.release()
+        if task.cancelled() or task.exception() is None:
+            self._pending.discard(task)
+
+    async def _checkpoint(self, last_checkpoint, tasks, checkpoint, page, response):
+        if last_checkpoint:
+            await last_checkpoint
+        await asyncio.gather(*tasks)
+        await self._write(checkpoint, page, response)
+
+    async def _drain(self, last_checkpoint):
+        while self._pending:
+            await asyncio.gather(*self._pending)
+        if last_checkpoint:
+            await last_checkpoint
+
+    @timings.timed("illustration")
+    async def download_image(self, http, illustration):
+        """
+        Download an illustration with the same retries and bookkeeping as
+        ``pixi.util.download_image``.
+        """
+        path = illustration_path(illustration, self.client.layout)
+        directory = self.directory / path.parent
+        referer = _referer(illustration)
+        finished = set()
+
+        report_started(illustration)
+        started = time.monotonic()
+        for attempt in range(TRIES):
+            token = self.client.access_token
+            try:
+                if illustration.meta_pages:
+                    destination = directory / path.name
+                    await self._download_meta_pages(
+                        http, illustration, destination, referer, finished
+                    )
+                else:
+                    url = illustration.image_urls[Size.ORIGINAL]
+                    ext = os.path.splitext(url)[1]
+                    directory.mkdir(parents=True, exist_ok=True)
+                    destination = await self.download(
+                        http, url, directory / f"{path.name}{ext}", referer
+                    )
+
+                await self._write(clear_failed, illustration.id)
+                if self.track_download:
+                    await self._write(record_finished, illustration, destination)
+                report_finished(
+                    illustration,
+                    destination,
+                    started,
+                    f"Finished downloading illustration {illustration.id}. "
+                    f"{illustration.title}.",
+                )
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                failure = classify(e)
+                error = str(e)
+                if failure.kind == PERMANENT:
+                    progress.echo(
+                        f"Failed to download illustration {illustration.id}. "
+                        f"{illustration.title} ({e}). Not retrying."
+                    )
+                    break
+
+                report_retry(illustration, attempt, failure, e)
+                if failure.kind == AUTH:
+                    loop = asyncio.get_event_loop()
+                    await loop.run_in_executor(
+                        self._api, self.client.reauthenticate, token
+                    )
+                elif attempt + 1 < TRIES:
+                    await asyncio.sleep(backoff_delay(attempt, RETRY_BACKOFF))
+
+        report_failed(
+            illustration,
+            failure,
+            error,
+            started,
+            f"Failed to download image {illustration.id}. "
+            f"{illustration.title} ({failure.reason}). Skipping...",
+        )
+        discard_partial_files(illustration, self.directory, self.client.layout)
+        await self._write(mark_failed, illustration, failure.reason, error)
+
+    async def _download_meta_pages(
+        self, http, illustration, illust_dir, referer, finished
+    ):
+        illust_dir.mkdir(parents=True, exist_ok=True)
+
+        async def download_page(url):
+            destination = illust_dir / url.split("/")[-1]
+            await self.download(http, url, destination, referer)
+            finished.add(url)
+
+        urls = [page[Size.ORIGINAL] for page in illustration.meta_pages]
+        results = await asyncio.gather(
+            *[download_page(url) for url in urls if url not in finished],
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def download(self, http, url, destination, referer):
+        """
+        Stream a file to ``destination`` like ``_PixivClient.download``: into
+        a ``.part`` file that's kept on failure and resumed with a range
+        request on the next attempt, and stored by content with ``dedupe``.
+        Return the path the file was saved to.
+        """
+        dedupe = self.client.dedupe
+        if dedupe:
+            linked = await self._write(link_known_file, url, destination, dedupe)
+            if linked is not None:
+                return linked
+
+        partial = destination.with_name(f"{destination.name}.part")
+        offset = partial.stat().st_size if partial.exists() else 0
+
+        limiter = self.client.image_limiter
+        await asyncio.sleep(limiter.delay())
+
+        headers = self._headers(referer, offset)
+        async with self._transfers, self._get(http, url, headers) as response:
+            if response.status in THROTTLED_STATUSES:
+                limiter.throttled(retry_after(response.headers))
+                response.raise_for_status()
+            limiter.succeeded()
+
+            if offset and not is_resumed(response.status, response.headers, offset):
+                if response.status != 200:
+                    partial.unlink()
+                    raise aiohttp.ClientError(f"Could not resume download of {url}.")
+                offset = 0
+
+            response.raise_for_status()
+            hash_ = await self._start_hash(partial, offset) if dedupe else None
+
+            size = offset
+            with timings.timer("transfer"), partial.open("ab" if offset else "wb") as f:
+                if hash_ is not None:
+                    f = HashingWriter(f, hash_)
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                    progress.add_bytes(len(chunk))
+                    delay = limiter.delay_bytes(len(chunk))
+                    if delay:
+                        await asyncio.sleep(delay)
+
+            length = response.content_length
+            if "Content-Encoding" not in response.headers and length is not None:
+                if size != offset + length:
+                    raise aiohttp.ClientPayloadError(f"Incomplete download of {url}.")
+
+        return await self._store(partial, destination, url, hash_)
+
+    def _headers(self, referer, offset):
+        """
+        Return the headers of an image request, with the client's current
+        access token, which may have been refreshed since the last request.
+        """
+        headers = {"Referer": referer}
+        authorization = self.client.session.headers.get("Authorization")
+        if authorization:
+            headers["Authorization"] = authorization
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        return headers
+
+    async def _store(self, partial, destination, url, hash_):
+        """Move a finished download into place, returning its final path."""
+        if hash_ is not None:
+            digest = hash_.hexdigest()
+            dedupe = self.client.dedupe
+            return await self._write(
+                store_file, partial, destination, url, digest, dedupe
+            )
+
+        return move_into_place(partial, destination)
+
+    @asynccontextmanager
+    async def _get(self, http, url, headers):
+        """Send a request, timing how long its response takes to start."""
+        with timings.timer("connect"):
+            response = await http.get(url, headers=headers)
+        async with response:
+            yield response
+
+    async def _start_hash(self, partial, offset):
+        if not offset:
+            return new_hash()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, hash_file, partial, new_hash())
+
+    async def _write(self, func, *args):
+        """Run a bookkeeping function on the dedicated database thread."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._writer, func, *args)
@@ -0,0 +1,79 @@
+import asyncio
+import random
+import re
+from collections import namedtuple
+
+from pixivapi import BadApiResponse
+from requests import ConnectionError, HTTPError, Timeout
+
+from pixi.ratelimit import THROTTLED_STATUSES
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+AUTH = "auth"
+
+Failure = namedtuple("Failure", "kind, reason")
+
+# The ceiling in seconds of the backoff before each retry of a transient
+# failure, which doubles on each retry.
+MAX_RETRY_BACKOFF = 60
+
+
+def classify(exception):
+    """
+    Sort a download error into a ``Failure`` of a kind (permanent, transient
+    or auth) and a short reason code, which is recorded in the failed table.
+    """
+    status = _status_code(exception)
+
+    if status == 401 or _is_expired_token(exception, status):
+        return Failure(AUTH, "auth_expired")
+    if status in THROTTLED_STATUSES:
+        return Failure(TRANSIENT, "throttled")
+    if status in (404, 410):
+        return Failure(PERMANENT, "not_found")
+    if status is not None and 400 <= status < 500:
+        return Failure(PERMANENT, f"http_{status}")
+    if status is not None:
+        return Failure(TRANSIENT, "server_error")
+
+    if isinstance(exception, (Timeout, asyncio.TimeoutError)):
+        return Failure(TRANSIENT, "timeout")
+    if isinstance(exception, ConnectionError):
+        return Failure(TRANSIENT, "connection_error")
+    if isinstance(exception, BadApiResponse):
+        return Failure(TRANSIENT, "bad_response")
+    return Failure(TRANSIENT, "network_error")
+
+
+def is_expired_token(status, text):
+    """Check whether an API response rejected an expired access token."""
+    return status == 400 and "invalid_grant" in (text or "")
+
+
+def backoff_delay(attempt, base):
+    """
+    Return the seconds to wait before retry number ``attempt`` (counting from
+    zero): exponential in the attempt, with jitter over its upper half.
+    """
+    delay = min(base * 2**attempt, MAX_RETRY_BACKOFF)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _status_code(exception):
+    if isinstance(exception, HTTPError) and exception.response is not None:
+        return exception.response.status_code
+
+    if isinstance(exception, BadApiResponse) and exception.args:
+        match = re.match(r"Status code: (\d+)", str(exception.args[0]))
+        return int(match.group(1)) if match else None
+
+    # aiohttp's ClientResponseError.
+    status = getattr(exception, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def _is_expired_token(exception, status):
+    if not isinstance(exception, BadApiResponse) or len(exception.args) < 2:
+        return False
+    return is_expired_token(status, str(exception.args[1]))
@@ -0,0 +1,87 @@
+import os
+import threading
+from pathlib import Path
+
+
+class FilenameAllocator:
+    """
+    Hands out free file names, numbering collisions ``name (1).ext``,
+    ``name (2).ext`` and so on.
+
+    Each directory is listed once and its names are cached, along with the
+    next number to try for each colliding name, so that allocating a name
+    takes a constant number of steps rather than a stat call per taken name.
+    A name is claimed by creating an empty file at it with ``O_EXCL``, so
+    two threads or processes can never be handed the same name; the caller
+    then replaces the empty file with the real one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taken = {}
+        self._next_number = {}
+
+    def allocate(self, path):
+        path = Path(path)
+        directory = os.path.abspath(path.parent)
+
+        with self._lock:
+            taken = self._listing(directory)
+            for name in self._candidates(directory, path.name, taken):
+                try:
+                    fd = os.open(
+                        os.path.join(directory, name),
+                        os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                        0o644,
+                    )
+                except FileExistsError:
+                    # Created by someone else since the directory was listed.
+                    taken.add(name)
+                    continue
+                os.close(fd)
+                taken.add(name)
+                return path.with_name(name)
+
+    def release(self, path):
+        """
+        Give back a name handed out by ``allocate`` that won't be used, once
+        the empty file claiming it has been removed.
+        """
+        path = Path(path)
+        with self._lock:
+            taken = self._taken.get(os.path.abspath(path.parent))
+            if taken is not None:
+                taken.discard(path.name)
+
+    def forget(self, directory=None):
+        """Drop the cached listing of ``directory``, or of every directory."""
+        with self._lock:
+            if directory is None:
+                self._taken.clear()
+                self._next_number.clear()
+            else:
+                directory = os.path.abspath(directory)
+                self._taken.pop(directory, None)
+                self._next_number.pop(directory, None)
+
+    def _listing(self, directory):
+        if directory not in self._taken:
+            try:
+                self._taken[directory] = set(os.listdir(directory))
+            except FileNotFoundError:
+                self._taken[directory] = set()
+            self._next_number[directory] = {}
+        return self._taken[directory]
+
+    def _candidates(self, directory, filename, taken):
+        if filename not in taken:
+            yield filename
+
+        stem, ext = os.path.splitext(filename)
+        numbers = self._next_number[directory]
+        while True:
+            number = numbers.get(filename, 1)
+            numbers[filename] = number + 1
+            candidate = f"{stem} ({number}){ext}"
+            if candidate not in taken:
+                yield candidate
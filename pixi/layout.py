@@ -0,0 +1,97 @@
+import re
+from pathlib import Path
+from string import Formatter
+
+from pixi.errors import InvalidConfig
+
+# Where an illustration is saved under the download directory, as a template
+# of "/"-separated components. The last component is the file name (without
+# its extension), or the folder name of a multi-page illustration.
+DEFAULT_LAYOUT = "{id}. {title}"
+
+# Matches the names the default layout gives illustrations, capturing the ID
+# and the rest of the name.
+DEFAULT_NAME = re.compile(r"(?P<id>\d+)\. (?P<title>.*)")
+
+# The fields a layout can use. ``shard`` is the last three digits of the ID,
+# which spreads illustrations evenly over a thousand folders.
+LAYOUT_FIELDS = ("id", "title", "artist_id", "shard")
+
+# What each field of a layout matches in the names it gives illustrations.
+FIELD_PATTERNS = {
+    "id": r"(?P<id>\d+)",
+    "title": r"(?P<title>.*)",
+    "artist_id": r".*",
+    "shard": r"\d{3}",
+}
+
+
+def layout_template(config):
+    """Read the layout template from the config, defaulting to a flat layout."""
+    layout = config["pixi"].get("layout") or DEFAULT_LAYOUT
+    check_layout(layout)
+    return layout
+
+
+def check_layout(layout):
+    try:
+        fields = layout_fields(layout)
+    except ValueError:
+        raise InvalidConfig("layout is not a valid template")
+
+    unknown = fields - set(LAYOUT_FIELDS)
+    if unknown:
+        raise InvalidConfig(f"layout has unknown fields: {', '.join(sorted(unknown))}")
+    if layout.startswith("/"):
+        raise InvalidConfig("layout must be relative to the download directory")
+    # Keeping the ID first in the name keeps every file identifiable.
+    if not layout.split("/")[-1].startswith("{id}"):
+        raise InvalidConfig("layout's file name must start with {id}")
+
+
+def layout_fields(layout):
+    """Return the names of the fields a layout template uses."""
+    return {field for _, field, _, _ in Formatter().parse(layout) if field is not None}
+
+
+def format_path(layout, id_, title, artist_id=None):
+    """
+    Fill in a layout template for an illustration, returning its path
+    relative to the download directory, without the file extension.
+    """
+    fields = {
+        "id": id_,
+        "title": title,
+        "artist_id": artist_id,
+        "shard": f"{id_ % 1000:03d}",
+    }
+    return Path(*[sanitize(part.format(**fields)) for part in layout.split("/")])
+
+
+def name_pattern(layout):
+    """
+    Return a regex that matches the names a layout gives illustrations (its
+    last component), capturing the ``id`` and, if the name has one, the
+    ``title``.
+    """
+    pattern = ""
+    seen = set()
+    for literal, field, _, _ in Formatter().parse(layout.split("/")[-1]):
+        pattern += re.escape(literal)
+        if field is not None:
+            # A field used twice can't capture twice.
+            pattern += r".*" if field in seen else FIELD_PATTERNS[field]
+            seen.add(field)
+    return re.compile(pattern)
+
+
+def illustration_path(illustration, layout):
+    return format_path(
+        layout, illustration.id, illustration.title, illustration.user.id
+    )
+
+
+def sanitize(name):
+    """Make a string safe to use as a single path component."""
+    name = re.sub(r'[:\?<>\\*\|"\/]', "_", name)
+    return "_" if name in ("", ".", "..") else name
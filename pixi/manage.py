@@ -0,0 +1,189 @@
+import sys
+from datetime import datetime
+
+import click
+
+from pixi import catalog, commandgroup
+from pixi.config import CONFIG_PATH, Config
+from pixi.database import calculate_migrations_needed, database
+from pixi.layout import DEFAULT_LAYOUT, layout_template
+from pixi.options import parse_duration
+from pixi.reindex import reindex as _reindex
+
+
+@commandgroup.command()
+def config():
+    """Edit the config file."""
+    with CONFIG_PATH.open("r+") as f:
+        text = click.edit(f.read())
+        if text:
+            f.seek(0)
+            f.truncate(0)
+            f.write(text)
+            click.echo("Edit completed.")
+        else:
+            click.echo("Edit aborted.")
+
+
+@commandgroup.command()
+def migrate():
+    """Upgrade the database to the latest migration."""
+    migrations_needed = calculate_migrations_needed()
+
+    if not migrations_needed:
+        click.echo("Database is up to date.")
+        sys.exit(1)
+
+    with database() as (conn, cursor):
+        for mig in migrations_needed:
+            with mig.path.open() as sql:
+                cursor.executescript(sql.read())
+                cursor.execute(
+                    "INSERT INTO versions (version) VALUES (?)",
+                    (mig.version,),
+                )
+            conn.commit()
+
+
+@commandgroup.command()
+def failed():
+    """View illustrations that failed to download."""
+    with database() as (conn, cursor):
+        cursor.execute(
+            """
+            SELECT
+                id,
+                artist,
+                title,
+                reason,
+                attempts,
+                time
+            FROM failed
+            ORDER BY time DESC
+            """
+        )
+        for row in cursor.fetchall():
+            time = datetime.fromisoformat(row["time"]).strftime("%b %d, %Y %H:%M:%S")
+            click.echo(f'{time} | {row["artist"]} - {row["title"]}')
+            if row["reason"]:
+                click.echo(f'Reason: {row["reason"]} ({row["attempts"]} attempts)')
+            click.echo(
+                "URL: https://www.pixiv.net/member_illust.php?mode=medium"
+                f'&illust_id={row["id"]}\n'
+            )
+
+
+@commandgroup.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=8,
+    help="Number of folders to scan at once.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    default=False,
+    help=(
+        "Delete the rows of illustrations missing from the directory. Refused "
+        "if any file in it isn't named like an illustration."
+    ),
+)
+def reindex(directory, jobs, prune):
+    """Record the illustrations in a directory as downloaded."""
+    config = Config(validate=False)
+    layout = layout_template(config) if config.has_section("pixi") else DEFAULT_LAYOUT
+    result = _reindex(directory, jobs=jobs, prune=prune, layout=layout)
+    click.echo(
+        f"Found {result.found} illustrations: {result.added} added, "
+        f"{result.moved} moved."
+    )
+    if not result.orphans:
+        return
+
+    for id_, path in result.orphans:
+        click.echo(f"Missing illustration {id_} (recorded at {path}).")
+    if prune:
+        click.echo(f"Deleted {len(result.orphans)} orphaned rows.")
+    else:
+        click.echo(
+            f"{len(result.orphans)} orphaned rows; run with --prune to delete them."
+        )
+
+
+@commandgroup.command()
+@click.argument("query", required=False)
+@click.option("--artist", "-r", type=int, help="Only illustrations by this artist ID.")
+@click.option("--tag", "-g", help="Only illustrations with this tag.")
+@click.option(
+    "--since",
+    "-s",
+    help="Only illustrations downloaded within this long, e.g. 7d.",
+    callback=lambda ctx, param, value: parse_duration(value) if value else None,
+)
+@click.option(
+    "--count",
+    "-c",
+    type=click.Choice(catalog.COUNT_BY),
+    help="Count the matches by artist or tag instead of listing them.",
+)
+@click.option(
+    "--limit",
+    "-l",
+    type=click.IntRange(min=1),
+    default=50,
+    help="The most results to show.",
+)
+def search(query, artist, tag, since, count, limit):
+    """Search the catalog of downloaded illustrations."""
+    filters = {"query": query, "artist_id": artist, "tag": tag, "since": since}
+
+    if count:
+        for row in catalog.count(count, limit=limit, **filters):
+            size = _format_size(row["size"]) if row["size"] is not None else ""
+            click.echo(f'{row["illustrations"]:>7}  {size:>9}  {row["name"]}')
+        return
+
+    for row in catalog.search(limit=limit, **filters):
+        click.echo(
+            f'{row["id"]}. {row["title"]} | {row["artist"]} ({row["artist_id"]}) '
+            f'| {row["page_count"]} pages, {row["width"]}x{row["height"]}'
+        )
+        click.echo(f'Path: {row["path"]}\n')
+
+
+def _format_size(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+@commandgroup.command()
+@click.option(
+    "--table",
+    "-t",
+    type=click.Choice(["downloaded", "failed", "all"]),
+    required=True,
+    help="The table to wipe.",
+)
+def wipe(table):
+    """Wipe the saved history of downloaded illustrations."""
+    tables = ["downloaded", "failed"] if table == "all" else [table]
+    with database() as (conn, cursor):
+        for t in tables:
+            _confirm_table_wipe(t)
+            cursor.execute(f"DELETE FROM {t}")
+            click.echo(f"Wiped the {t} table.")
+        conn.commit()
+
+
+def _confirm_table_wipe(table):
+    confirmation = click.prompt(
+        f'Enter "{table}" to confirm that you wish to wipe {table}'
+    )
+    if confirmation != table:
+        raise click.Abort
@@ -0,0 +1,11 @@
+CREATE TABLE sync_state (
+    source TEXT NOT NULL,
+    user INTEGER NOT NULL,
+    visibility TEXT NOT NULL DEFAULT '',
+    tag TEXT NOT NULL DEFAULT '',
+    cursor INTEGER,
+    page INTEGER NOT NULL DEFAULT 1,
+    newest_id INTEGER,
+    time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source, user, visibility, tag)
+);
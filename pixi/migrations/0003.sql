@@ -0,0 +1 @@
+ALTER TABLE failed ADD COLUMN reason TEXT;
@@ -0,0 +1,3 @@
+ALTER TABLE failed ADD COLUMN attempts INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE failed ADD COLUMN last_error TEXT;
+ALTER TABLE failed ADD COLUMN last_attempt TIMESTAMP;
@@ -0,0 +1,11 @@
+CREATE TABLE files (
+    path TEXT NOT NULL,
+    url TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (path)
+);
+
+CREATE INDEX files_hash ON files (hash);
+CREATE INDEX files_url ON files (url);
@@ -0,0 +1,2 @@
+ALTER TABLE downloaded ADD COLUMN title TEXT;
+ALTER TABLE downloaded ADD COLUMN artist_id INTEGER;
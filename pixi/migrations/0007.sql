@@ -0,0 +1,30 @@
+CREATE TABLE illustrations (
+    id INTEGER,
+    artist_id INTEGER NOT NULL,
+    artist TEXT,
+    title TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    created TIMESTAMP,
+    size INTEGER,
+    time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id)
+);
+
+-- Covers counting illustrations and their size by artist.
+CREATE INDEX illustrations_artist_id ON illustrations (artist_id, artist, size);
+CREATE INDEX illustrations_created ON illustrations (created);
+CREATE INDEX illustrations_time ON illustrations (time);
+
+CREATE TABLE tags (
+    illustration INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    translated_name TEXT,
+    PRIMARY KEY (illustration, name)
+) WITHOUT ROWID;
+
+CREATE INDEX tags_name ON tags (name);
+CREATE INDEX tags_translated_name ON tags (translated_name);
+
+CREATE VIRTUAL TABLE illustrations_search USING fts5(title, tags);
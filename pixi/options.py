@@ -1,7 +1,24 @@
 import functools
+import re
+from datetime import timedelta
 
 import click
 
+from pixi.errors import PixiError
+
+# Each prefetched page holds up to 30 illustrations' metadata in memory.
+MAX_PREFETCH = 10
+
+
+def parse_duration(string):
+    """Parse a duration like ``90``, ``30m``, ``12h`` or ``7d`` into a timedelta."""
+    match = re.fullmatch(r"(\d+)([smhd]?)", string.strip())
+    if not match:
+        raise PixiError(f"Invalid duration: {string}.")
+
+    unit = {"": "seconds", "s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+    return timedelta(**{unit[match.group(2)]: int(match.group(1))})
+
 
 def download_directory(func):
     return functools.wraps(func)(
@@ -62,3 +79,118 @@ def visibility(func):
             ),
         )(func)
     )
+
+
+def jobs(func):
+    return functools.wraps(func)(
+        click.option(
+            "--jobs",
+            "-j",
+            type=click.IntRange(min=1),
+            default=1,
+            help="Number of illustrations to download at once.",
+        )(func)
+    )
+
+
+def prefetch(func):
+    return functools.wraps(func)(
+        click.option(
+            "--prefetch",
+            type=click.IntRange(min=0, max=MAX_PREFETCH),
+            default=1,
+            help=(
+                "Number of pages of illustrations to fetch ahead of the "
+                f"downloads, up to {MAX_PREFETCH}."
+            ),
+        )(func)
+    )
+
+
+def until_known(func):
+    return functools.wraps(func)(
+        click.option(
+            "--until-known",
+            "-k",
+            type=click.IntRange(min=1),
+            help=(
+                "Stop once this many previously downloaded illustrations are "
+                "found in a row."
+            ),
+        )(func)
+    )
+
+
+def resume(func):
+    return functools.wraps(func)(
+        click.option(
+            "--resume",
+            "-r",
+            is_flag=True,
+            default=False,
+            help="Continue from where the last interrupted download stopped.",
+        )(func)
+    )
+
+
+def engine(func):
+    return functools.wraps(func)(
+        click.option(
+            "--engine",
+            "-e",
+            type=click.Choice(["thread", "async"]),
+            default="thread",
+            help=(
+                "The download engine. The async engine can keep many more "
+                "downloads in flight with a high --jobs."
+            ),
+        )(func)
+    )
+
+
+def progress_mode(func):
+    return functools.wraps(func)(
+        click.option(
+            "--progress",
+            "progress_mode",
+            type=click.Choice(["text", "json"]),
+            default="text",
+            help=(
+                "How to report progress. json prints one event per line, with "
+                "periodic throughput and queue depth stats."
+            ),
+        )(func)
+    )
+
+
+def quiet(func):
+    return functools.wraps(func)(
+        click.option(
+            "--quiet",
+            "-q",
+            is_flag=True,
+            default=False,
+            help="Hide the progress bar of each file.",
+        )(func)
+    )
+
+
+def stats(func):
+    return functools.wraps(func)(
+        click.option(
+            "--stats",
+            is_flag=True,
+            default=False,
+            help="Print the p50/p95/p99 latencies of each stage of the run.",
+        )(func)
+    )
+
+
+def profile(func):
+    return functools.wraps(func)(
+        click.option(
+            "--profile",
+            type=click.Path(dir_okay=False, writable=True),
+            help="Profile the run with cProfile and write the stats to this file.",
+        )(func)
+    )
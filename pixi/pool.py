@@ -0,0 +1,161 @@
+import functools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DownloadPool:
+    """
+    A bounded pool of download workers. At most ``jobs`` tasks run at once,
+    and ``submit`` blocks once ``jobs`` further tasks are queued, so whatever
+    produces the tasks (e.g. page fetches) stays just ahead of the downloads.
+
+    With a single job, tasks run inline in the submitting thread.
+
+    Exceptions raised by a task are re-raised in the submitting thread on the
+    next call to ``submit``, ``checkpoint`` or ``wait``.
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self._executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self._slots = threading.BoundedSemaphore(jobs * 2)
+        self._futures = set()
+        self._checkpoints = deque()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.wait()
+        else:
+            self._cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def submit(self, func, *args, **kwargs):
+        if self._executor is None:
+            return func(*args, **kwargs)
+
+        self._raise_errors()
+        self._run_checkpoints()
+        self._slots.acquire()
+        future = self._executor.submit(func, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._task_done)
+
+    def checkpoint(self, func, *args, **kwargs):
+        """
+        Call ``func`` once every task submitted so far has finished, without
+        waiting for it here. Checkpoints run in the submitting thread, in the
+        order they were made, during later calls to ``submit``, ``checkpoint``
+        and ``wait``. They are dropped if a task raises.
+        """
+        with self._lock:
+            pending = list(self._futures)
+        self._checkpoints.append((pending, functools.partial(func, *args, **kwargs)))
+        self._raise_errors()
+        self._run_checkpoints()
+
+    def wait(self):
+        """Block until every submitted task and checkpoint has finished."""
+        if self._executor is not None:
+            with self._lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.exception()
+        self._raise_errors()
+        self._run_checkpoints()
+
+    def _task_done(self, future):
+        self._slots.release()
+        if future.cancelled() or future.exception() is None:
+            with self._lock:
+                self._futures.discard(future)
+
+    def _raise_errors(self):
+        with self._lock:
+            failed = [f for f in self._futures if f.done()]
+            self._futures.difference_update(failed)
+        for future in failed:
+            future.result()
+
+    def _run_checkpoints(self):
+        while self._checkpoints:
+            pending, func = self._checkpoints[0]
+            if not all(future.done() for future in pending):
+                return
+            self._checkpoints.popleft()
+            func()
+
+    def _cancel(self):
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+            self._futures.clear()
+        self._checkpoints.clear()
+
+
+class _FetchFailed:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def prefetch_pages(get_next_response, starting_offset, prefetch=1):
+    """
+    Yield the API responses of a paginated endpoint, starting at
+    ``starting_offset`` and following each response's ``next`` cursor.
+
+    Up to ``prefetch`` pages are fetched ahead in a background thread while
+    the caller works on the current page. With a ``prefetch`` of zero, each
+    page is only fetched once the caller asks for it.
+    """
+    if prefetch < 1:
+        response = get_next_response(starting_offset)
+        yield response
+        while response["next"]:
+            response = get_next_response(response["next"])
+            yield response
+        return
+
+    pages = queue.Queue()
+    slots = threading.BoundedSemaphore(prefetch)
+    stop = threading.Event()
+
+    def fetch():
+        cursor = starting_offset
+        try:
+            while _acquire(slots, stop):
+                response = get_next_response(cursor)
+                pages.put(response)
+                cursor = response["next"]
+                if not cursor:
+                    return
+        except BaseException as e:
+            pages.put(_FetchFailed(e))
+
+    threading.Thread(target=fetch, daemon=True).start()
+
+    try:
+        while True:
+            response = pages.get()
+            slots.release()
+            if isinstance(response, _FetchFailed):
+                raise response.exception
+            yield response
+            if not response["next"]:
+                return
+    finally:
+        stop.set()
+
+
+def _acquire(semaphore, stop):
+    """Acquire the semaphore unless ``stop`` is set first."""
+    while not stop.is_set():
+        if semaphore.acquire(timeout=0.1):
+            return True
+    return False
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import Counter
+
+import click
+from tqdm import tqdm
+
+# The seconds between the aggregate stats events of JSON progress.
+STATS_INTERVAL = 5
+
+
+class Progress:
+    """
+    Reports what a download run is doing. In text mode, events are echoed as
+    their messages and each file gets a progress bar, unless ``quiet`` is set.
+    In JSON mode, each event is printed as a JSON object on its own line, and
+    a ``stats`` event with the recent throughput and queue depth is printed
+    every ``STATS_INTERVAL`` seconds as downloads progress.
+
+    Events are counted either way, so the counts and bytes are always
+    available to the end of run summary.
+    """
+
+    def __init__(self, mode="text", quiet=False):
+        self._lock = threading.Lock()
+        self.configure(mode, quiet)
+
+    def configure(self, mode="text", quiet=False):
+        with self._lock:
+            self.mode = mode
+            self.quiet = quiet
+            self.counts = Counter()
+            self.bytes = 0
+            self.started = time.monotonic()
+            self._last_stats = (self.started, 0, 0)
+
+    @property
+    def bars(self):
+        """Whether to draw a progress bar for each file."""
+        return self.mode == "text" and not self.quiet
+
+    def echo(self, message=None):
+        """
+        Echo a message without garbling the progress bars of downloads
+        running in other threads. Messages are left out of JSON progress.
+        """
+        if self.mode == "json":
+            return
+        with tqdm.external_write_mode():
+            click.echo(message)
+
+    def event(self, name, message=None, **fields):
+        """Count an event, and echo ``message`` or print it as JSON."""
+        with self._lock:
+            self.counts[name] += 1
+
+        if self.mode == "json":
+            self._emit({"event": name, **fields})
+            self.report_stats()
+        elif message is not None:
+            self.echo(message)
+
+    def count(self, name, amount=1):
+        """Count an event without reporting it."""
+        with self._lock:
+            self.counts[name] += amount
+
+    def add_bytes(self, size):
+        with self._lock:
+            self.bytes += size
+        if self.mode == "json":
+            self.report_stats()
+
+    def stats(self, now=None):
+        """
+        Return the totals so far, with the items and megabytes per second
+        since the last call and the number of illustrations queued for, and
+        in, download.
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            since, finished, size = self._last_stats
+            self._last_stats = (now, self.counts["finished"], self.bytes)
+            return {
+                **self._rates(now - since, finished, size),
+                "queued": self.counts["queued"] - self.counts["started"],
+                "active": (
+                    self.counts["started"]
+                    - self.counts["finished"]
+                    - self.counts["failed"]
+                ),
+                **self._totals(now),
+            }
+
+    def report_stats(self):
+        """Print a ``stats`` event in JSON mode, if one is due."""
+        if self.mode != "json":
+            return
+        now = time.monotonic()
+        if now - self._last_stats[0] >= STATS_INTERVAL:
+            self._emit({"event": "stats", **self.stats(now)})
+
+    def finish(self):
+        """Print a ``summary`` event of the whole run in JSON mode."""
+        if self.mode != "json":
+            return
+        now = time.monotonic()
+        with self._lock:
+            summary = {**self._rates(now - self.started, 0, 0), **self._totals(now)}
+        self._emit({"event": "summary", **summary})
+
+    def _rates(self, elapsed, finished, size):
+        elapsed = max(elapsed, 1e-9)
+        return {
+            "items_per_second": round(
+                (self.counts["finished"] - finished) / elapsed, 3
+            ),
+            "mb_per_second": round((self.bytes - size) / elapsed / 1e6, 3),
+        }
+
+    def _totals(self, now):
+        return {
+            "elapsed": round(now - self.started, 3),
+            "finished": self.counts["finished"],
+            "failed": self.counts["failed"],
+            "skipped": self.counts["skipped"],
+            "bytes": self.bytes,
+        }
+
+    def _emit(self, record):
+        line = json.dumps({"time": round(time.time(), 3), **record}, default=str)
+        with self._lock:
+            click.echo(line)
+
+
+# The progress reporter of the running command.
+progress = Progress()
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+
+# The status codes Pixiv throttles requests with.
+THROTTLED_STATUSES = frozenset([403, 429])
+
+# The bounds in seconds of the pause after a throttled request.
+MIN_BACKOFF = 1
+MAX_BACKOFF = 300
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that refills at ``rate`` tokens per second and
+    holds up to a second's worth of them. A rate of zero means unlimited.
+
+    A caller reserves tokens up front and then waits out the returned delay,
+    so large requests (e.g. a chunk of bytes) are allowed to overdraw the
+    bucket and the debt is paid back by everyone after them.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Take ``amount`` tokens and return how long to wait before using them."""
+        if not self.rate:
+            return 0
+
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(-self._tokens / self.rate, 0)
+
+
+class RateLimiter:
+    """
+    Limits the requests and bytes per second sent to one host, and pauses
+    every request to it after the host throttles one. The pause doubles with
+    each throttled request, is jittered so that parallel workers don't retry
+    in lockstep, and shrinks again as requests go through.
+
+    ``delay`` and ``delay_bytes`` return the time to wait rather than waiting,
+    so that the async engine can share the limiter; ``wait`` and
+    ``wait_bytes`` wait in the calling thread.
+    """
+
+    def __init__(self, requests_per_second=0, bytes_per_second=0):
+        self.requests = TokenBucket(requests_per_second)
+        self.bytes = TokenBucket(bytes_per_second)
+        self._backoff = 0
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Reserve a request and return how long to wait before sending it."""
+        with self._lock:
+            pause = self._paused_until - time.monotonic()
+        return max(pause, 0) + self.requests.reserve()
+
+    def delay_bytes(self, size):
+        """Reserve ``size`` bytes and return how long to wait after them."""
+        return self.bytes.reserve(size)
+
+    def wait(self):
+        _sleep(self.delay())
+
+    def wait_bytes(self, size):
+        _sleep(self.delay_bytes(size))
+
+    def throttled(self, retry_after=None):
+        """
+        Record a throttled request, pausing all requests for the backoff, or
+        for ``retry_after`` seconds if the server asked for longer.
+        """
+        with self._lock:
+            self._backoff = min(max(self._backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+            pause = self._backoff / 2 + random.uniform(0, self._backoff / 2)
+            pause = max(pause, retry_after or 0)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            return pause
+
+    def succeeded(self):
+        """Record a request that wasn't throttled, easing the backoff."""
+        with self._lock:
+            self._backoff = self._backoff / 2 if self._backoff > MIN_BACKOFF else 0
+
+
+def retry_after(headers):
+    """Return the seconds in a ``Retry-After`` header, if there is one."""
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
@@ -0,0 +1,157 @@
+import os
+import queue
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pixi.database import database
+from pixi.errors import PixiError
+from pixi.layout import DEFAULT_LAYOUT, DEFAULT_NAME, name_pattern
+
+# The number of rows written per transaction.
+REINDEX_BATCH = 50000
+
+Reindexed = namedtuple("Reindexed", "found, added, moved, orphans")
+
+
+def reindex(directory, jobs=8, prune=False, layout=DEFAULT_LAYOUT):
+    """
+    Scan ``directory`` for illustrations downloaded with ``layout``, ``jobs``
+    folders at a time, and record them in the downloaded table, pointing rows
+    at the files found if they had moved. Return a ``Reindexed`` of how many
+    illustrations were found, added and moved, and the orphaned rows (recorded
+    under ``directory`` but not found in it) as ``(id, path)`` tuples, which
+    are deleted if ``prune`` is set.
+
+    Pruning is refused if any file in ``directory`` isn't named like an
+    illustration, as its row would be deleted if it is one.
+    """
+    root = Path(directory).resolve()
+    found, unparsed = scan(root, jobs, layout)
+    if prune and unparsed:
+        raise PixiError(
+            f"Not pruning, as {len(unparsed)} files are not named like "
+            f"illustrations, such as {unparsed[0]}."
+        )
+    recorded = _recorded_paths()
+
+    rows = [
+        (id_, path, title)
+        for id_, (path, title) in found.items()
+        if recorded.get(id_) != path
+    ]
+    added = sum(1 for id_, _, _ in rows if id_ not in recorded)
+    _write_rows(rows)
+
+    orphans = _orphans(recorded, found, str(root))
+    if prune:
+        _delete_rows([id_ for id_, _ in orphans])
+
+    return Reindexed(len(found), added, len(rows) - added, orphans)
+
+
+def scan(root, jobs=8, layout=DEFAULT_LAYOUT):
+    """
+    Walk ``root`` and return a dict mapping the ID of every illustration to
+    its path and title (None if its name has none), and a sorted list of the
+    files that aren't named like illustrations. Illustrations are named like
+    ``layout`` names them at its depth, or like the default layout at any
+    depth. When an ID is found more than once, the first path in sort order
+    wins.
+    """
+    found = {}
+    unparsed = []
+    pattern = name_pattern(layout)
+    leaf_depth = layout.count("/")
+    # Finished scans are handed back through a queue; waiting on the set of
+    # pending futures instead costs time in proportion to its size.
+    done = queue.Queue()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        def submit(directory, depth):
+            pattern_ = pattern if depth == leaf_depth else None
+            future = executor.submit(_scan_directory, directory, pattern_)
+            future.add_done_callback(lambda future: done.put((depth, future)))
+
+        submit(root, 0)
+        pending = 1
+        while pending:
+            depth, future = done.get()
+            matches, subdirectories, files = future.result()
+            pending -= 1
+            for id_, path, title in matches:
+                if id_ not in found or path < found[id_][0]:
+                    found[id_] = (path, title)
+            unparsed.extend(files)
+            for subdirectory in subdirectories:
+                submit(subdirectory, depth + 1)
+                pending += 1
+    return found, sorted(unparsed)
+
+
+def _scan_directory(directory, pattern):
+    """
+    List one folder, returning the illustrations in it named like ``pattern``
+    (if given) or the default layout, the folders in it to scan next and the
+    other files in it. A folder named like an illustration is a multi-page
+    illustration, so it isn't scanned.
+    """
+    matches = []
+    subdirectories = []
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not is_dir and entry.name.endswith(".part"):
+                continue
+            name = entry.name if is_dir else os.path.splitext(entry.name)[0]
+            match = pattern and pattern.fullmatch(name)
+            match = match or DEFAULT_NAME.fullmatch(name)
+            if match:
+                id_ = int(match.group("id"))
+                matches.append((id_, entry.path, match.groupdict().get("title")))
+            elif is_dir:
+                subdirectories.append(entry.path)
+            else:
+                files.append(entry.path)
+    return matches, subdirectories, files
+
+
+def _recorded_paths():
+    with database() as (conn, cursor):
+        cursor.execute("SELECT id, path FROM downloaded")
+        return dict(cursor.fetchall())
+
+
+def _orphans(recorded, found, root):
+    # Rows recorded before layouts existed hold the download directory itself.
+    return sorted(
+        (id_, path)
+        for id_, path in recorded.items()
+        if id_ not in found and (path == root or path.startswith(root + os.sep))
+    )
+
+
+def _write_rows(rows):
+    for start in range(0, len(rows), REINDEX_BATCH):
+        end = start + REINDEX_BATCH
+        with database() as (conn, cursor):
+            cursor.executemany(
+                """
+                INSERT INTO downloaded (id, path, title) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    path = excluded.path,
+                    title = COALESCE(title, excluded.title)
+                """,
+                rows[start:end],
+            )
+
+
+def _delete_rows(ids):
+    for start in range(0, len(ids), REINDEX_BATCH):
+        end = start + REINDEX_BATCH
+        with database() as (conn, cursor):
+            cursor.executemany(
+                "DELETE FROM downloaded WHERE id = ?",
+                [(id_,) for id_ in ids[start:end]],
+            )
@@ -0,0 +1,200 @@
+import os
+from pathlib import Path
+
+import click
+from pixivapi import BadApiResponse
+from requests import RequestException
+
+from pixi.client import Client
+from pixi.database import batch_writes, database
+from pixi.layout import DEFAULT_NAME, format_path, layout_fields
+from pixi.pool import DownloadPool
+from pixi.util import release_file_name, rename_duplicate_file
+
+
+def relayout(directory, layout, jobs=1, dry_run=False):
+    """
+    Move the downloaded illustrations under ``directory`` to where ``layout``
+    puts them and update their recorded paths. Titles and artists that
+    weren't recorded are looked up, ``jobs`` at a time. Return a tuple of how
+    many illustrations were moved and how many couldn't be found on disk.
+    """
+    root = Path(directory).resolve()
+    fields = layout_fields(layout)
+    found, missing = _find_downloads(root)
+    _fill_fields(found, fields, jobs)
+
+    moved = 0
+    with batch_writes():
+        for entry in found:
+            if _needs_lookup(entry, fields):
+                # The lookup failed, so leave the illustration where it is.
+                continue
+            new_path = root / format_path(
+                layout, entry["id"], entry["title"], entry["artist_id"]
+            )
+            if entry["path"].is_file():
+                new_path = new_path.with_name(new_path.name + entry["path"].suffix)
+            if new_path == entry["path"]:
+                continue
+
+            if dry_run:
+                click.echo(f"{entry['path']} -> {new_path}")
+            else:
+                _move(entry, new_path, root)
+            moved += 1
+
+    return moved, missing
+
+
+def _find_downloads(root):
+    """
+    Find the files of the downloaded illustrations under ``root``. Return a
+    list of their entries and the number that are no longer on disk.
+    """
+    with database() as (conn, cursor):
+        # Fall back to the catalog for rows recorded without a title or artist.
+        cursor.execute(
+            """
+            SELECT
+                downloaded.id,
+                downloaded.path,
+                COALESCE(downloaded.title, illustrations.title) AS title,
+                COALESCE(downloaded.artist_id, illustrations.artist_id) AS artist_id
+            FROM downloaded
+            LEFT JOIN illustrations ON illustrations.id = downloaded.id
+            """
+        )
+        rows = cursor.fetchall()
+
+    found = []
+    missing = 0
+    flat_listings = {}
+    for row in rows:
+        recorded = Path(row["path"])
+        if recorded != root and root not in recorded.parents:
+            continue
+
+        path = _locate(row["id"], recorded, flat_listings)
+        if path is None:
+            click.echo(f"Illustration {row['id']} is missing from {recorded}.")
+            missing += 1
+            continue
+
+        found.append(
+            {
+                "id": row["id"],
+                "path": path,
+                "title": row["title"] or _parse_title(row["id"], path),
+                "artist_id": row["artist_id"],
+            }
+        )
+
+    return found, missing
+
+
+def _locate(illustration_id, recorded, flat_listings):
+    if recorded.name.startswith(str(illustration_id)):
+        return recorded if recorded.exists() else None
+
+    # Downloads recorded before layouts existed hold the download directory,
+    # in which the illustration was saved flat. Each such directory is only
+    # listed once.
+    if recorded not in flat_listings:
+        flat_listings[recorded] = _list_flat(recorded)
+    name = flat_listings[recorded].get(illustration_id)
+    return recorded / name if name else None
+
+
+def _list_flat(directory):
+    names = {}
+    try:
+        entries = sorted(os.listdir(directory))
+    except OSError:
+        return names
+
+    for name in entries:
+        match = DEFAULT_NAME.match(name)
+        if match and not name.endswith(".part"):
+            names.setdefault(int(match.group(1)), name)
+    return names
+
+
+def _parse_title(illustration_id, path):
+    name = path.name if path.is_dir() else path.stem
+    match = DEFAULT_NAME.fullmatch(name)
+    if match and int(match.group(1)) == illustration_id:
+        return match.group(2)
+    return None
+
+
+def _fill_fields(entries, fields, jobs):
+    """Look up the titles and artists the layout needs that weren't recorded."""
+    lookups = [entry for entry in entries if _needs_lookup(entry, fields)]
+    if not lookups:
+        return
+
+    click.echo(f"Looking up {len(lookups)} illustrations.")
+    client = Client()
+    with DownloadPool(jobs) as pool:
+        for entry in lookups:
+            pool.submit(_look_up, client, entry)
+
+
+def _needs_lookup(entry, fields):
+    return any(
+        entry[field] is None for field in ("title", "artist_id") if field in fields
+    )
+
+
+def _look_up(client, entry):
+    try:
+        illustration = client.fetch_illustration(entry["id"])
+    except (BadApiResponse, RequestException) as e:
+        return click.echo(f"Failed to look up illustration {entry['id']} ({e}).")
+
+    entry["title"] = illustration.title
+    entry["artist_id"] = illustration.user.id
+
+
+def _move(entry, new_path, root):
+    old_path = entry["path"]
+    new_path.parent.mkdir(parents=True, exist_ok=True)
+    new_path = rename_duplicate_file(new_path)
+    try:
+        if old_path.is_dir():
+            # A folder can't replace the empty file that reserves its name.
+            new_path.unlink()
+            old_path.rename(new_path)
+        else:
+            old_path.replace(new_path)
+    except BaseException:
+        release_file_name(new_path)
+        raise
+
+    with database() as (conn, cursor):
+        cursor.execute(
+            "UPDATE downloaded SET path = ?, title = ?, artist_id = ? WHERE id = ?",
+            (str(new_path), entry["title"], entry["artist_id"], entry["id"]),
+        )
+        # Keep the paths of content-addressed files in step.
+        old, new = str(old_path), str(new_path)
+        cursor.execute(
+            """
+            UPDATE files SET path = ? || substr(path, ?)
+            WHERE path = ? OR substr(path, 1, ?) = ?
+            """,
+            (new, len(old) + 1, old, len(old) + 1, old + os.sep),
+        )
+
+    _prune_empty(old_path.parent, root)
+
+
+def _prune_empty(directory, root):
+    """Remove the folders left empty under ``root`` by moving files out."""
+    while directory != root and root in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
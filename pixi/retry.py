@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone
+
+from pixi.client import Client
+from pixi.database import batch_writes, database
+from pixi.pool import DownloadPool
+from pixi.progress import progress
+from pixi.util import (
+    SQLITE_MAX_VARIABLES,
+    clear_failed,
+    fetch_and_download_image,
+    find_downloaded,
+)
+
+# The seconds to wait before retrying an illustration that failed once, which
+# doubles with each further failure, up to a day.
+BASE_RETRY_DELAY = 60
+MAX_RETRY_DELAY = 24 * 60 * 60
+
+
+def retry_failed(directory, track_download=True, jobs=1, max_age=None):
+    """
+    Retry the illustrations in the failed table that are due for a retry,
+    ``jobs`` at a time, and return a tuple of how many were retried and how
+    many of those still failed.
+    """
+    entries = failed_entries(max_age)
+    due = [entry for entry in entries if is_due(entry)]
+    if len(due) < len(entries):
+        progress.count("skipped", len(entries) - len(due))
+        progress.echo(
+            f"Skipping {len(entries) - len(due)} illustrations that failed "
+            "too recently to retry."
+        )
+
+    ids = [entry["id"] for entry in due]
+    downloaded = find_downloaded(ids)
+    with batch_writes():
+        for illustration_id in downloaded:
+            clear_failed(illustration_id)
+    ids = [
+        illustration_id for illustration_id in ids if illustration_id not in downloaded
+    ]
+
+    client = Client()
+    with batch_writes(), DownloadPool(jobs) as pool:
+        for illustration_id in ids:
+            progress.count("queued")
+            pool.submit(
+                fetch_and_download_image,
+                client,
+                illustration_id,
+                directory,
+                track_download,
+                on_lookup_failure=record_failed_attempt,
+            )
+
+    return len(due), len(_still_failed(ids))
+
+
+def failed_entries(max_age=None):
+    """
+    Return the rows of the failed table, leaving out those that first failed
+    more than ``max_age`` (a ``timedelta``) ago.
+    """
+    seconds = int(max_age.total_seconds()) if max_age else None
+    with database() as (conn, cursor):
+        cursor.execute(
+            """
+            SELECT
+                id,
+                attempts,
+                COALESCE(last_attempt, time) AS last_attempt
+            FROM failed
+            WHERE ? IS NULL OR time >= datetime('now', ?)
+            ORDER BY time
+            """,
+            (seconds, f"-{seconds} seconds"),
+        )
+        return cursor.fetchall()
+
+
+def is_due(entry, now=None):
+    """Check whether a failed entry has waited out its retry delay."""
+    now = now or datetime.now(timezone.utc)
+    delay = min(BASE_RETRY_DELAY * 2 ** (entry["attempts"] - 1), MAX_RETRY_DELAY)
+    return _parse_time(entry["last_attempt"]) + timedelta(seconds=delay) <= now
+
+
+def record_failed_attempt(illustration_id, reason, error):
+    """Count another failed attempt at an illustration that is already failed."""
+    with database() as (conn, cursor):
+        cursor.execute(
+            """
+            UPDATE failed SET
+                attempts = attempts + 1,
+                reason = ?,
+                last_error = ?,
+                last_attempt = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (reason, error, illustration_id),
+        )
+
+
+def _still_failed(ids):
+    """Return the subset of ``ids`` that are still in the failed table."""
+    failed = set()
+    with database() as (conn, cursor):
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            end = start + SQLITE_MAX_VARIABLES
+            chunk = ids[start:end]
+            cursor.execute(
+                f"""
+                SELECT id FROM failed WHERE id IN ({", ".join("?" * len(chunk))})
+                """,
+                chunk,
+            )
+            failed.update(row["id"] for row in cursor.fetchall())
+    return failed
+
+
+def _parse_time(value):
+    time = datetime.fromisoformat(value)
+    if time.tzinfo is None:
+        # CURRENT_TIMESTAMP is in UTC.
+        time = time.replace(tzinfo=timezone.utc)
+    return time
@@ -0,0 +1,170 @@
+import errno
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+
+from pixi.database import database
+from pixi.errors import InvalidConfig
+from pixi.util import release_file_name, rename_duplicate_file
+
+# The ways a file with known content can be linked into place.
+DEDUPE_MODES = ("hardlink", "reflink")
+
+# The ioctl that clones a file's extents on copy-on-write filesystems.
+FICLONE = 0x40049409
+
+# The size of the blocks a partial download is re-read in to hash it.
+HASH_BLOCK_SIZE = 2**20
+
+
+def dedupe_mode(config):
+    """Read the content-addressed storage mode from the config, if any."""
+    mode = config["pixi"].get("dedupe") or None
+    if mode is not None and mode not in DEDUPE_MODES:
+        raise InvalidConfig("dedupe must be hardlink, reflink or blank")
+    return mode
+
+
+def new_hash():
+    return hashlib.sha256()
+
+
+class HashingWriter:
+    """Wraps a file so that everything written to it is also hashed."""
+
+    def __init__(self, f, hash_):
+        self.f = f
+        self.hash = hash_
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.f.write(data)
+
+
+def hash_file(path, hash_):
+    """Feed the contents of ``path`` into ``hash_``."""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hash_.update(block)
+    return hash_
+
+
+def link_known_file(url, destination, mode):
+    """
+    If the file at ``url`` has been downloaded before and is still on disk,
+    link it to ``destination`` (or a free name next to it) instead of
+    downloading it again. Return the path linked to, or None.
+    """
+    known = _find_file("url", url)
+    if known is None:
+        return None
+
+    path, digest, size = known
+    destination = rename_duplicate_file(destination)
+    try:
+        linked = _link(path, destination, mode)
+    except BaseException:
+        release_file_name(destination)
+        raise
+    if not linked:
+        release_file_name(destination)
+        return None
+    record_file(destination, url, digest, size)
+    return destination
+
+
+def store_file(partial, destination, url, digest, mode):
+    """
+    Move a finished download into place at ``destination``, or a free name
+    next to it. When a file with the same content is already stored, the
+    download is dropped and that file is linked into place instead. Return
+    the final path.
+    """
+    size = partial.stat().st_size
+    destination = rename_duplicate_file(destination)
+
+    try:
+        known = _find_file("hash", digest, size)
+        if known is not None and _link(known[0], destination, mode):
+            partial.unlink()
+        else:
+            partial.replace(destination)
+    except BaseException:
+        release_file_name(destination)
+        raise
+
+    record_file(destination, url, digest, size)
+    return destination
+
+
+def record_file(path, url, digest, size):
+    with database() as (conn, cursor):
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO files (path, url, hash, size) VALUES (?, ?, ?, ?)
+            """,
+            (str(Path(path).resolve()), url, digest, size),
+        )
+
+
+def _find_file(column, value, size=None):
+    """
+    Return the path, hash and size of a stored file whose ``column`` matches
+    ``value``, skipping and forgetting files that were since moved, deleted
+    or changed.
+    """
+    with database() as (conn, cursor):
+        cursor.execute(
+            f"SELECT path, hash, size FROM files WHERE {column} = ?",
+            (value,),
+        )
+        rows = cursor.fetchall()
+
+    for row in rows:
+        path = Path(row["path"])
+        try:
+            on_disk = path.stat().st_size
+        except OSError:
+            on_disk = None
+        if on_disk == row["size"] and size in (None, on_disk):
+            return path, row["hash"], row["size"]
+        _forget_file(path)
+
+    return None
+
+
+def _forget_file(path):
+    with database() as (conn, cursor):
+        cursor.execute("DELETE FROM files WHERE path = ?", (str(path),))
+
+
+def _link(source, destination, mode):
+    """
+    Make the file reserved at ``destination`` share ``source``'s content, by
+    reflink if asked and supported, otherwise by hardlink. Return False if
+    neither works (e.g. across filesystems).
+    """
+    if mode == "reflink":
+        try:
+            return _reflink(source, destination)
+        except OSError:
+            # Not a copy-on-write filesystem, so fall back to a hardlink.
+            pass
+
+    # Link under a temporary name and move it over the reserved empty file.
+    link = destination.with_name(f"{destination.name}.link")
+    try:
+        os.link(source, link)
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            return False
+        raise
+    os.replace(link, destination)
+    return True
+
+
+def _reflink(source, destination):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    return True
@@ -0,0 +1,69 @@
+from pixi.database import database
+
+
+class SyncState:
+    """
+    The saved progress of a crawl over one source of illustrations, so that
+    an interrupted crawl can be resumed from where it stopped.
+
+    A source is identified by its type (``artist`` or ``bookmarks``), the
+    user it belongs to, and for bookmarks, the visibility and tag filters.
+    """
+
+    def __init__(self, source, user, visibility="", tag=""):
+        self.key = (source, user, visibility or "", tag or "")
+
+    def resume_point(self):
+        """
+        Return the ``(cursor, page)`` of the page that an interrupted crawl
+        stopped at, or ``None`` if the last crawl finished.
+        """
+        with database() as (conn, cursor):
+            cursor.execute(
+                """
+                SELECT cursor, page FROM sync_state
+                WHERE source = ? AND user = ? AND visibility = ? AND tag = ?
+                """,
+                self.key,
+            )
+            row = cursor.fetchone()
+
+        if not row or row["cursor"] is None:
+            return None
+        return row["cursor"], row["page"]
+
+    def page_done(self, page, response):
+        """
+        Record that every illustration of ``page`` has been handled, so a
+        resumed crawl starts on the page after it.
+        """
+        newest_id = None
+        if page == 1 and response["illustrations"]:
+            newest_id = response["illustrations"][0].id
+
+        self._save(response["next"], page + 1, newest_id)
+
+    def finish(self):
+        """Record that the crawl reached the end of the source."""
+        self._save(None, 1)
+
+    def _save(self, next_cursor, page, newest_id=None):
+        with database() as (conn, cursor):
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO sync_state (source, user, visibility, tag)
+                VALUES (?, ?, ?, ?)
+                """,
+                self.key,
+            )
+            cursor.execute(
+                """
+                UPDATE sync_state
+                SET cursor = ?,
+                    page = ?,
+                    newest_id = COALESCE(?, newest_id),
+                    time = CURRENT_TIMESTAMP
+                WHERE source = ? AND user = ? AND visibility = ? AND tag = ?
+                """,
+                (next_cursor, page, newest_id, *self.key),
+            )
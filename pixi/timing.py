@@ -0,0 +1,158 @@
+"""
+Timers for the hot paths of a download run, summarized by ``--stats``, and the
+``--profile`` profiler. Timers only record while enabled, so they cost next to
+nothing otherwise.
+"""
+
+import functools
+import inspect
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# The percentiles of each stage's latencies that are reported.
+PERCENTILES = (50, 95, 99)
+
+
+class Timings:
+    """Collects how long each call to each stage of a run took."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, enabled=False):
+        with self._lock:
+            self.enabled = enabled
+            self.samples = defaultdict(list)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the block as one call to ``stage``."""
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorate a function to time each call to it as ``stage``."""
+
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def coroutine_wrapper(*args, **kwargs):
+                    with self.timer(stage):
+                        return await func(*args, **kwargs)
+
+                return coroutine_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def summary(self):
+        """
+        Return a dict mapping each stage, in the order first timed, to its
+        number of calls, total seconds and the seconds of its ``PERCENTILES``.
+        """
+        with self._lock:
+            samples = {stage: sorted(times) for stage, times in self.samples.items()}
+
+        return {
+            stage: {
+                "count": len(times),
+                "total": sum(times),
+                **{f"p{p}": percentile(times, p) for p in PERCENTILES},
+            }
+            for stage, times in samples.items()
+        }
+
+    def format_summary(self):
+        """Return the summary as a table, with latencies in milliseconds."""
+        headers = ["Stage", "Count", "Total (s)"] + [f"p{p} (ms)" for p in PERCENTILES]
+        rows = [
+            [stage, str(row["count"]), f"{row['total']:.2f}"]
+            + [f"{row[f'p{p}'] * 1000:.1f}" for p in PERCENTILES]
+            for stage, row in self.summary().items()
+        ]
+
+        widths = [max(len(row[i]) for row in [headers] + rows) for i in range(6)]
+        return "\n".join(
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in [headers] + rows
+        )
+
+
+def percentile(ordered, p):
+    """Return the nearest-rank ``p``th percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+@contextmanager
+def profiling(path):
+    """
+    Profile the block with cProfile, including the threads it starts, and
+    dump the stats to ``path`` for ``pstats``. Does nothing if ``path`` is
+    None.
+    """
+    if path is None:
+        yield
+        return
+
+    # Imported here, as the database module, and so every command, imports
+    # this module.
+    import cProfile
+    import pstats
+
+    profiles = []
+    lock = threading.Lock()
+
+    def start(*args):
+        profile = cProfile.Profile()
+        with lock:
+            profiles.append(profile)
+        profile.enable()
+
+    # Before Python 3.12, a profile only sees the thread that enabled it, so
+    # each new thread starts its own.
+    per_thread = sys.version_info < (3, 12)
+    if per_thread:
+        threading.setprofile(start)
+    start()
+    try:
+        yield
+    finally:
+        if per_thread:
+            threading.setprofile(None)
+        for profile in profiles:
+            profile.disable()
+        pstats.Stats(*profiles).dump_stats(str(path))
+
+
+# The timings of the running command.
+timings = Timings()
@@ -1,13 +1,32 @@
+import itertools
 import os
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib import parse
 
-import click
 from pixivapi import BadApiResponse, Size
 from requests import RequestException
 
-from pixi.database import database
+from pixi.catalog import disk_size, record_illustration
+from pixi.database import batch_writes, commit_batch, database
 from pixi.errors import DownloadFailed, DuplicateImage, InvalidURL, PixiError
+from pixi.failures import AUTH, PERMANENT, backoff_delay, classify
+from pixi.filenames import FilenameAllocator
+from pixi.layout import illustration_path
+from pixi.pool import DownloadPool, prefetch_pages
+from pixi.progress import progress
+from pixi.timing import timings
+
+# The lowest maximum number of host parameters in a single SQLite statement.
+SQLITE_MAX_VARIABLES = 999
+
+# The number of pages of a multi-page illustration to download at once.
+META_PAGE_JOBS = 4
+
+# The base backoff in seconds before retrying a transient download failure.
+RETRY_BACKOFF = 1
+
+_filenames = FilenameAllocator()
 
 
 def parse_id(string, path=None, param=None):
@@ -28,17 +47,37 @@ def parse_id(string, path=None, param=None):
 
 
 def rename_duplicate_file(path):
-    new_path = path
-    dupe_number = 1
-    while new_path.exists():
-        name, ext = os.path.splitext(path.name)
-        new_path = path.with_name(f"{name} ({dupe_number}){ext}")
-        dupe_number += 1
-    return new_path
+    """
+    Return ``path``, or a numbered name next to it if that is taken. The name
+    is reserved by creating an empty file at it, which the caller replaces.
+    """
+    return _filenames.allocate(path)
+
+
+def release_file_name(path):
+    """
+    Give back a name reserved by ``rename_duplicate_file`` that won't be
+    used, deleting the empty file that reserves it.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    _filenames.release(path)
 
 
-def format_filename(id_, title):
-    return re.sub(r'[:\?<>\\*\|"\/]', "_", f"{id_}. {title}")
+def move_into_place(partial, destination):
+    """
+    Move a finished download to ``destination``, or a free name next to it,
+    and return the path it was moved to.
+    """
+    destination = rename_duplicate_file(destination)
+    try:
+        partial.replace(destination)
+    except BaseException:
+        release_file_name(destination)
+        raise
+    return destination
 
 
 def resolve_track_download(track_download, directory):
@@ -47,6 +86,7 @@ def resolve_track_download(track_download, directory):
     return track_download
 
 
+@timings.timed("illustration")
 def download_image(
     illustration,
     directory,
@@ -58,47 +98,188 @@ def download_image(
         try:
             check_duplicate(illustration.id)
         except DuplicateImage:
-            return click.echo(
-                f"{illustration.id}. {illustration.title} has been downloaded "
-                "previously, skipping..."
-            )
+            return _echo_duplicate(illustration)
 
+    report_started(illustration)
+    started = time.monotonic()
+    finished_pages = set()
     for attempt in range(tries):
+        # Other threads may refresh the token meanwhile; only a failure with
+        # the token this attempt used should refresh it again.
+        token = illustration.client.access_token
         try:
-            filename = format_filename(illustration.id, illustration.title)
-
-            if illustration.meta_pages:
-                click.echo(
-                    "Downloading multi-page illustration "
-                    f"{illustration.id}. {illustration.title}."
-                )
-            else:
-                click.echo(
-                    f"Downloading illustration {illustration.id}. "
-                    f"{illustration.title}."
-                )
-
-            illustration.download(
-                directory=directory,
-                size=Size.ORIGINAL,
-                filename=filename,
-            )
-
-            click.echo()
+            path = _download_files(illustration, directory, finished_pages)
+            report_finished(illustration, path, started)
             clear_failed(illustration.id)
             if track_download:
-                record_download(illustration.id, str(directory))
-
-            break
+                record_finished(illustration, path)
+            return
         except (BadApiResponse, RequestException) as e:
-            click.echo(
-                f"Failed to download illustration {illustration.id}. "
-                f"{illustration.title} ({e}). Attempting to re-download "
-                f"(attempt {attempt + 1})."
-            )
+            failure = classify(e)
+            error = str(e)
+            if failure.kind == PERMANENT:
+                _echo(
+                    f"Failed to download illustration {illustration.id}. "
+                    f"{illustration.title} ({e}). Not retrying."
+                )
+                break
+
+            report_retry(illustration, attempt, failure, e)
+            if failure.kind == AUTH:
+                illustration.client.reauthenticate(token)
+            elif attempt + 1 < tries:
+                time.sleep(backoff_delay(attempt, RETRY_BACKOFF))
+
+    report_failed(illustration, failure, error, started)
+    discard_partial_files(illustration, directory, illustration.client.layout)
+    mark_failed(illustration, failure.reason, error)
+    raise DownloadFailed(failure.reason)
+
+
+def report_started(illustration):
+    """Report that an illustration is about to be downloaded."""
+    if illustration.meta_pages:
+        message = (
+            "Downloading multi-page illustration "
+            f"{illustration.id}. {illustration.title}."
+        )
+    else:
+        message = f"Downloading illustration {illustration.id}. {illustration.title}."
+    progress.event(
+        "started",
+        message,
+        id=illustration.id,
+        title=illustration.title,
+        pages=len(illustration.meta_pages) or 1,
+    )
+
+
+def report_finished(illustration, path, started, message=""):
+    """
+    Report that an illustration finished downloading to ``path``, having
+    started at the monotonic time ``started``.
+    """
+    progress.event(
+        "finished",
+        message,
+        id=illustration.id,
+        path=str(path),
+        bytes=disk_size(path),
+        duration=round(time.monotonic() - started, 3),
+    )
+
+
+def report_retry(illustration, attempt, failure, error):
+    progress.event(
+        "retry",
+        f"Failed to download illustration {illustration.id}. "
+        f"{illustration.title} ({error}). Attempting to re-download "
+        f"(attempt {attempt + 1}).",
+        id=illustration.id,
+        attempt=attempt + 1,
+        reason=failure.reason,
+        error=str(error),
+    )
+
+
+def report_failed(illustration, failure, error, started, message=None):
+    progress.event(
+        "failed",
+        message,
+        id=illustration.id,
+        title=illustration.title,
+        reason=failure.reason,
+        error=error,
+        duration=round(time.monotonic() - started, 3),
+    )
+
+
+def _download_files(illustration, directory, finished_pages):
+    """
+    Download an illustration to where the client's layout puts it under
+    ``directory`` and return the path of its file, or of its folder if it
+    has multiple pages.
+    """
+    path = illustration_path(illustration, illustration.client.layout)
+    directory = directory / path.parent
+
+    if illustration.meta_pages:
+        download_meta_pages(illustration, directory, path.name, finished_pages)
+        return directory / path.name
+
+    url = illustration.image_urls[Size.ORIGINAL]
+    ext = os.path.splitext(url)[1]
+    directory.mkdir(parents=True, exist_ok=True)
+    # The file may end up at a free name next to the one asked for.
+    return illustration.client.download(
+        url=url,
+        destination=directory / f"{path.name}{ext}",
+        referer=_referer(illustration),
+    )
+
+
+def discard_partial_files(illustration, directory, layout):
+    """
+    Delete the ``.part`` files that failed attempts at an illustration left
+    under ``directory``, once it has been given up on.
+    """
+    path = illustration_path(illustration, layout)
+    directory = directory / path.parent
+
+    if illustration.meta_pages:
+        illust_dir = directory / path.name
+        urls = [page[Size.ORIGINAL] for page in illustration.meta_pages]
+        partials = [illust_dir / f"{url.split('/')[-1]}.part" for url in urls]
     else:
-        mark_failed(illustration)
-        raise DownloadFailed
+        ext = os.path.splitext(illustration.image_urls[Size.ORIGINAL])[1]
+        partials = [directory / f"{path.name}{ext}.part"]
+
+    for partial in partials:
+        try:
+            partial.unlink()
+        except FileNotFoundError:
+            pass
+    if illustration.meta_pages:
+        # The folder is only removed if it is empty, with no page saved.
+        try:
+            illust_dir.rmdir()
+        except OSError:
+            pass
+
+
+def download_meta_pages(illustration, directory, filename, finished=None):
+    """
+    Download the pages of a multi-page illustration into a folder named
+    ``filename``, ``META_PAGE_JOBS`` at a time, skipping those in ``finished``.
+    """
+    finished = set() if finished is None else finished
+    referer = _referer(illustration)
+    illust_dir = directory / filename
+    illust_dir.mkdir(parents=True, exist_ok=True)
+
+    def download_page(url):
+        illustration.client.download(
+            url=url,
+            destination=illust_dir / url.split("/")[-1],
+            referer=referer,
+        )
+        finished.add(url)
+
+    urls = [page[Size.ORIGINAL] for page in illustration.meta_pages]
+    urls = [url for url in urls if url not in finished]
+
+    with ThreadPoolExecutor(max_workers=META_PAGE_JOBS) as executor:
+        futures = [executor.submit(download_page, url) for url in urls]
+
+    for future in futures:
+        future.result()
+
+
+def _referer(illustration):
+    return (
+        "https://www.pixiv.net/member_illust.php?mode=medium"
+        f"&illust_id={illustration.id}"
+    )
 
 
 def download_pages(
@@ -108,49 +289,230 @@ def download_pages(
     allow_duplicates=False,
     track_download=True,
     start_page=1,
+    jobs=1,
+    prefetch=1,
+    until_known=None,
+    checkpoint=None,
+    engine="thread",
 ):
-    response = get_next_response(starting_offset)
-    if not response["illustrations"]:
-        raise PixiError("No illustrations found.")
-
-    page = start_page
-    while True:
-        click.echo(f"Downloading page {page} of illustrations.\n")
-        for illustration in response["illustrations"]:
-            try:
-                download_image(
-                    illustration,
-                    directory=directory,
-                    tries=3,
-                    allow_duplicate=allow_duplicates,
-                    track_download=(resolve_track_download(track_download, directory)),
-                )
-            except DownloadFailed:
-                click.echo(
-                    f"Failed to download image {illustration.id}. "
-                    f"{illustration.title} three times. Skipping..."
+    if until_known and allow_duplicates:
+        raise PixiError("--until-known cannot be used with --allow-duplicates.")
+    get_next_response = timings.timed("page")(get_next_response)
+    # With --until-known, the next page is likely never needed, so it is only
+    # fetched once it is.
+    prefetch = 0 if until_known else prefetch
+
+    if engine == "async":
+        # Imported here, as the async engine builds on this module.
+        from pixi.engine import download_pages_async
+
+        return download_pages_async(
+            get_next_response,
+            starting_offset,
+            directory,
+            allow_duplicates=allow_duplicates,
+            track_download=resolve_track_download(track_download, directory),
+            start_page=start_page,
+            jobs=jobs,
+            prefetch=prefetch,
+            until_known=until_known,
+            checkpoint=checkpoint,
+        )
+
+    responses = prefetch_pages(get_next_response, starting_offset, prefetch)
+    try:
+        response = next(responses)
+        if not response["illustrations"]:
+            raise PixiError("No illustrations found.")
+
+        track_download = resolve_track_download(track_download, directory)
+        if not allow_duplicates:
+            duplicates = DuplicateFilter(track_download, until_known)
+
+        with batch_writes(), DownloadPool(jobs) as pool:
+            pages = itertools.chain([response], responses)
+            for page, response in enumerate(pages, start=start_page):
+                if page != start_page:
+                    commit_batch()
+
+                progress.event(
+                    "page",
+                    f"Downloading page {page} of illustrations.\n",
+                    page=page,
+                    illustrations=len(response["illustrations"]),
                 )
 
-        if not response["next"]:
-            break
+                illustrations = response["illustrations"]
+                if not allow_duplicates:
+                    illustrations = duplicates.filter(illustrations)
+
+                for illustration in illustrations:
+                    progress.count("queued")
+                    # Duplicates have already been skipped for the whole page.
+                    pool.submit(
+                        _download_page_image,
+                        illustration,
+                        directory=directory,
+                        allow_duplicate=True,
+                        track_download=track_download,
+                    )
+
+                if checkpoint:
+                    pool.checkpoint(checkpoint, page, response)
+
+                if not allow_duplicates and duplicates.caught_up:
+                    _echo(
+                        f"Found {until_known} previously downloaded "
+                        "illustrations in a row, stopping."
+                    )
+                    break
+    finally:
+        responses.close()
+
+
+class DuplicateFilter:
+    """
+    Filters previously downloaded illustrations out of each page, with one
+    query per page, and stops once ``until_known`` are seen in a row.
+    """
+
+    def __init__(self, track_download, until_known=None):
+        self.track_download = track_download
+        self.until_known = until_known
+        self.known_in_a_row = 0
+        self.submitted = set()
+
+    @property
+    def caught_up(self):
+        return bool(self.until_known) and self.known_in_a_row >= self.until_known
+
+    def filter(self, illustrations):
+        downloaded = find_downloaded(illustration.id for illustration in illustrations)
+        submitted = self.submitted if self.track_download else set()
+
+        for illustration in illustrations:
+            if illustration.id in downloaded:
+                _echo_duplicate(illustration)
+                self.known_in_a_row += 1
+                if self.caught_up:
+                    return
+            elif illustration.id in submitted:
+                _echo_duplicate(illustration)
+            else:
+                self.known_in_a_row = 0
+                submitted.add(illustration.id)
+                yield illustration
+
+
+def download_illustrations(
+    client,
+    illustration_ids,
+    directory,
+    allow_duplicates=False,
+    track_download=True,
+    jobs=1,
+):
+    """
+    Look up and download many illustrations by ID, ``jobs`` at a time.
+    Previously downloaded illustrations are filtered out in bulk up front.
+    """
+    if not allow_duplicates:
+        downloaded = find_downloaded(illustration_ids)
+        if downloaded:
+            progress.count("skipped", len(downloaded))
+            _echo(f"Skipping {len(downloaded)} previously downloaded illustrations.\n")
+        illustration_ids = [id_ for id_ in illustration_ids if id_ not in downloaded]
+
+    with batch_writes(), DownloadPool(jobs) as pool:
+        for illustration_id in illustration_ids:
+            progress.count("queued")
+            pool.submit(
+                fetch_and_download_image,
+                client,
+                illustration_id,
+                directory,
+                track_download,
+            )
+
+
+def fetch_and_download_image(
+    client, illustration_id, directory, track_download, on_lookup_failure=None
+):
+    """
+    Look up an illustration by ID and download it, duplicate or not. If the
+    lookup fails, that is reported and ``on_lookup_failure`` is called with
+    the ID, the reason it failed and the error.
+    """
+    try:
+        illustration = client.fetch_illustration(illustration_id)
+    except (BadApiResponse, RequestException) as e:
+        reason = classify(e).reason
+        # Count the illustration as started too, so the queue depth balances.
+        progress.count("started")
+        progress.event(
+            "failed",
+            f"Failed to look up illustration {illustration_id} ({e}).",
+            id=illustration_id,
+            reason=reason,
+            error=str(e),
+        )
+        if on_lookup_failure is not None:
+            on_lookup_failure(illustration_id, reason, str(e))
+        return
+
+    _download_page_image(illustration, directory, True, track_download)
 
-        response = get_next_response(response["next"])
-        page += 1
 
+def _download_page_image(illustration, directory, allow_duplicate, track_download):
+    try:
+        download_image(
+            illustration,
+            directory=directory,
+            tries=3,
+            allow_duplicate=allow_duplicate,
+            track_download=track_download,
+        )
+    except DownloadFailed as e:
+        _echo(
+            f"Failed to download image {illustration.id}. "
+            f"{illustration.title} ({e}). Skipping..."
+        )
+
+
+def _echo_duplicate(illustration):
+    progress.event(
+        "skipped",
+        f"{illustration.id}. {illustration.title} has been downloaded "
+        "previously, skipping...",
+        id=illustration.id,
+        reason="duplicate",
+    )
 
-def mark_failed(illustration):
+
+def _echo(message=None):
+    progress.echo(message)
+
+
+def mark_failed(illustration, reason=None, error=None):
     with database() as (conn, cursor):
         cursor.execute(
             """
-            INSERT OR IGNORE INTO failed (id, artist, title) VALUES (?, ?, ?)
+            INSERT INTO failed (id, artist, title, reason, last_error, last_attempt)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET
+                attempts = attempts + 1,
+                reason = excluded.reason,
+                last_error = excluded.last_error,
+                last_attempt = excluded.last_attempt
             """,
             (
                 illustration.id,
                 illustration.user.account,
                 illustration.title,
+                reason,
+                error,
             ),
         )
-        conn.commit()
 
 
 def clear_failed(illustration_id):
@@ -161,23 +523,43 @@ def clear_failed(illustration_id):
             """,
             (illustration_id,),
         )
-        conn.commit()
 
 
-def record_download(illustration_id, path):
+def record_finished(illustration, path):
+    """
+    Record a finished download and add it to the catalog in one transaction,
+    committed at once even when writes are batched.
+    """
+    # The outer block keeps a batch from committing between the two.
+    with batch_writes(), database():
+        record_download(
+            illustration.id,
+            str(path.resolve()),
+            illustration.title,
+            illustration.user.id,
+        )
+        record_illustration(illustration, path)
+    commit_batch()
+
+
+@timings.timed("record_download")
+def record_download(illustration_id, path, title=None, artist_id=None):
     with database() as (conn, cursor):
         cursor.execute(
             """
-            INSERT OR IGNORE INTO downloaded (id, path) VALUES (?, ?)
+            INSERT OR IGNORE INTO downloaded (id, path, title, artist_id)
+            VALUES (?, ?, ?, ?)
             """,
             (
                 illustration_id,
                 path,
+                title,
+                artist_id,
             ),
         )
-        conn.commit()
 
 
+@timings.timed("duplicate_check")
 def check_duplicate(illustration_id):
     with database() as (conn, cursor):
         cursor.execute(
@@ -189,3 +571,27 @@ def check_duplicate(illustration_id):
         row = cursor.fetchone()
         if row:
             raise DuplicateImage(row["path"])
+
+
+@timings.timed("duplicate_check")
+def find_downloaded(illustration_ids):
+    """
+    Return the subset of ``illustration_ids`` that have been downloaded
+    before, in as few queries as SQLite's variable limit allows.
+    """
+    illustration_ids = list(illustration_ids)
+    downloaded = set()
+
+    with database() as (conn, cursor):
+        for start in range(0, len(illustration_ids), SQLITE_MAX_VARIABLES):
+            end = start + SQLITE_MAX_VARIABLES
+            chunk = illustration_ids[start:end]
+            cursor.execute(
+                f"""
+                SELECT id FROM downloaded WHERE id IN ({", ".join("?" * len(chunk))})
+                """,
+                chunk,
+            )
+            downloaded.update(row["id"] for row in cursor.fetchall())
+
+    return downloaded
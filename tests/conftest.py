@@ -0,0 +1,13 @@
+from pathlib import Path
+from shutil import copyfile
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point pixi at a fresh copy of the migrated test database."""
+    db_path = tmp_path / "db.sqlite3"
+    copyfile(Path(__file__).parent / "test.db", db_path)
+    monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+    return db_path
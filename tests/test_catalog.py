@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+
+from pixi.catalog import count, disk_size, record_illustration, search
+from pixi.database import database
+from pixi.errors import PixiError
+
+
+def _illustration(id_, title, artist_id, tags):
+    user = mock.Mock(id=artist_id)
+    # ``name`` is taken by Mock's constructor.
+    user.name = f"artist {artist_id}"
+    return mock.Mock(
+        id=id_,
+        title=title,
+        user=user,
+        tags=[
+            {"name": name, "translated_name": translated} for name, translated in tags
+        ],
+        page_count=1,
+        width=800,
+        height=600,
+        create_date=datetime(2020, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+def _catalog():
+    Path("1.jpg").write_bytes(b"a" * 10)
+    Path("2.png").write_bytes(b"b" * 20)
+    record_illustration(
+        _illustration(1, "Sunset beach", 7, [("海", "sea"), ("オリジナル", None)]),
+        Path("1.jpg"),
+    )
+    record_illustration(
+        _illustration(2, "Night city", 8, [("オリジナル", "original")]),
+        Path("2.png"),
+    )
+
+
+def test_record_illustration(db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+
+        (row,) = search(artist_id=7)
+        assert row["title"] == "Sunset beach"
+        assert row["artist"] == "artist 7"
+        assert row["size"] == 10
+        assert row["created"] == "2020-01-01T00:00:00+00:00"
+
+
+def test_record_illustration_replaces(db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+        record_illustration(_illustration(1, "Sunrise", 7, []), Path("1.jpg"))
+
+        assert [row["id"] for row in search("sunset")] == []
+        assert [row["id"] for row in search("sunrise")] == [1]
+        assert search(tag="海") == []
+
+
+@pytest.mark.parametrize(
+    "filters, ids",
+    [
+        ({"query": "beach"}, [1]),
+        ({"query": "sea"}, [1]),
+        ({"query": "オリジナル"}, [1, 2]),
+        ({"tag": "original"}, [2]),
+        ({"tag": "オリジナル", "artist_id": 8}, [2]),
+        ({"since": timedelta(days=1)}, [1, 2]),
+    ],
+)
+def test_search(filters, ids, db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+        assert sorted(row["id"] for row in search(**filters)) == ids
+
+
+def test_search_since_leaves_out_older(db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+        with database() as (conn, cursor):
+            cursor.execute(
+                """
+                UPDATE illustrations SET time = datetime('now', '-8 days')
+                WHERE id = 1
+                """
+            )
+
+        assert [row["id"] for row in search(since=timedelta(days=7))] == [2]
+
+
+def test_search_includes_path(db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+        with database() as (conn, cursor):
+            cursor.execute("INSERT INTO downloaded (id, path) VALUES (2, '/2.png')")
+
+        assert [row["path"] for row in search()] == ["/2.png", None]
+
+
+def test_search_invalid_query(db):
+    with CliRunner().isolated_filesystem():
+        with pytest.raises(PixiError):
+            search('"unbalanced')
+
+
+def test_count(db):
+    with CliRunner().isolated_filesystem():
+        _catalog()
+
+        rows = [tuple(row) for row in count("tag")]
+        assert rows == [("オリジナル", 2, None), ("海", 1, None)]
+        rows = [tuple(row) for row in count("tag", artist_id=8)]
+        assert rows == [("オリジナル", 1, None)]
+        rows = [tuple(row) for row in count("artist", query="night")]
+        assert rows == [("artist 8 (8)", 1, 20)]
+
+
+def test_disk_size():
+    with CliRunner().isolated_filesystem():
+        Path("folder").mkdir()
+        Path("folder/a.png").write_bytes(b"a" * 3)
+        Path("folder/b.png").write_bytes(b"b" * 4)
+        assert disk_size(Path("folder")) == 7
+        assert disk_size(Path("folder/a.png")) == 3
+        assert disk_size(Path("missing")) is None
@@ -1,21 +1,42 @@
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from pathlib import Path
 from unittest import mock
 
 import pytest
 from click.testing import CliRunner
-from pixivapi import LoginError
+from pixivapi import BadApiResponse, LoginError
+from requests import HTTPError, RequestException
 
-from pixi.client import Client, _PixivClient
+from pixi.client import RETRY_METHODS, Client, _hash_token, _PixivClient, _retry
 from pixi.errors import GoAuthenticate
 
 
 @dataclass
 class RequestResponse:
-    headers = {"Content-Length": 3072}
+    status_code: int = 200
+    headers: dict = field(default_factory=lambda: {"Content-Length": "2"})
+    chunks: tuple = (b"a", b"b")
 
-    def iter_content(*args, **kwargs):
-        return iter([b"a", b"b"])
+    def iter_content(self, *args, **kwargs):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(self.status_code)
+
+    def close(self):
+        pass
+
+
+def _client(*responses):
+    _PixivClient.authenticate = None
+    client = _PixivClient(authenticate=False)
+    client.session.get = mock.Mock(side_effect=responses)
+    return client
 
 
 @mock.patch("pixi.client.Config")
@@ -38,6 +59,7 @@ def test_get_client_crappy_refresh_token(authenticate, config):
 @mock.patch("pixi.client.Config")
 @mock.patch("pixi.client._PixivClient.authenticate")
 def test_working_get_client(authenticate, config):
+    config.return_value = {"pixi": {"refresh_token": "a"}}
     Client()
 
 
@@ -49,13 +71,36 @@ def test_get_client_no_authentication(authenticate, config):
     Client(authenticate=False)
 
 
-@mock.patch("pixi.client.ceil")
-@mock.patch("pixi.client.rename_duplicate_file")
-def test_client_download(rename_duplicate_file, ceil):
+@mock.patch("pixi.client.Config")
+@mock.patch("pixi.client._PixivClient.authenticate")
+def test_client_session_configured(_, config):
+    config.return_value = {
+        "pixi": {"refresh_token": "a", "pool_size": "64", "max_retries": "5"}
+    }
+    client = _PixivClient()
+
+    adapter = client.session.get_adapter("https://i.pximg.net")
+    assert adapter._pool_maxsize == 64
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == 64
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.backoff_factor == 0.5
+    assert "POST" not in adapter.max_retries.allowed_methods
+
+
+@mock.patch("pixi.client.Retry")
+def test_retry_old_urllib3(retry):
+    def old_retry(
+        total, backoff_factor, status_forcelist, raise_on_status, method_whitelist
+    ):
+        return method_whitelist
+
+    retry.side_effect = old_retry
+    assert _retry(3, 0.5) == RETRY_METHODS
+
+
+def test_client_download():
     with CliRunner().isolated_filesystem():
         destination = Path.cwd() / "filename.jpg"
-        rename_duplicate_file.return_value = destination
-        ceil.return_value = 3
 
         _PixivClient.authenticate = None
         client = _PixivClient(authenticate=False)
@@ -66,17 +111,274 @@ def test_client_download(rename_duplicate_file, ceil):
             assert "ab" == f.read()
 
 
-@mock.patch("pixi.client.rename_duplicate_file")
-def test_client_download_file_deletion(rename_duplicate_file):
+def test_client_download_renames():
     with CliRunner().isolated_filesystem():
-        destination = mock.Mock()
-        destination.open.side_effect = Exception
-        rename_duplicate_file.return_value = destination
+        destination = Path.cwd() / "filename.jpg"
+        destination.write_bytes(b"old")
+        client = _client(RequestResponse())
+        saved = client.download("haha not a url", destination)
 
-        _PixivClient.authenticate = None
-        client = _PixivClient(authenticate=False)
-        client.session.get = lambda *a, **k: RequestResponse()
-        with pytest.raises(Exception):
+        assert saved == Path.cwd() / "filename (1).jpg"
+        assert saved.read_bytes() == b"ab"
+        assert destination.read_bytes() == b"old"
+
+
+def test_client_download_encoded():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        client = _client(RequestResponse(headers={"Content-Encoding": "gzip"}))
+        client.download("haha not a url", destination)
+        assert destination.read_bytes() == b"ab"
+
+
+@mock.patch("pixi.client.PROGRESS_INTERVAL", 3600)
+@mock.patch("pixi.client.tqdm")
+def test_client_download_throttles_progress(tqdm):
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        client = _client(
+            RequestResponse(headers={"Content-Length": "3"}, chunks=(b"a", b"b", b"c"))
+        )
+        client.download("haha not a url", destination)
+
+        progress = tqdm.return_value.__enter__.return_value
+        assert progress.update.call_args_list == [mock.call(3)]
+
+
+def test_client_download_keeps_partial_file():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        client = _client(RequestResponse(chunks=(b"a", ConnectionError())))
+        with pytest.raises(ConnectionError):
+            client.download("haha not a url", destination)
+
+        assert not destination.exists()
+        with (Path.cwd() / "filename.jpg.part").open("r") as f:
+            assert "a" == f.read()
+
+
+def test_client_download_resumes_partial_file():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        (Path.cwd() / "filename.jpg.part").write_bytes(b"ab")
+        client = _client(
+            RequestResponse(
+                status_code=206,
+                headers={"Content-Length": "1", "Content-Range": "bytes 2-2/3"},
+                chunks=(b"c",),
+            )
+        )
+        client.download("haha not a url", destination)
+
+        headers = client.session.get.call_args[1]["headers"]
+        assert headers["Range"] == "bytes=2-"
+        assert destination.read_bytes() == b"abc"
+        assert not (Path.cwd() / "filename.jpg.part").exists()
+
+
+def test_client_download_resume_ignored():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        (Path.cwd() / "filename.jpg.part").write_bytes(b"xx")
+        client = _client(RequestResponse(chunks=(b"a", b"b")))
+        client.download("haha not a url", destination)
+        assert destination.read_bytes() == b"ab"
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        RequestResponse(status_code=416, headers={}),
+        RequestResponse(
+            status_code=206,
+            headers={"Content-Length": "1", "Content-Range": "bytes 0-0/3"},
+        ),
+    ],
+)
+def test_client_download_resume_mismatch(response):
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        (Path.cwd() / "filename.jpg.part").write_bytes(b"xx")
+        client = _client(response, RequestResponse(chunks=(b"a", b"b")))
+        client.download("haha not a url", destination)
+
+        assert "Range" not in client.session.get.call_args[1]["headers"]
+        assert destination.read_bytes() == b"ab"
+
+
+def test_client_download_incomplete():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        client = _client(RequestResponse(headers={"Content-Length": "3"}))
+        with pytest.raises(RequestException):
             client.download("haha not a url", destination)
+        assert not destination.exists()
+
+
+def test_client_download_http_error():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        client = _client(RequestResponse(status_code=404))
+        with pytest.raises(HTTPError):
+            client.download("haha not a url", destination)
+        assert not destination.exists()
+
+
+def test_client_download_throttled():
+    with CliRunner().isolated_filesystem():
+        destination = Path.cwd() / "filename.jpg"
+        response = RequestResponse(status_code=429, headers={"Retry-After": "30"})
+        client = _client(response)
+        with pytest.raises(HTTPError):
+            client.download("haha not a url", destination)
+        assert client.image_limiter.delay() >= 29
+
+
+def _api_response(status_code, headers=None):
+    return mock.Mock(
+        status_code=status_code,
+        headers=headers or {},
+        content=b"{}",
+        text="{}",
+        json=lambda: {"a": 1},
+    )
+
+
+@mock.patch("pixi.client.RateLimiter.wait")
+def test_client_request_json_retries_throttled(wait):
+    client = _client()
+    client.session.request = mock.Mock(
+        side_effect=[_api_response(403), _api_response(429), _api_response(200)]
+    )
+    assert client._request_json("GET", "url") == {"a": 1}
+    assert client.session.request.call_count == 3
+    assert wait.call_count == 3
+
+
+@mock.patch("pixi.client.RateLimiter.wait")
+def test_client_request_json_gives_up(_):
+    client = _client()
+    client.session.request = mock.Mock(return_value=_api_response(429))
+    with pytest.raises(BadApiResponse):
+        client._request_json("GET", "url")
+    assert client.session.request.call_count == 4
+
+
+@mock.patch("pixi.client.Config")
+@mock.patch("pixi.client._PixivClient.authenticate")
+def test_client_rate_limits_configured(_, config):
+    config.return_value = {
+        "pixi": {"refresh_token": "a", "image_bytes_per_second": "1048576"}
+    }
+    client = _PixivClient()
+    assert client.api_limiter.requests.rate == 2
+    assert client.api_limiter.bytes.rate == 0
+    assert client.image_limiter.bytes.rate == 1048576
+
+
+@mock.patch("pixi.client.RateLimiter.wait")
+def test_client_request_json_refreshes_expired_token(_):
+    client = _client()
+    client.authenticate = mock.Mock()
+    expired = _api_response(400)
+    expired.text = '{"error": {"message": "invalid_grant"}}'
+    client.session.request = mock.Mock(side_effect=[expired, _api_response(200)])
+
+    assert client._request_json("GET", "url") == {"a": 1}
+    client.authenticate.assert_called_once()
+
+
+def test_client_reauthenticate_stale_token():
+    client = _client()
+    client.authenticate = mock.Mock()
+    client.access_token = "new"
+    client.reauthenticate("old")
+    client.authenticate.assert_not_called()
+
+
+def test_client_reauthenticate_failed():
+    client = _client()
+    client.authenticate = mock.Mock(side_effect=LoginError)
+    with pytest.raises(GoAuthenticate):
+        client.reauthenticate()
+
+
+class FakeConfig(dict):
+    save = mock.Mock()
+
+
+def _token_config(expiry):
+    return FakeConfig(
+        pixi={
+            "refresh_token": "refresh",
+            "access_token": "cached",
+            "access_token_expiry": str(expiry),
+            "account_id": "7",
+            "account_name": "azuline",
+            "refresh_token_hash": _hash_token("refresh"),
+        }
+    )
+
+
+@mock.patch("pixi.client.Config")
+@mock.patch("pixi.client._PixivClient.authenticate")
+def test_client_uses_cached_token(authenticate, config):
+    config.return_value = _token_config(time.time() + 3000)
+    client = _PixivClient()
+
+    authenticate.assert_not_called()
+    assert client.access_token == "cached"
+    assert client.account.id == 7
+    assert client.session.headers["Authorization"] == "Bearer cached"
+
+
+@mock.patch("pixi.client.Config")
+@mock.patch("pixi.client._PixivClient.authenticate")
+def test_client_ignores_token_of_other_refresh_token(authenticate, config):
+    config.return_value = _token_config(time.time() + 3000)
+    config.return_value["pixi"]["refresh_token"] = "another"
+    _PixivClient()
+
+    authenticate.assert_called_once_with("another")
+
+
+@mock.patch("pixi.client.Config")
+def test_client_caches_new_token(config):
+    config.return_value = _token_config(time.time() + 60)
+
+    def authenticate(self, refresh_token):
+        self.access_token = "fresh"
+        self.access_token_expiry = 12345
+        self.account = mock.Mock(id=8, account="someone")
+
+    with mock.patch("pixi.client._PixivClient.authenticate", authenticate):
+        client = _PixivClient()
+
+    assert client.access_token == "fresh"
+    assert config.return_value["pixi"]["access_token"] == "fresh"
+    assert config.return_value["pixi"]["access_token_expiry"] == "12345"
+    assert config.return_value["pixi"]["account_id"] == "8"
+    assert config.return_value["pixi"]["refresh_token_hash"] == _hash_token("refresh")
+    config.return_value.save.assert_called()
+
+
+@mock.patch("pixi.client.RateLimiter.wait")
+def test_client_request_json_refreshes_expiring_token(_):
+    client = _client()
+    client.access_token_expiry = time.time() + 10
+    client.authenticate = mock.Mock()
+    client.session.request = mock.Mock(return_value=_api_response(200))
+
+    client._request_json("GET", "url")
+    client.authenticate.assert_called_once()
+
+
+def test_client_download_dedupe(db):
+    with CliRunner().isolated_filesystem():
+        client = _client(RequestResponse())
+        client.dedupe = "hardlink"
+        assert client.download("url/a", Path.cwd() / "a.jpg") == Path.cwd() / "a.jpg"
+        assert client.download("url/a", Path.cwd() / "b.jpg") == Path.cwd() / "b.jpg"
 
-        destination.unlink.assert_called()
+        assert client.session.get.call_count == 1
+        assert Path("a.jpg").stat().st_ino == Path("b.jpg").stat().st_ino
@@ -1,25 +1,22 @@
+import json
 from pathlib import Path
-from shutil import copyfile
 from unittest import mock
 
-import click
 from click.testing import CliRunner
 from pixivapi import BadApiResponse, LoginError, Visibility
 
 from pixi.commands import (
-    _confirm_table_wipe,
     _get_starting_bookmark_offset,
     artist,
     auth,
     bookmarks,
-    config,
-    failed,
     illust,
-    migrate,
-    wipe,
+    relayout,
+    retry_failed,
 )
-from pixi.database import Migration, database
 from pixi.errors import DownloadFailed, PixiError
+from pixi.progress import progress
+from pixi.timing import timings
 
 
 @mock.patch("pixi.commands.Config")
@@ -39,76 +36,7 @@ def test_auth_success(client, config):
 
     CliRunner().invoke(auth, ["-u", "u", "-p", "p"])
     assert config_dict["pixi"]["refresh_token"] == "token value"
-
-
-@mock.patch("click.edit")
-def test_edit_config_completed(edit, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        config_path = Path.cwd() / "config.ini"
-        with config_path.open("w") as f:
-            f.write("a bunch of text")
-
-        monkeypatch.setattr("pixi.commands.CONFIG_PATH", config_path)
-        edit.return_value = "text2"
-        result = runner.invoke(config)
-        assert result.output == "Edit completed.\n"
-
-        assert edit.called_with("a bunch of text")
-
-        with config_path.open("r") as f:
-            assert "text2" == f.read()
-
-
-@mock.patch("click.edit")
-def test_edit_config_aborted(edit, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        config_path = Path.cwd() / "config.ini"
-        with config_path.open("w") as f:
-            f.write("a bunch of text")
-
-        monkeypatch.setattr("pixi.commands.CONFIG_PATH", config_path)
-        edit.return_value = None
-        result = runner.invoke(config)
-        assert result.output == "Edit aborted.\n"
-
-        with config_path.open("r") as f:
-            assert "a bunch of text" == f.read()
-
-
-@mock.patch("pixi.commands.calculate_migrations_needed")
-def test_migrate(calculate, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        fake_mig = Path.cwd() / "0001.sql"
-        with fake_mig.open("w") as f:
-            f.write("INSERT INTO test (id) VALUES (29)")
-
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
-        with database() as (conn, cursor):
-            cursor.execute("CREATE TABLE test (id INTEGER PRIMARY KEY)")
-            cursor.execute("CREATE TABLE versions (version INTEGER PRIMARY KEY)")
-            conn.commit()
-
-        calculate.return_value = [Migration(path=fake_mig, version=9)]
-        runner.invoke(migrate)
-
-        with database() as (conn, cursor):
-            cursor.execute("SELECT version FROM versions")
-            assert 9 == cursor.fetchone()[0]
-            cursor.execute("SELECT id FROM test")
-            assert 29 == cursor.fetchone()[0]
-
-
-@mock.patch("pixi.commands.calculate_migrations_needed")
-def test_migrate_not_needed(calculate, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
-        calculate.return_value = []
-        result = runner.invoke(migrate)
-        assert isinstance(result.exception, SystemExit)
+    client.return_value.cache_token.assert_called_once_with(config_dict)
 
 
 @mock.patch("pixi.commands.download_image")
@@ -146,39 +74,204 @@ def test_illust_error(_, __, download_image):
     assert isinstance(result.exception, DownloadFailed)
 
 
+@mock.patch("pixi.commands.download_illustrations")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_illust_many(_, client, download_illustrations):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        Path("ids.txt").write_text(
+            "3\n\nhttps://www.pixiv.net/member_illust.php?illust_id=4\n1\n"
+        )
+        result = runner.invoke(
+            illust,
+            ["-d", str(Path.cwd()), "-f", "ids.txt", "--jobs", "8", "1", "2"],
+        )
+
+    assert result.exit_code == 0
+    client.assert_called_once()
+    args, kwargs = download_illustrations.call_args
+    assert args == (client.return_value, [1, 2, 3, 4])
+    assert kwargs["jobs"] == 8
+
+
+@mock.patch("pixi.commands.download_illustrations")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_illust_stdin(_, client, download_illustrations):
+    result = CliRunner().invoke(illust, ["--from-file", "-"], input="5\n6\n")
+    assert result.exit_code == 0
+    assert download_illustrations.call_args[0][1] == [5, 6]
+
+
+def test_illust_none_given():
+    result = CliRunner().invoke(illust, [])
+    assert isinstance(result.exception, PixiError)
+
+
+@mock.patch("pixi.commands.SyncState")
 @mock.patch("pixi.commands.download_pages")
 @mock.patch("pixi.commands.Client")
 @mock.patch("pixi.commands.Config")
-def test_artist(_, client, download_pages):
+def test_artist(_, client, download_pages, sync_state):
     CliRunner().invoke(
         artist,
         [
             "--page",
             "372",
+            "--jobs",
+            "4",
+            "--until-known",
+            "30",
             "https://www.pixiv.net/member.php?id=12345",
         ],
     )
     assert download_pages.call_args[1]["starting_offset"] == 371 * 30
+    assert download_pages.call_args[1]["jobs"] == 4
+    assert download_pages.call_args[1]["until_known"] == 30
 
     download_pages.call_args[0][0](222)
     fetch_user_illustrations = client.return_value.fetch_user_illustrations
     fetch_user_illustrations.assert_called_with(12345, offset=222)
 
+    sync_state.assert_called_with("artist", 12345)
+    assert download_pages.call_args[1]["checkpoint"] == (
+        sync_state.return_value.page_done
+    )
+    sync_state.return_value.finish.assert_called()
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_artist_resume(_, client, download_pages, sync_state):
+    sync_state.return_value.resume_point.return_value = (150, 6)
+    result = CliRunner().invoke(artist, ["--resume", "12345"])
+    assert "Resuming from page 6." in result.output
+    assert download_pages.call_args[1]["starting_offset"] == 150
+    assert download_pages.call_args[1]["start_page"] == 6
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_artist_resume_nothing_saved(_, client, download_pages, sync_state):
+    sync_state.return_value.resume_point.return_value = None
+    CliRunner().invoke(artist, ["--resume", "12345"])
+    assert download_pages.call_args[1]["starting_offset"] == 0
+    assert download_pages.call_args[1]["start_page"] == 1
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_artist_json_progress(_, client, download_pages, sync_state):
+    sync_state.return_value.resume_point.return_value = (150, 6)
+    try:
+        result = CliRunner().invoke(
+            artist, ["--progress", "json", "--quiet", "--resume", "12345"]
+        )
+        assert not progress.bars
+    finally:
+        progress.configure()
+
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [line["event"] for line in lines] == ["summary"]
+
 
+@mock.patch("pixi.commands.SyncState")
 @mock.patch("pixi.commands.download_pages")
 @mock.patch("pixi.commands.Client")
 @mock.patch("pixi.commands.Config")
-def test_bookmarks(_, client, download_pages):
+def test_artist_stats_and_profile(_, client, download_pages, sync_state):
+    def download_pages_(get_next_response, **kwargs):
+        timings.record("page", 0.5)
+
+    download_pages.side_effect = download_pages_
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        try:
+            result = runner.invoke(
+                artist, ["--stats", "--profile", "run.prof", "12345"]
+            )
+        finally:
+            timings.configure()
+        assert Path("run.prof").is_file()
+
+    assert result.exit_code == 0
+    assert "p95 (ms)" in result.output
+    assert "page" in result.output
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_artist_interrupted_stats(_, client, download_pages, sync_state):
+    def download_pages_(get_next_response, **kwargs):
+        timings.record("page", 0.5)
+        raise KeyboardInterrupt
+
+    download_pages.side_effect = download_pages_
+    try:
+        result = CliRunner().invoke(artist, ["--progress", "json", "--stats", "12345"])
+    finally:
+        progress.configure()
+        timings.configure()
+
+    # Click prints "Aborted!" after the events.
+    lines = [json.loads(line) for line in result.output.splitlines()[:2]]
+    assert [line["event"] for line in lines] == ["summary", "timings"]
+    assert "page" in lines[1]["stages"]
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_artist_resume_with_page(_, client, download_pages, sync_state):
+    result = CliRunner().invoke(artist, ["--resume", "--page", "3", "12345"])
+    assert isinstance(result.exception, PixiError)
+    download_pages.assert_not_called()
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_bookmarks(_, client, download_pages, sync_state):
     CliRunner().invoke(bookmarks)
     assert download_pages.call_count == 2
+    assert sync_state.return_value.finish.call_count == 2
+
+
+@mock.patch("pixi.commands.SyncState")
+@mock.patch("pixi.commands._get_starting_bookmark_offset")
+@mock.patch("pixi.commands.download_pages")
+@mock.patch("pixi.commands.Client")
+@mock.patch("pixi.commands.Config")
+def test_bookmarks_resume(_, client, download_pages, get_offset, sync_state):
+    client.return_value.account.id = 789
+    sync_state.return_value.resume_point.return_value = (831831, 4)
+    CliRunner().invoke(bookmarks, ["--visibility", "private", "--resume", "-g", "a"])
+
+    sync_state.assert_called_with("bookmarks", 789, "private", "a")
+    get_offset.assert_not_called()
+    assert download_pages.call_args[1]["starting_offset"] == 831831
+    assert download_pages.call_args[1]["start_page"] == 4
 
 
+@mock.patch("pixi.commands.SyncState")
 @mock.patch("pixi.commands.download_pages")
 @mock.patch("pixi.commands.Client")
 @mock.patch("pixi.commands.Config")
-def test_bookmarks_with_visibility(_, client, download_pages):
-    CliRunner().invoke(bookmarks, ["--visibility", "public"])
+def test_bookmarks_with_visibility(_, client, download_pages, __):
+    CliRunner().invoke(bookmarks, ["--visibility", "public", "--prefetch", "3"])
     assert download_pages.call_count == 1
+    assert download_pages.call_args[1]["prefetch"] == 3
 
     client.return_value.account.id = 789
     download_pages.call_args[0][0](10)
@@ -202,119 +295,28 @@ def test_get_starting_bookmark_offset_page_1():
     assert _get_starting_bookmark_offset(get_next_response, 1) is None
 
 
-def test_failed(monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        db_path = Path.cwd() / "db.sqlite3"
-        copyfile(Path(__file__).parent / "test.db", db_path)
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
-        with database() as (conn, cursor):
-            cursor.execute(
-                """
-                INSERT INTO FAILED (id, artist, title, time)
-                VALUES (?, ?, ?, ?)
-                """,
-                (
-                    20,
-                    "testing",
-                    "illustration",
-                    "2019-01-01T01:23:45-04:00",
-                ),
-            )
-
-        result = runner.invoke(failed)
-        assert result.output == (
-            "Jan 01, 2019 01:23:45 | testing - illustration\n"
-            "URL: https://www.pixiv.net/member_illust.php?mode=medium"
-            "&illust_id=20\n\n"
+@mock.patch("pixi.commands._retry_failed")
+def test_retry_failed(retry, monkeypatch):
+    retry.return_value = (5, 2)
+    with CliRunner().isolated_filesystem():
+        result = CliRunner().invoke(
+            retry_failed, ["-d", ".", "--max-age", "7d", "--jobs", "4"]
         )
 
+    assert result.output == "Retried 5 illustrations: 3 downloaded, 2 still failed.\n"
+    assert retry.call_args[1]["max_age"].days == 7
+    assert retry.call_args[1]["jobs"] == 4
 
-@mock.patch("pixi.commands._confirm_table_wipe")
-def test_wipe(_, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        db_path = Path.cwd() / "db.sqlite3"
-        copyfile(Path(__file__).parent / "test.db", db_path)
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
-
-        with database() as (conn, cursor):
-            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
-            cursor.execute(
-                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
-            )
-            conn.commit()
-
-        runner.invoke(wipe, "--table=all")
-
-        with database() as (conn, cursor):
-            cursor.execute("SELECT 1 FROM downloaded")
-            assert not cursor.fetchone()
-            cursor.execute("SELECT 1 FROM failed")
-            assert not cursor.fetchone()
-
-
-@mock.patch("pixi.commands._confirm_table_wipe")
-def test_wipe_single(_, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        db_path = Path.cwd() / "db.sqlite3"
-        copyfile(Path(__file__).parent / "test.db", db_path)
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
-
-        with database() as (conn, cursor):
-            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
-            cursor.execute(
-                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
-            )
-            conn.commit()
-
-        runner.invoke(wipe, "--table=failed")
 
-        with database() as (conn, cursor):
-            cursor.execute("SELECT 1 FROM downloaded")
-            assert cursor.fetchone()
-            cursor.execute("SELECT 1 FROM failed")
-            assert not cursor.fetchone()
-
-
-@mock.patch("pixi.commands._confirm_table_wipe")
-def test_wipe_failed(confirm, monkeypatch):
-    runner = CliRunner()
-    with runner.isolated_filesystem():
-        db_path = Path.cwd() / "db.sqlite3"
-        copyfile(Path(__file__).parent / "test.db", db_path)
-        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
-        confirm.side_effect = click.Abort
-
-        with database() as (conn, cursor):
-            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
-            cursor.execute(
-                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
-            )
-            conn.commit()
-
-        result = runner.invoke(wipe, "--table=all")
-        assert isinstance(result.exception, SystemExit)
-
-        with database() as (conn, cursor):
-            cursor.execute("SELECT 1 FROM downloaded")
-            assert cursor.fetchone()
-            cursor.execute("SELECT 1 FROM failed")
-            assert cursor.fetchone()
-
-
-def test_confirm_table_wipe():
-    result = CliRunner().invoke(
-        click.command()(lambda: _confirm_table_wipe("table")),
-        input="table",
-    )
-    assert not result.exception
-
-
-def test_confirm_table_wipe_fail():
-    result = CliRunner().invoke(
-        click.command()(lambda: _confirm_table_wipe("table")),
-        input="not table",
-    )
-    assert isinstance(result.exception, SystemExit)
+@mock.patch("pixi.commands._relayout")
+@mock.patch("pixi.commands.Config")
+def test_relayout(config, relayout_, monkeypatch):
+    config.return_value = {
+        "pixi": {"download_directory": ".", "layout": "{shard}/{id}"}
+    }
+    relayout_.return_value = (4, 1)
+    result = CliRunner().invoke(relayout, ["--dry-run"])
+
+    assert result.output == "Would move 4 illustrations; 1 missing from disk.\n"
+    assert relayout_.call_args[1]["layout"] == "{shard}/{id}"
+    assert relayout_.call_args[1]["dry_run"]
@@ -6,7 +6,13 @@ import pytest
 from click.testing import CliRunner
 
 from pixi import make_app_directories
-from pixi.config import Config, _validate_config, write_default_config
+from pixi.config import (
+    Config,
+    _save_config,
+    _validate_config,
+    get_setting,
+    write_default_config,
+)
 from pixi.errors import InvalidConfig
 
 
@@ -66,6 +72,32 @@ def test_save_config(monkeypatch):
         assert parser["pixi"]["test"] == "balls"
 
 
+def test_save_config_private(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        mock_config = Path.cwd() / "config.ini"
+        mock_config.touch(mode=0o644)
+        monkeypatch.setattr("pixi.config.CONFIG_PATH", mock_config)
+
+        Config().save()
+        assert mock_config.stat().st_mode & 0o777 == 0o600
+
+
+def test_save_config_atomic(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        mock_config = Path.cwd() / "config.ini"
+        mock_config.write_text("[pixi]\nrefresh_token = old\n")
+        monkeypatch.setattr("pixi.config.CONFIG_PATH", mock_config)
+
+        parser = ConfigParser()
+        parser.read_dict({"pixi": {"refresh_token": "new"}})
+        with mock.patch.object(parser, "write", side_effect=OSError):
+            with pytest.raises(OSError):
+                _save_config(parser)
+
+        assert mock_config.read_text() == "[pixi]\nrefresh_token = old\n"
+        assert list(Path.cwd().iterdir()) == [mock_config]
+
+
 def test_create_app_directories(monkeypatch):
     with CliRunner().isolated_filesystem():
         mock_dir = Path.cwd() / "cfgdir"
@@ -85,6 +117,7 @@ def test_write_default_config(monkeypatch):
         parser = ConfigParser()
         parser.read(mock_config)
         assert "pixi" in parser.sections()
+        assert mock_config.stat().st_mode & 0o777 == 0o600
 
 
 def test_dont_write_default_config(monkeypatch):
@@ -96,3 +129,20 @@ def test_dont_write_default_config(monkeypatch):
         write_default_config()
         with mock_config.open("r") as f:
             assert f.read() == "filler"
+
+
+def test_get_setting():
+    config = {"pixi": {"pool_size": "8", "retry_backoff": "1.5"}}
+    assert get_setting(config, "pool_size") == 8
+    assert get_setting(config, "retry_backoff", float) == 1.5
+
+
+def test_get_setting_default():
+    assert get_setting({"pixi": {"pool_size": ""}}, "pool_size") == 32
+    assert get_setting({"pixi": {}}, "max_retries") == 3
+
+
+def test_get_setting_invalid():
+    with pytest.raises(InvalidConfig) as e:
+        get_setting({"pixi": {"pool_size": "many"}}, "pool_size")
+    assert str(e.value) == "pool_size must be a number"
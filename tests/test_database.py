@@ -1,4 +1,6 @@
+import sqlite3
 from pathlib import Path
+from shutil import copyfile
 from unittest import mock
 
 import click
@@ -9,7 +11,12 @@ from pixi.database import (
     Migration,
     _find_migrations,
     _get_version,
+    _latest_migration,
+    batch_writes,
     calculate_migrations_needed,
+    check_database,
+    close_database,
+    commit_batch,
     confirm_database_is_updated,
     create_database_if_nonexistent,
     database,
@@ -27,6 +34,145 @@ def test_database_contextmanager(monkeypatch):
             assert cursor.fetchone()[0] == 1
 
 
+def test_database_connection_is_shared(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
+        with database() as (conn1, _):
+            pass
+        with database() as (conn2, cursor):
+            assert conn1 is conn2
+            cursor.execute("PRAGMA journal_mode")
+            assert cursor.fetchone()[0] == "wal"
+        close_database()
+
+
+def test_database_rolls_back_on_error(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with pytest.raises(ValueError):
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (1)")
+                raise ValueError
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT 1 FROM ham")
+            assert not cursor.fetchone()
+        close_database()
+
+
+def _count_rows(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute("SELECT COUNT(*) FROM ham").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_batch_writes(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with batch_writes():
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (1)")
+            assert _count_rows(db_path) == 0
+
+            commit_batch()
+            assert _count_rows(db_path) == 1
+
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (2)")
+            assert _count_rows(db_path) == 1
+
+        assert _count_rows(db_path) == 2
+        close_database()
+
+
+def test_batch_writes_rolls_back_failed_block(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with batch_writes():
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (1)")
+            with pytest.raises(ValueError):
+                with database() as (conn, cursor):
+                    cursor.execute("INSERT INTO ham (id) VALUES (2)")
+                    raise ValueError
+            with pytest.raises(ValueError):
+                with database() as (conn, cursor):
+                    cursor.execute("INSERT INTO ham (id) VALUES (3)")
+                    commit_batch()
+                    cursor.execute("INSERT INTO ham (id) VALUES (4)")
+                    raise ValueError
+
+        conn = sqlite3.connect(str(db_path))
+        assert conn.execute("SELECT id FROM ham").fetchall() == [(1,), (3,)]
+        conn.close()
+        close_database()
+
+
+def test_batch_writes_rolls_back_first_block(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with batch_writes():
+            with pytest.raises(ValueError):
+                with database() as (conn, cursor):
+                    cursor.execute("INSERT INTO ham (id) VALUES (1)")
+                    raise ValueError
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (2)")
+            assert _count_rows(db_path) == 0
+
+        assert _count_rows(db_path) == 1
+        close_database()
+
+
+def test_batch_writes_commits_on_interval(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        monkeypatch.setattr("pixi.database.BATCH_INTERVAL", 0)
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with batch_writes():
+            with database() as (conn, cursor):
+                cursor.execute("INSERT INTO ham (id) VALUES (1)")
+            assert _count_rows(db_path) == 1
+        close_database()
+
+
+def test_batch_writes_commits_on_error(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE ham(id INTEGER PRIMARY KEY)")
+
+        with pytest.raises(KeyboardInterrupt):
+            with batch_writes():
+                with database() as (conn, cursor):
+                    cursor.execute("INSERT INTO ham (id) VALUES (1)")
+                raise KeyboardInterrupt
+
+        assert _count_rows(db_path) == 1
+        close_database()
+
+
 def test_create_nonexistent_database(monkeypatch):
     with CliRunner().isolated_filesystem():
         monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
@@ -109,3 +255,46 @@ def test_get_version_empty_table(monkeypatch):
             conn.commit()
 
         assert 0 == _get_version()
+
+
+def test_check_database_writes_stamp(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        monkeypatch.setattr("pixi.database._latest_migration", lambda: 1)
+
+        check_database()
+        assert Path("schema_version").read_text() == f"1 {db_path.stat().st_ino}"
+
+
+@mock.patch("pixi.database.create_database_if_nonexistent")
+def test_check_database_cached(create, monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        db_path.touch()
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        monkeypatch.setattr("pixi.database._latest_migration", lambda: 3)
+        Path("schema_version").write_text(f"3 {db_path.stat().st_ino}")
+
+        check_database()
+        create.assert_not_called()
+
+
+@mock.patch("pixi.database.confirm_database_is_updated")
+@mock.patch("pixi.database.create_database_if_nonexistent")
+def test_check_database_stale_stamp(create, confirm, monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        monkeypatch.setattr("pixi.database._latest_migration", lambda: 99)
+        Path("schema_version").write_text(f"3 {db_path.stat().st_ino}")
+
+        check_database()
+        confirm.assert_called_once()
+        assert Path("schema_version").read_text().startswith("3 ")
+
+
+def test_latest_migration():
+    assert _latest_migration() == max(m.version for m in _find_migrations())
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+from pixivapi import Size
+
+from pixi.errors import PixiError
+from pixi.layout import DEFAULT_LAYOUT
+from pixi.ratelimit import RateLimiter
+from pixi.util import download_pages
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from pixi.engine import AsyncEngine, download_pages_async  # noqa: E402
+
+IMAGE = b"0123456789" * 100
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/missing"):
+            self.send_error(404)
+            return
+        if self.path.startswith("/private"):
+            if self.headers["Authorization"] != "Bearer new":
+                self.send_error(401)
+                return
+
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(IMAGE) - 1}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(IMAGE) - start))
+        self.end_headers()
+        self.wfile.write(IMAGE[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _illustration(server, id_, path=None):
+    url = f"{server}/{path or id_}.jpg"
+    return mock.Mock(id=id_, title="hi", meta_pages=[], image_urls={Size.ORIGINAL: url})
+
+
+def _client():
+    return mock.Mock(
+        session=mock.Mock(headers={}),
+        chunk_size=256,
+        image_limiter=RateLimiter(),
+        dedupe=None,
+        layout=DEFAULT_LAYOUT,
+    )
+
+
+@mock.patch("pixi.engine.record_finished")
+@mock.patch("pixi.engine.clear_failed")
+@mock.patch("pixi.engine.DuplicateFilter")
+@mock.patch("pixi.engine.Client")
+def test_download_pages_async(
+    client, dup_filter, clear_failed, record_finished, server
+):
+    client.return_value = _client()
+    dup_filter.return_value.filter.side_effect = lambda illustrations: illustrations
+    dup_filter.return_value.caught_up = False
+    checkpoint = mock.Mock()
+    get_next_response = mock.Mock(
+        side_effect=[
+            {"illustrations": [_illustration(server, i) for i in range(3)], "next": 3},
+            {"illustrations": [_illustration(server, 3)], "next": None},
+        ]
+    )
+
+    with CliRunner().isolated_filesystem():
+        download_pages_async(
+            get_next_response, 0, Path.cwd(), jobs=2, checkpoint=checkpoint
+        )
+        for i in range(4):
+            assert Path(f"{i}. hi.jpg").read_bytes() == IMAGE
+
+    assert record_finished.call_count == 4
+    assert [c[0][0] for c in checkpoint.call_args_list] == [1, 2]
+
+
+@mock.patch("pixi.engine.DuplicateFilter")
+@mock.patch("pixi.engine.Client")
+def test_download_pages_async_until_known(client, dup_filter):
+    client.return_value = _client()
+    dup_filter.return_value.filter.return_value = []
+    dup_filter.return_value.caught_up = True
+    get_next_response = mock.Mock(
+        side_effect=[
+            {"illustrations": [mock.Mock(id=1)], "next": 1},
+            {"illustrations": [mock.Mock(id=2)], "next": None},
+        ]
+    )
+
+    download_pages_async(get_next_response, 0, None, until_known=1, prefetch=0)
+    assert get_next_response.call_count == 1
+
+
+@mock.patch("pixi.engine.mark_failed")
+@mock.patch("pixi.engine.Client")
+def test_download_pages_async_failure(client, mark_failed, server):
+    client.return_value = _client()
+    illustration = _illustration(server, 1, path="missing")
+    get_next_response = mock.Mock(
+        return_value={"illustrations": [illustration], "next": None}
+    )
+
+    with CliRunner().isolated_filesystem():
+        Path("1. hi.jpg.part").write_bytes(IMAGE[:300])
+        download_pages_async(
+            get_next_response,
+            0,
+            Path.cwd(),
+            allow_duplicates=True,
+            track_download=False,
+        )
+        assert not Path("1. hi.jpg.part").exists()
+
+    mark_failed.assert_called_once_with(illustration, "not_found", mock.ANY)
+
+
+@mock.patch("pixi.engine.clear_failed")
+@mock.patch("pixi.engine.Client")
+def test_download_pages_async_reauthenticates(client, _, server):
+    client.return_value = _client()
+    client.return_value.access_token = "old"
+    client.return_value.session.headers = {"Authorization": "Bearer old"}
+
+    def reauthenticate(token):
+        client.return_value.access_token = "new"
+        client.return_value.session.headers["Authorization"] = "Bearer new"
+
+    client.return_value.reauthenticate.side_effect = reauthenticate
+    illustration = _illustration(server, 1, path="private")
+    get_next_response = mock.Mock(
+        return_value={"illustrations": [illustration], "next": None}
+    )
+
+    with CliRunner().isolated_filesystem():
+        download_pages_async(
+            get_next_response,
+            0,
+            Path.cwd(),
+            allow_duplicates=True,
+            track_download=False,
+        )
+        assert Path("1. hi.jpg").read_bytes() == IMAGE
+
+    client.return_value.reauthenticate.assert_called_once_with("old")
+
+
+@mock.patch("pixi.engine.Client")
+def test_download_pages_async_no_illustrations(client):
+    client.return_value = _client()
+    get_next_response = mock.Mock(return_value={"illustrations": [], "next": None})
+    with pytest.raises(PixiError):
+        download_pages_async(get_next_response, 0, None, allow_duplicates=True)
+
+
+def test_download_resumes_partial_file(server):
+    async def download(destination):
+        async with aiohttp.ClientSession() as http:
+            return await engine.download(
+                http, f"{server}/1.jpg", destination, "referer"
+            )
+
+    engine = AsyncEngine(_client(), None)
+    engine._transfers = asyncio.Semaphore(1)
+
+    with CliRunner().isolated_filesystem():
+        Path("1.jpg.part").write_bytes(IMAGE[:300])
+        assert asyncio.run(download(Path("1.jpg"))) == Path("1.jpg")
+        assert Path("1.jpg").read_bytes() == IMAGE
+        assert not Path("1.jpg.part").exists()
+
+
+@mock.patch("pixi.engine.download_pages_async")
+def test_download_pages_async_engine(download_pages_async):
+    download_pages(mock.Mock(), 0, None, track_download=False, engine="async")
+    download_pages_async.assert_called_once()
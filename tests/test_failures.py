@@ -0,0 +1,58 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from pixivapi import BadApiResponse
+from requests import ConnectionError, HTTPError, RequestException, Timeout
+
+from pixi.failures import (
+    AUTH,
+    MAX_RETRY_BACKOFF,
+    PERMANENT,
+    TRANSIENT,
+    backoff_delay,
+    classify,
+)
+
+
+def _http_error(status_code):
+    return HTTPError(response=mock.Mock(status_code=status_code))
+
+
+@pytest.mark.parametrize(
+    "exception, kind, reason",
+    [
+        (_http_error(404), PERMANENT, "not_found"),
+        (_http_error(410), PERMANENT, "not_found"),
+        (_http_error(400), PERMANENT, "http_400"),
+        (_http_error(403), TRANSIENT, "throttled"),
+        (_http_error(429), TRANSIENT, "throttled"),
+        (_http_error(503), TRANSIENT, "server_error"),
+        (_http_error(401), AUTH, "auth_expired"),
+        (BadApiResponse("Status code: 404", "{}"), PERMANENT, "not_found"),
+        (
+            BadApiResponse("Status code: 400", '{"error": "invalid_grant"}'),
+            AUTH,
+            "auth_expired",
+        ),
+        (BadApiResponse(), TRANSIENT, "bad_response"),
+        (Timeout(), TRANSIENT, "timeout"),
+        (asyncio.TimeoutError(), TRANSIENT, "timeout"),
+        (ConnectionError(), TRANSIENT, "connection_error"),
+        (RequestException("Incomplete download"), TRANSIENT, "network_error"),
+        (mock.Mock(spec=Exception, status=404), PERMANENT, "not_found"),
+    ],
+)
+def test_classify(exception, kind, reason):
+    assert classify(exception) == (kind, reason)
+
+
+@mock.patch("pixi.failures.random.uniform", lambda low, high: high)
+def test_backoff_delay():
+    assert [backoff_delay(attempt, 1) for attempt in range(4)] == [1, 2, 4, 8]
+    assert backoff_delay(20, 1) == MAX_RETRY_BACKOFF
+
+
+@mock.patch("pixi.failures.random.uniform", lambda low, high: low)
+def test_backoff_delay_jitter():
+    assert backoff_delay(2, 1) == 2
@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from click.testing import CliRunner
+
+from pixi.filenames import FilenameAllocator
+
+
+def test_allocate_free_name():
+    with CliRunner().isolated_filesystem():
+        path = FilenameAllocator().allocate(Path("file.jpg"))
+        assert path == Path("file.jpg")
+        assert path.exists()
+
+
+def test_allocate_numbers_collisions():
+    allocator = FilenameAllocator()
+    with CliRunner().isolated_filesystem():
+        Path("file.jpg").touch()
+        names = [allocator.allocate(Path("file.jpg")).name for _ in range(3)]
+        assert names == ["file (1).jpg", "file (2).jpg", "file (3).jpg"]
+
+
+def test_allocate_lists_directory_once():
+    allocator = FilenameAllocator()
+    with CliRunner().isolated_filesystem():
+        with mock.patch("pixi.filenames.os.listdir", wraps=os.listdir) as listdir:
+            for _ in range(5):
+                allocator.allocate(Path("file.jpg"))
+        listdir.assert_called_once()
+
+
+def test_allocate_skips_names_created_since_listing():
+    allocator = FilenameAllocator()
+    with CliRunner().isolated_filesystem():
+        allocator.allocate(Path("other.jpg"))
+        Path("file.jpg").touch()
+        Path("file (1).jpg").touch()
+        assert allocator.allocate(Path("file.jpg")) == Path("file (2).jpg")
+
+
+def test_allocate_parallel_writers_get_unique_names():
+    with CliRunner().isolated_filesystem():
+        allocators = [FilenameAllocator(), FilenameAllocator()]
+        with ThreadPoolExecutor(8) as pool:
+            paths = list(
+                pool.map(
+                    lambda i: allocators[i % 2].allocate(Path("file.jpg")), range(40)
+                )
+            )
+        assert len(set(paths)) == 40
+        assert len(os.listdir()) == 40
+
+
+def test_forget_relists_directory():
+    allocator = FilenameAllocator()
+    with CliRunner().isolated_filesystem():
+        allocator.allocate(Path("file.jpg"))
+        Path("file.jpg").unlink()
+        allocator.forget()
+        assert allocator.allocate(Path("file.jpg")) == Path("file.jpg")
+
+
+def test_release_frees_name():
+    allocator = FilenameAllocator()
+    with CliRunner().isolated_filesystem():
+        path = allocator.allocate(Path("file.jpg"))
+        path.unlink()
+        allocator.release(path)
+        assert allocator.allocate(Path("file.jpg")) == Path("file.jpg")
@@ -0,0 +1,70 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from pixi.errors import InvalidConfig
+from pixi.layout import (
+    DEFAULT_LAYOUT,
+    format_path,
+    illustration_path,
+    layout_fields,
+    layout_template,
+    name_pattern,
+)
+
+
+def test_format_path_default():
+    assert format_path(DEFAULT_LAYOUT, 1, "ti/tle") == Path("1. ti_tle")
+
+
+def test_format_path_sharded():
+    path = format_path("{artist_id}/{shard}/{id}. {title}", 123456, "hi", 42)
+    assert path == Path("42/456/123456. hi")
+
+
+def test_format_path_sanitizes_components():
+    assert format_path("{title}/{id}", 1, "..") == Path("_/1")
+
+
+def test_illustration_path():
+    illustration = mock.Mock(id=1, title="hi", user=mock.Mock(id=2))
+    assert illustration_path(illustration, "{artist_id}/{id}") == Path("2/1")
+
+
+def test_layout_fields():
+    assert layout_fields("{artist_id}/{id}. {title}") == {"artist_id", "id", "title"}
+
+
+@pytest.mark.parametrize(
+    "layout, name, groups",
+    [
+        (DEFAULT_LAYOUT, "12. a. b", {"id": "12", "title": "a. b"}),
+        ("{shard}/{id}", "5123", {"id": "5123"}),
+        (
+            "{artist_id}/{id} - {title} ({artist_id})",
+            "7 - t (2)",
+            {"id": "7", "title": "t"},
+        ),
+        ("{id}_{shard}", "42_042", {"id": "42"}),
+    ],
+)
+def test_name_pattern(layout, name, groups):
+    assert name_pattern(layout).fullmatch(name).groupdict() == groups
+
+
+def test_name_pattern_no_match():
+    assert not name_pattern("{shard}/{id}").fullmatch("12. title")
+
+
+def test_layout_template_default():
+    assert layout_template({"pixi": {"layout": ""}}) == DEFAULT_LAYOUT
+
+
+@pytest.mark.parametrize(
+    "layout",
+    ["{id", "{artist}/{id}", "/{id}", "{artist_id}/{title} {id}"],
+)
+def test_layout_template_invalid(layout):
+    with pytest.raises(InvalidConfig):
+        layout_template({"pixi": {"layout": layout}})
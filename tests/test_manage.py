@@ -0,0 +1,259 @@
+from configparser import ConfigParser
+from pathlib import Path
+from shutil import copyfile
+from unittest import mock
+
+import click
+from click.testing import CliRunner
+
+from pixi.database import Migration, database
+from pixi.manage import (
+    _confirm_table_wipe,
+    config,
+    failed,
+    migrate,
+    reindex,
+    search,
+    wipe,
+)
+from pixi.reindex import Reindexed
+
+
+@mock.patch("click.edit")
+def test_edit_config_completed(edit, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        config_path = Path.cwd() / "config.ini"
+        with config_path.open("w") as f:
+            f.write("a bunch of text")
+
+        monkeypatch.setattr("pixi.manage.CONFIG_PATH", config_path)
+        edit.return_value = "text2"
+        result = runner.invoke(config)
+        assert result.output == "Edit completed.\n"
+
+        assert edit.called_with("a bunch of text")
+
+        with config_path.open("r") as f:
+            assert "text2" == f.read()
+
+
+@mock.patch("click.edit")
+def test_edit_config_aborted(edit, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        config_path = Path.cwd() / "config.ini"
+        with config_path.open("w") as f:
+            f.write("a bunch of text")
+
+        monkeypatch.setattr("pixi.manage.CONFIG_PATH", config_path)
+        edit.return_value = None
+        result = runner.invoke(config)
+        assert result.output == "Edit aborted.\n"
+
+        with config_path.open("r") as f:
+            assert "a bunch of text" == f.read()
+
+
+@mock.patch("pixi.manage.calculate_migrations_needed")
+def test_migrate(calculate, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        fake_mig = Path.cwd() / "0001.sql"
+        with fake_mig.open("w") as f:
+            f.write("INSERT INTO test (id) VALUES (29)")
+
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
+        with database() as (conn, cursor):
+            cursor.execute("CREATE TABLE test (id INTEGER PRIMARY KEY)")
+            cursor.execute("CREATE TABLE versions (version INTEGER PRIMARY KEY)")
+            conn.commit()
+
+        calculate.return_value = [Migration(path=fake_mig, version=9)]
+        runner.invoke(migrate)
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT version FROM versions")
+            assert 9 == cursor.fetchone()[0]
+            cursor.execute("SELECT id FROM test")
+            assert 29 == cursor.fetchone()[0]
+
+
+@mock.patch("pixi.manage.calculate_migrations_needed")
+def test_migrate_not_needed(calculate, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", Path.cwd() / "db.sqlite3")
+        calculate.return_value = []
+        result = runner.invoke(migrate)
+        assert isinstance(result.exception, SystemExit)
+
+
+def test_failed(monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        with database() as (conn, cursor):
+            cursor.execute(
+                """
+                INSERT INTO FAILED (id, artist, title, time)
+                VALUES (?, ?, ?, ?)
+                """,
+                (
+                    20,
+                    "testing",
+                    "illustration",
+                    "2019-01-01T01:23:45-04:00",
+                ),
+            )
+
+        result = runner.invoke(failed)
+        assert result.output == (
+            "Jan 01, 2019 01:23:45 | testing - illustration\n"
+            "URL: https://www.pixiv.net/member_illust.php?mode=medium"
+            "&illust_id=20\n\n"
+        )
+
+
+@mock.patch("pixi.manage._confirm_table_wipe")
+def test_wipe(_, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+
+        with database() as (conn, cursor):
+            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
+            cursor.execute(
+                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
+            )
+            conn.commit()
+
+        runner.invoke(wipe, "--table=all")
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT 1 FROM downloaded")
+            assert not cursor.fetchone()
+            cursor.execute("SELECT 1 FROM failed")
+            assert not cursor.fetchone()
+
+
+@mock.patch("pixi.manage._confirm_table_wipe")
+def test_wipe_single(_, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+
+        with database() as (conn, cursor):
+            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
+            cursor.execute(
+                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
+            )
+            conn.commit()
+
+        runner.invoke(wipe, "--table=failed")
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT 1 FROM downloaded")
+            assert cursor.fetchone()
+            cursor.execute("SELECT 1 FROM failed")
+            assert not cursor.fetchone()
+
+
+@mock.patch("pixi.manage._confirm_table_wipe")
+def test_wipe_failed(confirm, monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        confirm.side_effect = click.Abort
+
+        with database() as (conn, cursor):
+            cursor.execute('INSERT INTO downloaded (id, path) VALUES (1, "a")')
+            cursor.execute(
+                'INSERT INTO FAILED (id, artist, title) VALUES (1, "a", "b")'
+            )
+            conn.commit()
+
+        result = runner.invoke(wipe, "--table=all")
+        assert isinstance(result.exception, SystemExit)
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT 1 FROM downloaded")
+            assert cursor.fetchone()
+            cursor.execute("SELECT 1 FROM failed")
+            assert cursor.fetchone()
+
+
+def test_confirm_table_wipe():
+    result = CliRunner().invoke(
+        click.command()(lambda: _confirm_table_wipe("table")),
+        input="table",
+    )
+    assert not result.exception
+
+
+def test_confirm_table_wipe_fail():
+    result = CliRunner().invoke(
+        click.command()(lambda: _confirm_table_wipe("table")),
+        input="not table",
+    )
+    assert isinstance(result.exception, SystemExit)
+
+
+@mock.patch("pixi.manage.catalog")
+def test_search(catalog):
+    catalog.COUNT_BY = ("artist", "tag")
+    catalog.search.return_value = [
+        {
+            "id": 1,
+            "title": "Sunset",
+            "artist": "someone",
+            "artist_id": 7,
+            "page_count": 2,
+            "width": 800,
+            "height": 600,
+            "path": "/dl/1. Sunset",
+        }
+    ]
+    result = CliRunner().invoke(search, ["beach", "--since", "7d", "-r", "7"])
+
+    assert result.output == (
+        "1. Sunset | someone (7) | 2 pages, 800x600\nPath: /dl/1. Sunset\n\n"
+    )
+    kwargs = catalog.search.call_args[1]
+    assert kwargs["query"] == "beach"
+    assert kwargs["artist_id"] == 7
+    assert kwargs["since"].days == 7
+
+
+@mock.patch("pixi.manage.catalog.count")
+def test_search_count(count):
+    count.return_value = [{"name": "オリジナル", "illustrations": 3, "size": 3 * 2**20}]
+    result = CliRunner().invoke(search, ["--count", "tag"])
+
+    assert result.output == "      3    3.0 MiB  オリジナル\n"
+    assert count.call_args[0] == ("tag",)
+
+
+@mock.patch("pixi.manage.Config")
+@mock.patch("pixi.manage._reindex")
+def test_reindex(reindex_, config_):
+    config_.return_value = ConfigParser()
+    config_.return_value.read_dict({"pixi": {"layout": "{shard}/{id}"}})
+    reindex_.return_value = Reindexed(5, 3, 1, [(9, "/dl/9. gone.jpg")])
+    with CliRunner().isolated_filesystem():
+        result = CliRunner().invoke(reindex, [".", "--jobs", "4"])
+
+    assert result.output == (
+        "Found 5 illustrations: 3 added, 1 moved.\n"
+        "Missing illustration 9 (recorded at /dl/9. gone.jpg).\n"
+        "1 orphaned rows; run with --prune to delete them.\n"
+    )
+    reindex_.assert_called_once_with(".", jobs=4, prune=False, layout="{shard}/{id}")
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+import pytest
+
+from pixi.errors import PixiError
+from pixi.options import parse_duration
+
+
+@pytest.mark.parametrize(
+    "string, duration",
+    [
+        ("90", timedelta(seconds=90)),
+        ("30m", timedelta(minutes=30)),
+        ("12h", timedelta(hours=12)),
+        ("7d", timedelta(days=7)),
+    ],
+)
+def test_parse_duration(string, duration):
+    assert parse_duration(string) == duration
+
+
+def test_parse_duration_invalid():
+    with pytest.raises(PixiError):
+        parse_duration("a week")
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from pixi.pool import DownloadPool, prefetch_pages
+
+
+def test_pool_runs_inline_with_one_job():
+    threads = []
+    with DownloadPool(1) as pool:
+        pool.submit(lambda: threads.append(threading.current_thread()))
+    assert threads == [threading.current_thread()]
+
+
+def test_pool_runs_tasks_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+    with DownloadPool(3) as pool:
+        for _ in range(3):
+            pool.submit(barrier.wait)
+
+
+def test_pool_bounds_running_tasks():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def task():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    with DownloadPool(2) as pool:
+        for _ in range(10):
+            pool.submit(task)
+
+    assert max(peak) <= 2
+
+
+def test_pool_reraises_task_errors():
+    def task():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        with DownloadPool(2) as pool:
+            pool.submit(task)
+
+
+def test_pool_wait():
+    done = []
+    with DownloadPool(2) as pool:
+        pool.submit(lambda: time.sleep(0.01) or done.append(1))
+        pool.wait()
+        assert done == [1]
+
+
+def test_pool_checkpoint_inline():
+    calls = []
+    with DownloadPool(1) as pool:
+        pool.submit(calls.append, 1)
+        pool.checkpoint(calls.append, "checkpoint")
+        pool.submit(calls.append, 2)
+    assert calls == [1, "checkpoint", 2]
+
+
+def test_pool_checkpoint_waits_for_earlier_tasks():
+    release = threading.Event()
+    calls = []
+
+    with DownloadPool(2) as pool:
+        pool.submit(release.wait, 5)
+        pool.checkpoint(calls.append, "checkpoint")
+        assert calls == []
+        release.set()
+        pool.wait()
+        assert calls == ["checkpoint"]
+
+
+def test_pool_checkpoint_dropped_on_error():
+    calls = []
+
+    def task():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        with DownloadPool(2) as pool:
+            pool.submit(task)
+            pool.checkpoint(calls.append, "checkpoint")
+    assert calls == []
+
+
+def _paginated(pages):
+    calls = []
+
+    def get_next_response(cursor):
+        calls.append(cursor)
+        return {"illustrations": [cursor], "next": pages.get(cursor)}
+
+    return get_next_response, calls
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 3])
+def test_prefetch_pages(prefetch):
+    get_next_response, calls = _paginated({None: 30, 30: 60})
+    responses = list(prefetch_pages(get_next_response, None, prefetch))
+    assert [r["illustrations"] for r in responses] == [[None], [30], [60]]
+    assert calls == [None, 30, 60]
+
+
+def test_prefetch_pages_fetches_ahead():
+    get_next_response, calls = _paginated({0: 1, 1: 2, 2: 3})
+    responses = prefetch_pages(get_next_response, 0, prefetch=2)
+    next(responses)
+
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+    # The current page plus two pages ahead, and no further.
+    assert calls == [0, 1, 2]
+    responses.close()
+
+
+def test_prefetch_pages_error():
+    def get_next_response(cursor):
+        if cursor:
+            raise ValueError
+        return {"illustrations": [], "next": 1}
+
+    responses = prefetch_pages(get_next_response, None, prefetch=1)
+    next(responses)
+    with pytest.raises(ValueError):
+        next(responses)
@@ -0,0 +1,90 @@
+import json
+from unittest import mock
+
+from pixi.progress import Progress
+
+
+def _lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_text_event_echoes_message(capsys):
+    progress = Progress("text")
+    progress.event("started", "Downloading illustration 1. hi.", id=1)
+    progress.event("finished", None, id=1)
+    assert capsys.readouterr().out == "Downloading illustration 1. hi.\n"
+    assert progress.counts == {"started": 1, "finished": 1}
+
+
+def test_json_event(capsys):
+    progress = Progress("json")
+    progress.event("started", "Downloading illustration 1. hi.", id=1, pages=2)
+    progress.echo("Not printed.")
+
+    (line,) = _lines(capsys)
+    assert line["event"] == "started"
+    assert line["id"] == 1
+    assert line["pages"] == 2
+    assert "time" in line
+
+
+def test_bars():
+    assert Progress("text").bars
+    assert not Progress("text", quiet=True).bars
+    assert not Progress("json").bars
+
+
+def test_stats():
+    progress = Progress("json")
+    progress.count("queued", 5)
+    progress.count("started", 3)
+    progress.count("finished", 2)
+    progress.add_bytes(4_000_000)
+
+    stats = progress.stats(now=progress.started + 2)
+    assert stats["items_per_second"] == 1
+    assert stats["mb_per_second"] == 2
+    assert stats["queued"] == 2
+    assert stats["active"] == 1
+    assert stats["finished"] == 2
+    assert stats["bytes"] == 4_000_000
+
+    # Rates are measured since the last stats.
+    progress.count("finished")
+    stats = progress.stats(now=progress.started + 3)
+    assert stats["items_per_second"] == 1
+    assert stats["mb_per_second"] == 0
+
+
+@mock.patch("pixi.progress.STATS_INTERVAL", 0)
+def test_json_reports_stats(capsys):
+    progress = Progress("json")
+    progress.event("finished", id=1)
+    progress.add_bytes(10)
+
+    assert [line["event"] for line in _lines(capsys)] == ["finished", "stats", "stats"]
+
+
+def test_json_stats_not_due(capsys):
+    progress = Progress("json")
+    progress.add_bytes(10)
+    assert capsys.readouterr().out == ""
+
+
+def test_finish(capsys):
+    progress = Progress("json")
+    progress.count("finished", 3)
+    progress.count("skipped")
+    progress.add_bytes(100)
+    progress.finish()
+
+    (summary,) = _lines(capsys)
+    assert summary["event"] == "summary"
+    assert summary["finished"] == 3
+    assert summary["skipped"] == 1
+    assert summary["bytes"] == 100
+
+
+def test_finish_text(capsys):
+    Progress("text").finish()
+    assert capsys.readouterr().out == ""
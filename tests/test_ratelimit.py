@@ -0,0 +1,72 @@
+from unittest import mock
+
+from pixi.ratelimit import MAX_BACKOFF, RateLimiter, TokenBucket, retry_after
+
+
+@mock.patch("pixi.ratelimit.time.monotonic")
+def test_token_bucket(monotonic):
+    monotonic.return_value = 100
+    bucket = TokenBucket(2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1
+
+    monotonic.return_value = 102
+    assert bucket.reserve() == 0
+
+
+@mock.patch("pixi.ratelimit.time.monotonic")
+def test_token_bucket_overdraw(monotonic):
+    monotonic.return_value = 100
+    bucket = TokenBucket(1024)
+    assert bucket.reserve(4096) == 3
+    monotonic.return_value = 103
+    assert bucket.reserve(1024) == 1
+
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    assert all(bucket.reserve(10**9) == 0 for _ in range(100))
+
+
+@mock.patch("pixi.ratelimit.random.uniform", lambda low, high: high)
+@mock.patch("pixi.ratelimit.time.monotonic")
+def test_rate_limiter_backoff(monotonic):
+    monotonic.return_value = 100
+    limiter = RateLimiter()
+    assert limiter.delay() == 0
+
+    assert limiter.throttled() == 1
+    assert limiter.throttled() == 2
+    assert limiter.throttled() == 4
+    assert limiter.delay() == 4
+
+    limiter.succeeded()
+    monotonic.return_value = 200
+    assert limiter.delay() == 0
+    assert limiter.throttled() == 4
+
+
+@mock.patch("pixi.ratelimit.random.uniform", lambda low, high: low)
+@mock.patch("pixi.ratelimit.time.monotonic")
+def test_rate_limiter_backoff_jitter_and_cap(monotonic):
+    monotonic.return_value = 100
+    limiter = RateLimiter()
+    for _ in range(20):
+        pause = limiter.throttled()
+    assert pause == MAX_BACKOFF / 2
+
+
+@mock.patch("pixi.ratelimit.time.monotonic")
+def test_rate_limiter_retry_after(monotonic):
+    monotonic.return_value = 100
+    limiter = RateLimiter()
+    assert limiter.throttled(retry_after=60) == 60
+    assert limiter.delay() == 60
+
+
+def test_retry_after():
+    assert retry_after({"Retry-After": "5"}) == 5
+    assert retry_after({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+    assert retry_after({}) is None
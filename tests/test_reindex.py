@@ -0,0 +1,129 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+
+from pixi.database import database
+from pixi.errors import PixiError
+from pixi.reindex import reindex, scan
+
+
+def _tree():
+    root = Path("dl").resolve()
+    (root / "12" / "3. pages").mkdir(parents=True)
+    (root / "12" / "3. pages" / "3_p0.png").touch()
+    (root / "1. image.jpg").touch()
+    (root / "1. image (1).jpg").touch()
+    (root / "2. a.b.png").touch()
+    (root / "4. partial.jpg.part").touch()
+    (root / "notes.txt").touch()
+    return root
+
+
+def _downloaded():
+    with database() as (conn, cursor):
+        cursor.execute("SELECT id, path, title FROM downloaded ORDER BY id")
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def test_scan():
+    with CliRunner().isolated_filesystem():
+        root = _tree()
+        assert scan(root, jobs=2) == (
+            {
+                1: (str(root / "1. image (1).jpg"), "image (1)"),
+                2: (str(root / "2. a.b.png"), "a.b"),
+                3: (str(root / "12" / "3. pages"), "pages"),
+            },
+            [str(root / "notes.txt")],
+        )
+
+
+def test_scan_layout():
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        (root / "123" / "5123").mkdir(parents=True)
+        (root / "123" / "5123" / "5123_p0.png").touch()
+        (root / "456" / "7. legacy").mkdir(parents=True)
+        (root / "456" / "456.jpg").touch()
+        (root / "8. flat.jpg").touch()
+
+        found, unparsed = scan(root, jobs=2, layout="{shard}/{id}")
+        assert found == {
+            456: (str(root / "456" / "456.jpg"), None),
+            5123: (str(root / "123" / "5123"), None),
+            7: (str(root / "456" / "7. legacy"), "legacy"),
+            8: (str(root / "8. flat.jpg"), "flat"),
+        }
+        assert unparsed == []
+
+
+def test_reindex(db):
+    with CliRunner().isolated_filesystem():
+        root = _tree()
+        with database() as (conn, cursor):
+            cursor.executemany(
+                "INSERT INTO downloaded (id, path, title) VALUES (?, ?, ?)",
+                [
+                    (2, str(root / "2. a.b.png"), "a.b"),
+                    (3, "/elsewhere/3. pages", "recorded"),
+                    (5, str(root / "5. gone.jpg"), None),
+                    (6, str(root), None),
+                    (7, "/elsewhere/7. other.jpg", None),
+                ],
+            )
+
+        result = reindex(root, jobs=2)
+
+        assert result.found == 3
+        assert result.added == 1
+        assert result.moved == 1
+        assert result.orphans == [(5, str(root / "5. gone.jpg")), (6, str(root))]
+        assert _downloaded() == [
+            (1, str(root / "1. image (1).jpg"), "image (1)"),
+            (2, str(root / "2. a.b.png"), "a.b"),
+            (3, str(root / "12" / "3. pages"), "recorded"),
+            (5, str(root / "5. gone.jpg"), None),
+            (6, str(root), None),
+            (7, "/elsewhere/7. other.jpg", None),
+        ]
+
+
+def test_reindex_prune(db):
+    with CliRunner().isolated_filesystem():
+        root = _tree()
+        with database() as (conn, cursor):
+            cursor.execute(
+                "INSERT INTO downloaded (id, path) VALUES (5, ?)",
+                (str(root / "5. gone.jpg"),),
+            )
+
+        (root / "notes.txt").unlink()
+        reindex(root, prune=True)
+        assert [row[0] for row in _downloaded()] == [1, 2, 3]
+
+
+def test_reindex_prune_unparsed(db):
+    with CliRunner().isolated_filesystem():
+        root = _tree()
+        with database() as (conn, cursor):
+            cursor.execute(
+                "INSERT INTO downloaded (id, path) VALUES (5, ?)",
+                (str(root / "5. gone.jpg"),),
+            )
+
+        with pytest.raises(PixiError):
+            reindex(root, prune=True)
+        assert [row[0] for row in _downloaded()] == [5]
+
+
+def test_reindex_writes_in_batches(monkeypatch, db):
+    monkeypatch.setattr("pixi.reindex.REINDEX_BATCH", 2)
+    with CliRunner().isolated_filesystem():
+        root = _tree()
+        with mock.patch("pixi.reindex.database", wraps=database) as database_:
+            reindex(root)
+        # One read of the recorded rows, then two batches of writes.
+        assert database_.call_count == 3
+        assert len(_downloaded()) == 3
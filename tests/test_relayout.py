@@ -0,0 +1,127 @@
+from pathlib import Path
+from unittest import mock
+
+from click.testing import CliRunner
+
+from pixi.database import database
+from pixi.relayout import relayout
+
+LAYOUT = "{artist_id}/{id}. {title}"
+
+
+def _insert_downloaded(*rows):
+    with database() as (conn, cursor):
+        cursor.executemany(
+            "INSERT INTO downloaded (id, path, title, artist_id) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+
+def _downloaded_paths():
+    with database() as (conn, cursor):
+        cursor.execute("SELECT id, path FROM downloaded ORDER BY id")
+        return [(row["id"], row["path"]) for row in cursor.fetchall()]
+
+
+def test_relayout(db):
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        (root / "2. folder").mkdir(parents=True)
+        (root / "2. folder" / "p0.png").write_bytes(b"page")
+        (root / "1. image.jpg").write_bytes(b"image")
+        _insert_downloaded(
+            (1, str(root / "1. image.jpg"), "image", 10),
+            (2, str(root / "2. folder"), "folder", 20),
+            (3, str(root / "3. gone.jpg"), "gone", 30),
+        )
+
+        assert relayout(root, LAYOUT) == (2, 1)
+
+        assert (root / "10" / "1. image.jpg").read_bytes() == b"image"
+        assert (root / "20" / "2. folder" / "p0.png").read_bytes() == b"page"
+        assert not (root / "1. image.jpg").exists()
+        assert _downloaded_paths() == [
+            (1, str(root / "10" / "1. image.jpg")),
+            (2, str(root / "20" / "2. folder")),
+            (3, str(root / "3. gone.jpg")),
+        ]
+
+
+def test_relayout_back_to_flat_prunes_folders(db):
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        (root / "10").mkdir(parents=True)
+        (root / "10" / "1. image.jpg").write_bytes(b"image")
+        _insert_downloaded((1, str(root / "10" / "1. image.jpg"), "image", 10))
+
+        assert relayout(root, "{id}. {title}") == (1, 0)
+        assert (root / "1. image.jpg").exists()
+        assert not (root / "10").exists()
+
+
+def test_relayout_updates_stored_files(db):
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        (root / "2. folder").mkdir(parents=True)
+        (root / "2. folder" / "p0.png").write_bytes(b"page")
+        _insert_downloaded((2, str(root / "2. folder"), "folder", 20))
+        with database() as (conn, cursor):
+            cursor.execute(
+                "INSERT INTO files (path, url, hash, size) VALUES (?, 'u', 'h', 4)",
+                (str(root / "2. folder" / "p0.png"),),
+            )
+
+        relayout(root, LAYOUT)
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT path FROM files")
+            assert cursor.fetchone()["path"] == str(
+                root / "20" / "2. folder" / "p0.png"
+            )
+
+
+def test_relayout_dry_run(db):
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        root.mkdir()
+        (root / "1. image.jpg").write_bytes(b"image")
+        _insert_downloaded((1, str(root / "1. image.jpg"), "image", 10))
+
+        assert relayout(root, LAYOUT, dry_run=True) == (1, 0)
+        assert (root / "1. image.jpg").exists()
+        assert _downloaded_paths() == [(1, str(root / "1. image.jpg"))]
+
+
+@mock.patch("pixi.relayout.Client")
+def test_relayout_flat_rows_look_up_artists(client, db):
+    client.return_value.fetch_illustration.return_value = mock.Mock(
+        title="image", user=mock.Mock(id=10)
+    )
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        root.mkdir()
+        (root / "1. image.jpg").write_bytes(b"image")
+        (root / "1. image.jpg.part").write_bytes(b"partial")
+        # Downloads recorded before layouts hold the download directory.
+        _insert_downloaded((1, str(root), None, None))
+
+        assert relayout(root, LAYOUT) == (1, 0)
+        assert (root / "10" / "1. image.jpg").exists()
+        client.return_value.fetch_illustration.assert_called_once_with(1)
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT title, artist_id FROM downloaded")
+            assert tuple(cursor.fetchone()) == ("image", 10)
+
+
+@mock.patch("pixi.relayout.Client")
+def test_relayout_flat_rows_parse_titles(client, db):
+    with CliRunner().isolated_filesystem():
+        root = Path("dl").resolve()
+        root.mkdir()
+        (root / "123. a.b.jpg").write_bytes(b"image")
+        _insert_downloaded((123, str(root), None, None))
+
+        assert relayout(root, "{shard}/{id}. {title}") == (1, 0)
+        assert (root / "123" / "123. a.b.jpg").exists()
+        client.assert_not_called()
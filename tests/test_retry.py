@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+from click.testing import CliRunner
+from pixivapi import BadApiResponse
+
+from pixi.database import database
+from pixi.errors import DownloadFailed
+from pixi.retry import (
+    _still_failed,
+    failed_entries,
+    is_due,
+    record_failed_attempt,
+    retry_failed,
+)
+
+NOW = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def _insert_failed(*rows):
+    with database() as (conn, cursor):
+        cursor.executemany(
+            """
+            INSERT INTO failed (id, artist, title, attempts, time)
+            VALUES (?, 'artist', 'title', ?, datetime('now', ?))
+            """,
+            rows,
+        )
+
+
+def test_is_due():
+    entry = {"attempts": 1, "last_attempt": "2020-01-01 11:58:00"}
+    assert is_due(entry, now=NOW)
+    entry = {"attempts": 3, "last_attempt": "2020-01-01 11:58:00"}
+    assert not is_due(entry, now=NOW)
+    entry = {"attempts": 100, "last_attempt": "2019-12-31 11:59:00"}
+    assert is_due(entry, now=NOW)
+
+
+def test_failed_entries_max_age(db):
+    with CliRunner().isolated_filesystem():
+        _insert_failed((1, 1, "-1 hours"), (2, 1, "-3 days"))
+
+        assert [row["id"] for row in failed_entries()] == [2, 1]
+        assert [row["id"] for row in failed_entries(timedelta(days=1))] == [1]
+
+
+def test_record_failed_attempt(db):
+    with CliRunner().isolated_filesystem():
+        _insert_failed((1, 1, "-1 hours"))
+        record_failed_attempt(1, "not_found", "Status code: 404")
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT * FROM failed")
+            row = cursor.fetchone()
+        assert row["attempts"] == 2
+        assert row["reason"] == "not_found"
+        assert row["last_error"] == "Status code: 404"
+
+
+def test_still_failed(db, monkeypatch):
+    monkeypatch.setattr("pixi.retry.SQLITE_MAX_VARIABLES", 2)
+    _insert_failed((1, 1, "-1 hours"), (3, 1, "-1 hours"), (4, 1, "-1 hours"))
+
+    assert _still_failed([1, 2, 3]) == {1, 3}
+
+
+@mock.patch("pixi.util.download_image")
+@mock.patch("pixi.retry.Client")
+def test_retry_failed(client, download_image, db):
+    def download(illustration, **kwargs):
+        if illustration.id == 2:
+            raise DownloadFailed("timeout")
+        with database() as (conn, cursor):
+            cursor.execute("DELETE FROM failed WHERE id = ?", (illustration.id,))
+
+    client.return_value.fetch_illustration.side_effect = lambda id_: (
+        mock.Mock(id=id_, title="hi")
+    )
+    download_image.side_effect = download
+
+    with CliRunner().isolated_filesystem():
+        _insert_failed((1, 1, "-1 hours"), (2, 1, "-1 hours"), (3, 5, "-10 minutes"))
+
+        assert retry_failed(Path.cwd(), jobs=2) == (2, 1)
+        assert download_image.call_count == 2
+
+
+@mock.patch("pixi.util.download_image")
+@mock.patch("pixi.retry.Client")
+def test_retry_failed_lookup_error(client, download_image, db):
+    client.return_value.fetch_illustration.side_effect = BadApiResponse(
+        "Status code: 404", "{}"
+    )
+
+    with CliRunner().isolated_filesystem():
+        _insert_failed((1, 1, "-1 hours"))
+
+        assert retry_failed(Path.cwd()) == (1, 1)
+        download_image.assert_not_called()
+        with database() as (conn, cursor):
+            cursor.execute("SELECT attempts, reason FROM failed")
+            assert tuple(cursor.fetchone()) == (2, "not_found")
+
+
+@mock.patch("pixi.util.download_image")
+@mock.patch("pixi.retry.Client")
+def test_retry_failed_already_downloaded(client, download_image, db):
+    with CliRunner().isolated_filesystem():
+        _insert_failed((1, 1, "-1 hours"))
+        with database() as (conn, cursor):
+            cursor.execute("INSERT INTO downloaded (id, path) VALUES (1, 'x')")
+
+        assert retry_failed(Path.cwd()) == (1, 0)
+        client.return_value.fetch_illustration.assert_not_called()
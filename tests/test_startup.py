@@ -0,0 +1,106 @@
+"""
+Startup tests and a cold-start benchmark. Each command is run in a fresh
+interpreter against a temporary config and database. Run this file directly
+to print every command's median cold-start latency:
+
+    python tests/test_startup.py
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from pixi import COMMANDS, commandgroup
+
+# The modules that only download commands should pay for.
+HEAVY_MODULES = ["pixivapi", "requests", "tqdm", "pixi.client"]
+
+RUN_PIXI = """
+import json, sys
+sys.argv = ["pixi", *json.loads(sys.argv[1])]
+try:
+    from pixi.__main__ import run
+    run()
+finally:
+    print(json.dumps([m for m in {heavy} if m in sys.modules]), file=sys.stderr)
+""".format(
+    heavy=HEAVY_MODULES
+)
+
+
+@pytest.fixture(scope="module")
+def pixi_home(tmp_path_factory):
+    home = tmp_path_factory.mktemp("home")
+    _run_pixi(home, "migrate")
+    return home
+
+
+def _run_pixi(home, *args):
+    env = {
+        **os.environ,
+        "XDG_CONFIG_HOME": str(home / "config"),
+        "XDG_DATA_HOME": str(home / "data"),
+        "PYTHONPATH": str(Path(__file__).parent.parent),
+    }
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", RUN_PIXI, json.dumps(args)],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    return result, json.loads(result.stderr.splitlines()[-1]), elapsed
+
+
+def test_lazy_command_help_matches_docstrings():
+    for name, (module, short_help) in COMMANDS.items():
+        __import__(module)
+        assert commandgroup.commands[name].get_short_help_str(100) == short_help
+
+
+def test_help_imports_no_commands(pixi_home):
+    result, heavy, _ = _run_pixi(pixi_home, "--help")
+    assert "retry-failed" in result.stdout
+    assert heavy == []
+
+
+@pytest.mark.parametrize(
+    "command", ["config", "failed", "migrate", "reindex", "search", "wipe"]
+)
+def test_cheap_commands_skip_download_stack(pixi_home, command):
+    _, heavy, _ = _run_pixi(pixi_home, command, "--help")
+    assert heavy == []
+
+
+def test_download_commands_load_download_stack(pixi_home):
+    _, heavy, _ = _run_pixi(pixi_home, "illust", "--help")
+    assert heavy == HEAVY_MODULES
+
+
+@pytest.mark.parametrize("command", sorted(COMMANDS))
+def test_cold_start_latency(pixi_home, command, record_property):
+    timings = [_run_pixi(pixi_home, command, "--help")[2] for _ in range(3)]
+    record_property("cold_start_seconds", statistics.median(timings))
+
+
+def _benchmark(runs=10):
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as home:
+        home = Path(home)
+        _run_pixi(home, "migrate")
+        for args in [["--help"]] + [[command, "--help"] for command in COMMANDS]:
+            timings = [_run_pixi(home, *args)[2] for _ in range(runs)]
+            median = statistics.median(timings) * 1000
+            print(f"pixi {' '.join(args):<20} {median:7.1f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,126 @@
+import hashlib
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+
+from pixi.database import database
+from pixi.errors import InvalidConfig
+from pixi.storage import (
+    HashingWriter,
+    dedupe_mode,
+    hash_file,
+    link_known_file,
+    new_hash,
+    store_file,
+)
+
+
+@pytest.fixture(autouse=True)
+def cwd(tmp_path, monkeypatch):
+    # Files are stored relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+
+
+def _partial(name, content):
+    path = Path(f"{name}.part")
+    path.write_bytes(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def test_dedupe_mode():
+    assert dedupe_mode({"pixi": {"dedupe": ""}}) is None
+    assert dedupe_mode({"pixi": {}}) is None
+    assert dedupe_mode({"pixi": {"dedupe": "reflink"}}) == "reflink"
+    with pytest.raises(InvalidConfig):
+        dedupe_mode({"pixi": {"dedupe": "symlink"}})
+
+
+def test_hashing_writer():
+    with CliRunner().isolated_filesystem():
+        with open("a", "wb") as f:
+            writer = HashingWriter(f, new_hash())
+            writer.write(b"ab")
+            writer.write(memoryview(b"cd"))
+        assert writer.hash.hexdigest() == hashlib.sha256(b"abcd").hexdigest()
+        assert hash_file("a", new_hash()).hexdigest() == writer.hash.hexdigest()
+
+
+@pytest.mark.parametrize("mode", ["hardlink", "reflink"])
+def test_store_file_links_same_content(db, mode):
+    partial, digest = _partial("a.png", b"image")
+    first = store_file(partial, Path("a.png"), "url/a", digest, mode)
+
+    partial, digest = _partial("b.png", b"image")
+    second = store_file(partial, Path("b.png"), "url/b", digest, mode)
+
+    assert second.read_bytes() == b"image"
+    assert not partial.exists()
+    if mode == "hardlink":
+        assert first.stat().st_ino == second.stat().st_ino
+
+
+def test_store_file_different_content(db):
+    partial, digest = _partial("a.png", b"image")
+    store_file(partial, Path("a.png"), "url/a", digest, "hardlink")
+    partial, digest = _partial("b.png", b"other")
+    store_file(partial, Path("b.png"), "url/b", digest, "hardlink")
+
+    assert Path("a.png").stat().st_ino != Path("b.png").stat().st_ino
+    assert Path("b.png").read_bytes() == b"other"
+
+
+def test_store_file_taken_name(db):
+    Path("a.png").write_bytes(b"taken")
+    partial, digest = _partial("a.png", b"image")
+    assert store_file(partial, Path("a.png"), "url", digest, "hardlink") == Path(
+        "a (1).png"
+    )
+
+
+def test_link_known_file(db):
+    partial, digest = _partial("a.png", b"image")
+    store_file(partial, Path("a.png"), "url/a", digest, "hardlink")
+
+    assert link_known_file("url/a", Path("b.png"), "hardlink") == Path("b.png")
+    assert Path("b.png").stat().st_ino == Path("a.png").stat().st_ino
+    assert link_known_file("url/c", Path("c.png"), "hardlink") is None
+
+
+def test_link_known_file_forgets_missing(db):
+    partial, digest = _partial("a.png", b"image")
+    store_file(partial, Path("a.png"), "url/a", digest, "hardlink")
+    Path("a.png").unlink()
+
+    assert link_known_file("url/a", Path("b.png"), "hardlink") is None
+    with database() as (conn, cursor):
+        cursor.execute("SELECT COUNT(*) FROM files")
+        assert cursor.fetchone()[0] == 0
+
+
+@mock.patch("pixi.storage.os.link")
+def test_store_file_cross_device(link, db):
+    link.side_effect = OSError(18, "Invalid cross-device link")
+    partial, digest = _partial("a.png", b"image")
+    store_file(partial, Path("a.png"), "url/a", digest, "hardlink")
+    partial, digest = _partial("b.png", b"image")
+    store_file(partial, Path("b.png"), "url/b", digest, "hardlink")
+
+    assert Path("b.png").read_bytes() == b"image"
+    assert not partial.exists()
+
+
+def test_link_known_file_cross_device_releases_name(db):
+    partial, digest = _partial("a.png", b"image")
+    store_file(partial, Path("a.png"), "url/a", digest, "hardlink")
+
+    with mock.patch("pixi.storage.os.link") as link:
+        link.side_effect = OSError(18, "Invalid cross-device link")
+        assert link_known_file("url/a", Path("b.png"), "hardlink") is None
+    assert not Path("b.png").exists()
+
+    partial, digest = _partial("b.png", b"other")
+    assert store_file(partial, Path("b.png"), "url/b", digest, "hardlink") == Path(
+        "b.png"
+    )
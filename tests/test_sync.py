@@ -0,0 +1,46 @@
+from unittest import mock
+
+from click.testing import CliRunner
+
+from pixi.database import database
+from pixi.sync import SyncState
+
+
+def _page(next_, ids):
+    return {
+        "illustrations": [mock.Mock(id=id_) for id_ in ids],
+        "next": next_,
+    }
+
+
+def test_resume_point_nothing_saved(db):
+    with CliRunner().isolated_filesystem():
+        assert SyncState("artist", 1).resume_point() is None
+
+
+def test_page_done(db):
+    with CliRunner().isolated_filesystem():
+        sync = SyncState("bookmarks", 1, "public", None)
+        sync.page_done(1, _page(831831, [99, 98]))
+        sync.page_done(2, _page(831000, [97, 96]))
+
+        assert sync.resume_point() == (831000, 3)
+        assert SyncState("bookmarks", 1, "private", None).resume_point() is None
+        assert SyncState("bookmarks", 1, "public", "tag").resume_point() is None
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT newest_id FROM sync_state")
+            assert cursor.fetchone()["newest_id"] == 99
+
+
+def test_finish(db):
+    with CliRunner().isolated_filesystem():
+        sync = SyncState("artist", 1)
+        sync.page_done(1, _page(30, [99]))
+        sync.finish()
+        assert sync.resume_point() is None
+
+        # The newest illustration seen is kept across crawls.
+        with database() as (conn, cursor):
+            cursor.execute("SELECT newest_id FROM sync_state")
+            assert cursor.fetchone()["newest_id"] == 99
@@ -0,0 +1,97 @@
+import asyncio
+import pstats
+import threading
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from pixi.timing import Timings, percentile, profiling
+
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 95) == 95
+    assert percentile(ordered, 99) == 99
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_timer_disabled():
+    timings = Timings()
+    with timings.timer("page"):
+        pass
+    assert not timings.samples
+
+
+def test_timer():
+    timings = Timings()
+    timings.configure(enabled=True)
+    for _ in range(3):
+        with timings.timer("page"):
+            pass
+    assert len(timings.samples["page"]) == 3
+
+
+def test_timed():
+    timings = Timings()
+    timings.configure(enabled=True)
+
+    @timings.timed("database")
+    def query(value):
+        return value
+
+    @timings.timed("transfer")
+    async def transfer(value):
+        return value
+
+    assert query(1) == 1
+    assert asyncio.run(transfer(2)) == 2
+    assert list(timings.samples) == ["database", "transfer"]
+
+
+def test_summary():
+    timings = Timings()
+    for seconds in [0.1] * 98 + [1, 2]:
+        timings.record("page", seconds)
+
+    summary = timings.summary()["page"]
+    assert summary["count"] == 100
+    assert round(summary["total"], 2) == 12.8
+    assert summary["p50"] == 0.1
+    assert summary["p95"] == 0.1
+    assert summary["p99"] == 1
+
+
+def test_format_summary():
+    timings = Timings()
+    timings.record("page", 0.25)
+    timings.record("record_download", 0.002)
+
+    lines = timings.format_summary().splitlines()
+    assert lines[0].split()[:2] == ["Stage", "Count"]
+    assert lines[0].endswith("p99 (ms)")
+    assert lines[1].split() == ["page", "1", "0.25", "250.0", "250.0", "250.0"]
+    assert lines[2].split() == ["record_download", "1", "0.00", "2.0", "2.0", "2.0"]
+
+
+def _work_in_thread():
+    return sum(range(1000))
+
+
+def test_profiling_threads():
+    with CliRunner().isolated_filesystem():
+        with profiling(Path("run.prof")):
+            thread = threading.Thread(target=_work_in_thread)
+            thread.start()
+            thread.join()
+
+        functions = pstats.Stats("run.prof").stats
+        assert any(name == "_work_in_thread" for _, _, name in functions)
+
+
+def test_profiling_disabled():
+    with CliRunner().isolated_filesystem():
+        with profiling(None):
+            pass
+        assert not list(Path.cwd().iterdir())
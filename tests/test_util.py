@@ -1,3 +1,7 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
 from pathlib import Path
 from shutil import copyfile
 from unittest import mock
@@ -5,18 +9,24 @@ from unittest import mock
 import pytest
 from click.testing import CliRunner
 from pixivapi import BadApiResponse, Size
+from requests import HTTPError, RequestException
 
-from pixi.database import database
+from pixi.database import batch_writes, database
 from pixi.errors import DownloadFailed, DuplicateImage, InvalidURL, PixiError
+from pixi.layout import DEFAULT_LAYOUT
+from pixi.progress import Progress
 from pixi.util import (
     check_duplicate,
     clear_failed,
+    download_illustrations,
     download_image,
+    download_meta_pages,
     download_pages,
-    format_filename,
+    find_downloaded,
     mark_failed,
     parse_id,
     record_download,
+    record_finished,
     rename_duplicate_file,
     resolve_track_download,
 )
@@ -71,10 +81,6 @@ def test_rename_duplicate_file_doesnt_exist():
         assert new_path == Path.cwd() / "file.jpg"
 
 
-def test_format_filename():
-    assert "id. titl_e" == format_filename("id", "titl/e")
-
-
 @pytest.mark.parametrize(
     "track_download, directory, result",
     [
@@ -87,50 +93,271 @@ def test_resolve_track_download(track_download, directory, result):
     assert result == resolve_track_download(track_download, directory)
 
 
-@mock.patch("pixi.util.format_filename")
+@mock.patch("pixi.util.illustration_path")
 @mock.patch("pixi.util.check_duplicate")
 @mock.patch("pixi.util.clear_failed")
-@mock.patch("pixi.util.record_download")
-def test_download_illust(_, __, ___, format_filename):
-    format_filename.return_value = "1. image"
-    illustration = mock.Mock()
-    illustration.client = mock
-    illustration.meta_pages = False
+@mock.patch("pixi.util.record_finished")
+def test_download_illust(record_finished, _, __, illustration_path):
+    illustration_path.return_value = Path("1. image")
+    illustration = _illustration()
+
+    with CliRunner().isolated_filesystem():
+        download_image(illustration, directory=Path.cwd())
+
+        illustration.client.download.assert_called_with(
+            url="https://i.pximg.net/img/1_p0.jpg",
+            destination=Path.cwd() / "1. image.jpg",
+            referer=mock.ANY,
+        )
+        record_finished.assert_called_once_with(
+            illustration, Path.cwd() / "1. image.jpg"
+        )
+
+
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.clear_failed")
+@mock.patch("pixi.util.record_finished")
+def test_download_illust_renamed(record_finished, _, __):
+    illustration = _illustration()
+
+    with CliRunner().isolated_filesystem():
+        saved = Path.cwd() / "1. hi (1).jpg"
+        illustration.client.download.side_effect = None
+        illustration.client.download.return_value = saved
+        download_image(illustration, directory=Path.cwd())
+
+        record_finished.assert_called_once_with(illustration, saved)
+
+
+@mock.patch("pixi.util.progress", new_callable=lambda: Progress("json"))
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.clear_failed")
+@mock.patch("pixi.util.record_finished")
+def test_download_illust_json_progress(_, __, ___, progress, capsys):
+    illustration = _illustration()
+
+    with CliRunner().isolated_filesystem():
+        Path("1. hi.jpg").write_bytes(b"image")
+        download_image(illustration, directory=Path.cwd(), track_download=False)
+
+    started, finished = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert started["event"] == "started"
+    assert started["id"] == 1
+    assert started["pages"] == 1
+    assert finished["event"] == "finished"
+    assert finished["path"].endswith("1. hi.jpg")
+    assert finished["bytes"] == 5
+    assert progress.counts == {"started": 1, "finished": 1}
+
+
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.clear_failed")
+@mock.patch("pixi.util.record_finished")
+def test_download_illust_layout(record_finished, _, __):
+    illustration = _illustration()
+    illustration.client.layout = "{artist_id}/{shard}/{id}"
 
     with CliRunner().isolated_filesystem():
         download_image(illustration, directory=Path.cwd())
 
-        assert illustration.download.called_with(
-            directory=Path.cwd(),
-            size=Size.ORIGINAL,
-            filename="1. image",
+        illustration.client.download.assert_called_with(
+            url="https://i.pximg.net/img/1_p0.jpg",
+            destination=Path.cwd() / "5" / "001" / "1.jpg",
+            referer=mock.ANY,
         )
+        record_finished.assert_called_once_with(
+            illustration, Path.cwd() / "5" / "001" / "1.jpg"
+        )
+
+
+def _illustration():
+    client = mock.Mock(layout=DEFAULT_LAYOUT)
+    # Files are saved where they were asked to be.
+    client.download.side_effect = lambda url, destination, referer: destination
+    return mock.Mock(
+        id=1,
+        title="hi",
+        user=mock.Mock(id=5),
+        meta_pages=[],
+        image_urls={Size.ORIGINAL: "https://i.pximg.net/img/1_p0.jpg"},
+        client=client,
+    )
 
 
-@mock.patch("pixi.util.format_filename")
+@mock.patch("pixi.util.time.sleep")
 @mock.patch("pixi.util.check_duplicate")
 @mock.patch("pixi.util.mark_failed")
-def test_download_illust_error(_, __, format_filename):
-    format_filename.return_value = "1. image"
-    illustration = mock.Mock()
-    illustration.download.side_effect = BadApiResponse
+def test_download_illust_error(mark_failed, __, sleep):
+    illustration = _illustration()
+    illustration.client.download.side_effect = BadApiResponse
 
     with CliRunner().isolated_filesystem():
         with pytest.raises(DownloadFailed):
             download_image(illustration, directory=Path.cwd(), tries=2)
-        assert illustration.download.call_count == 2
+        assert illustration.client.download.call_count == 2
+        assert sleep.call_count == 1
+        mark_failed.assert_called_once_with(illustration, "bad_response", mock.ANY)
+
+
+@mock.patch("pixi.util.time.sleep")
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.mark_failed")
+def test_download_illust_permanent_error(mark_failed, _, sleep):
+    illustration = _illustration()
+    illustration.client.download.side_effect = HTTPError(
+        response=mock.Mock(status_code=404)
+    )
+
+    with CliRunner().isolated_filesystem():
+        with pytest.raises(DownloadFailed, match="not_found"):
+            download_image(illustration, directory=Path.cwd(), tries=3)
+        assert illustration.client.download.call_count == 1
+        sleep.assert_not_called()
+        mark_failed.assert_called_once_with(illustration, "not_found", mock.ANY)
+
+
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.mark_failed")
+def test_download_illust_failure_discards_partial_file(_, __):
+    illustration = _illustration()
+
+    def download(url, destination, referer):
+        destination.with_name(f"{destination.name}.part").write_bytes(b"ima")
+        raise HTTPError(response=mock.Mock(status_code=410))
+
+    illustration.client.download.side_effect = download
+
+    with CliRunner().isolated_filesystem():
+        with pytest.raises(DownloadFailed):
+            download_image(illustration, directory=Path.cwd(), tries=3)
+        assert not list(Path.cwd().iterdir())
 
 
-@mock.patch("pixi.util.format_filename")
 @mock.patch("pixi.util.check_duplicate")
 @mock.patch("pixi.util.mark_failed")
-def test_download_duplicate(_, check_duplicate, format_filename):
+def test_download_multi_page_illust_failure_discards_partial_files(_, __):
+    illustration = _multi_page_illustration(2)
+    illustration.title = "hi"
+    illustration.client.layout = DEFAULT_LAYOUT
+
+    def download(url, destination, referer):
+        destination.with_name(f"{destination.name}.part").write_bytes(b"ima")
+        raise HTTPError(response=mock.Mock(status_code=404))
+
+    illustration.client.download.side_effect = download
+
+    with CliRunner().isolated_filesystem():
+        with pytest.raises(DownloadFailed):
+            download_image(illustration, directory=Path.cwd(), tries=3)
+        assert not list(Path.cwd().iterdir())
+
+
+@mock.patch("pixi.util.time.sleep")
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.record_finished")
+@mock.patch("pixi.util.clear_failed")
+def test_download_illust_auth_error(_, __, ___, sleep):
+    illustration = _illustration()
+    illustration.client.download.side_effect = [
+        BadApiResponse("Status code: 400", '{"error": "invalid_grant"}'),
+        Path("1. hi.jpg"),
+    ]
+
+    with CliRunner().isolated_filesystem():
+        download_image(illustration, directory=Path.cwd(), tries=3)
+        illustration.client.reauthenticate.assert_called_once_with(
+            illustration.client.access_token
+        )
+        sleep.assert_not_called()
+
+
+def _multi_page_illustration(pages):
+    return mock.Mock(
+        id=1,
+        meta_pages=[
+            {Size.ORIGINAL: f"https://i.pximg.net/img/1_p{i}.png"} for i in range(pages)
+        ],
+    )
+
+
+def test_download_meta_pages():
+    illustration = _multi_page_illustration(3)
+
+    with CliRunner().isolated_filesystem():
+        download_meta_pages(illustration, Path.cwd(), "1. image")
+
+        assert (Path.cwd() / "1. image").is_dir()
+        destinations = sorted(
+            c[1]["destination"] for c in illustration.client.download.call_args_list
+        )
+        assert destinations == [
+            Path.cwd() / "1. image" / f"1_p{i}.png" for i in range(3)
+        ]
+
+
+def test_download_meta_pages_concurrently(monkeypatch):
+    monkeypatch.setattr("pixi.util.META_PAGE_JOBS", 3)
+    illustration = _multi_page_illustration(3)
+    barrier = threading.Barrier(3, timeout=5)
+    illustration.client.download.side_effect = lambda **kwargs: barrier.wait()
+
+    with CliRunner().isolated_filesystem():
+        download_meta_pages(illustration, Path.cwd(), "1. image")
+
+
+def test_download_meta_pages_retry_skips_finished():
+    illustration = _multi_page_illustration(3)
+    finished = set()
+
+    def download(url, **kwargs):
+        if url.endswith("p1.png"):
+            raise RequestException
+
+    illustration.client.download.side_effect = download
+
+    with CliRunner().isolated_filesystem():
+        with pytest.raises(RequestException):
+            download_meta_pages(illustration, Path.cwd(), "1. image", finished)
+        assert illustration.client.download.call_count == 3
+
+        illustration.client.download.side_effect = None
+        download_meta_pages(illustration, Path.cwd(), "1. image", finished)
+        assert illustration.client.download.call_count == 4
+        assert illustration.client.download.call_args[1]["url"].endswith("p1.png")
+
+
+@mock.patch("pixi.util.illustration_path")
+@mock.patch("pixi.util.download_meta_pages")
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.clear_failed")
+@mock.patch("pixi.util.record_finished")
+def test_download_multi_page_illust(
+    record_finished, _, __, download_meta_pages, illustration_path
+):
+    illustration_path.return_value = Path("1. image")
+    illustration = _multi_page_illustration(2)
+
+    with CliRunner().isolated_filesystem():
+        download_image(illustration, directory=Path.cwd())
+
+        download_meta_pages.assert_called_with(
+            illustration, Path.cwd(), "1. image", set()
+        )
+        illustration.client.download.assert_not_called()
+        record_finished.assert_called_once_with(illustration, Path.cwd() / "1. image")
+
+
+@mock.patch("pixi.util.check_duplicate")
+@mock.patch("pixi.util.mark_failed")
+def test_download_duplicate(_, check_duplicate):
     illustration = mock.Mock()
     check_duplicate.side_effect = DuplicateImage
 
     with CliRunner().isolated_filesystem():
         download_image(illustration, directory=Path.cwd())
-        illustration.download.assert_not_called()
+        illustration.client.download.assert_not_called()
 
 
 def test_download_pages_no_illustrations():
@@ -140,17 +367,19 @@ def test_download_pages_no_illustrations():
         download_pages(get_next_response, 1, None)
 
 
+@mock.patch("pixi.util.find_downloaded")
 @mock.patch("pixi.util.download_image")
-def test_download_pages(download_image):
+def test_download_pages(download_image, find_downloaded):
     download_image.side_effect = [DownloadFailed] * 5 + [None] * 5
+    find_downloaded.return_value = set()
     get_next_response = mock.Mock()
     get_next_response.side_effect = [
         {
-            "illustrations": [mock.Mock(id=1, title="hi")] * 5,
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(5)],
             "next": 5,
         },
         {
-            "illustrations": [6, 7, 8, 9, 10],
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(5, 10)],
             "next": None,
         },
     ]
@@ -159,6 +388,137 @@ def test_download_pages(download_image):
     assert download_image.call_count == 10
 
 
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_pages_concurrently(download_image, find_downloaded):
+    download_image.side_effect = [DownloadFailed] * 2 + [None] * 3
+    find_downloaded.return_value = set()
+    get_next_response = mock.Mock()
+    get_next_response.side_effect = [
+        {
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(3)],
+            "next": 3,
+        },
+        {
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(2, 5)],
+            "next": None,
+        },
+    ]
+
+    download_pages(get_next_response, 0, None, jobs=3)
+    assert download_image.call_count == 5
+    assert sorted(c[0][0].id for c in download_image.call_args_list) == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_pages_skips_downloaded(download_image, find_downloaded):
+    find_downloaded.return_value = {1, 3}
+    get_next_response = mock.Mock()
+    get_next_response.return_value = {
+        "illustrations": [mock.Mock(id=i, title="hi") for i in range(5)],
+        "next": None,
+    }
+
+    download_pages(get_next_response, 0, None)
+    assert find_downloaded.call_count == 1
+    assert [c[0][0].id for c in download_image.call_args_list] == [0, 2, 4]
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_pages_allow_duplicates(download_image, find_downloaded):
+    get_next_response = mock.Mock()
+    get_next_response.return_value = {
+        "illustrations": [mock.Mock(id=i, title="hi") for i in range(5)],
+        "next": None,
+    }
+
+    download_pages(get_next_response, 0, None, allow_duplicates=True)
+    find_downloaded.assert_not_called()
+    assert download_image.call_count == 5
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_pages_until_known(download_image, find_downloaded):
+    find_downloaded.side_effect = [{2, 4}, {5, 6, 7}]
+    get_next_response = mock.Mock()
+    get_next_response.side_effect = [
+        {
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(5)],
+            "next": 5,
+        },
+        {
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(5, 10)],
+            "next": 10,
+        },
+        {
+            "illustrations": [mock.Mock(id=i, title="hi") for i in range(10, 15)],
+            "next": None,
+        },
+    ]
+
+    download_pages(get_next_response, 0, None, until_known=3)
+    assert [c[0][0].id for c in download_image.call_args_list] == [0, 1, 3]
+    assert get_next_response.call_count == 2
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_pages_checkpoint(download_image, find_downloaded):
+    find_downloaded.return_value = set()
+    checkpoint = mock.Mock()
+    first = {"illustrations": [mock.Mock(id=1, title="hi")], "next": 30}
+    second = {"illustrations": [mock.Mock(id=2, title="hi")], "next": None}
+    get_next_response = mock.Mock(side_effect=[first, second])
+
+    download_pages(get_next_response, 0, None, start_page=3, checkpoint=checkpoint)
+    assert checkpoint.call_args_list == [mock.call(3, first), mock.call(4, second)]
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_illustrations(download_image, find_downloaded):
+    find_downloaded.return_value = {2}
+    client = mock.Mock()
+    client.fetch_illustration.side_effect = [
+        mock.Mock(id=1),
+        BadApiResponse("Status code: 404", "{}"),
+        mock.Mock(id=4),
+    ]
+    download_image.side_effect = [None, DownloadFailed("not_found")]
+
+    download_illustrations(client, [1, 2, 3, 4], None, jobs=2)
+    assert sorted(c[0][0] for c in client.fetch_illustration.call_args_list) == [
+        1,
+        3,
+        4,
+    ]
+    assert download_image.call_count == 2
+    assert all(c[1]["allow_duplicate"] for c in download_image.call_args_list)
+
+
+@mock.patch("pixi.util.find_downloaded")
+@mock.patch("pixi.util.download_image")
+def test_download_illustrations_allow_duplicates(download_image, find_downloaded):
+    client = mock.Mock()
+    download_illustrations(client, [1, 2], None, allow_duplicates=True)
+    find_downloaded.assert_not_called()
+    assert download_image.call_count == 2
+
+
+def test_download_pages_until_known_allow_duplicates():
+    with pytest.raises(PixiError):
+        download_pages(mock.Mock(), 0, None, allow_duplicates=True, until_known=3)
+
+
 def test_mark_failed(monkeypatch):
     runner = CliRunner()
     with runner.isolated_filesystem():
@@ -187,6 +547,21 @@ def test_mark_failed(monkeypatch):
             assert cursor.fetchone()["id"] == 99
 
 
+def test_mark_failed_reason(monkeypatch):
+    with CliRunner().isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+
+        illustration = mock.Mock(id=99, user=mock.Mock(account="a"), title="b")
+        mark_failed(illustration, "timeout")
+        mark_failed(illustration, "not_found")
+
+        with database() as (conn, cursor):
+            cursor.execute("SELECT reason FROM failed WHERE id = 99")
+            assert [row["reason"] for row in cursor.fetchall()] == ["not_found"]
+
+
 def test_clear_failed(monkeypatch):
     runner = CliRunner()
     with runner.isolated_filesystem():
@@ -235,6 +610,49 @@ def test_record_download(monkeypatch):
             assert cursor.fetchone()["id"] == 99
 
 
+def _finished_illustration():
+    user = mock.Mock(id=5)
+    user.name = "artist"
+    return mock.Mock(
+        id=99,
+        title="hi",
+        user=user,
+        tags=[{"name": "tag", "translated_name": None}],
+        page_count=1,
+        width=800,
+        height=600,
+        create_date=datetime(2020, 1, 1, tzinfo=timezone.utc),
+    )
+
+
+def test_record_finished_commits_during_batch(db):
+    with CliRunner().isolated_filesystem():
+        Path("99. hi.jpg").write_bytes(b"image")
+        with batch_writes():
+            record_finished(_finished_illustration(), Path("99. hi.jpg"))
+
+            conn = sqlite3.connect(str(db))
+            downloaded = conn.execute("SELECT path FROM downloaded").fetchone()
+            cataloged = conn.execute("SELECT size FROM illustrations").fetchone()
+            conn.close()
+
+    assert downloaded[0].endswith("99. hi.jpg")
+    assert cataloged[0] == 5
+
+
+@mock.patch("pixi.util.record_illustration")
+def test_record_finished_atomic(record_illustration, db):
+    record_illustration.side_effect = sqlite3.OperationalError
+
+    with batch_writes():
+        with pytest.raises(sqlite3.OperationalError):
+            record_finished(_finished_illustration(), Path("99. hi.jpg"))
+
+    with database() as (conn, cursor):
+        cursor.execute("SELECT 1 FROM downloaded WHERE id = 99")
+        assert not cursor.fetchone()
+
+
 def test_check_duplicate_positive(monkeypatch):
     runner = CliRunner()
     with runner.isolated_filesystem():
@@ -276,3 +694,20 @@ def test_check_duplicate_negative(monkeypatch):
             )
 
         check_duplicate(98)
+
+
+def test_find_downloaded(monkeypatch):
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        db_path = Path.cwd() / "db.sqlite3"
+        copyfile(Path(__file__).parent / "test.db", db_path)
+        monkeypatch.setattr("pixi.database.DATABASE_PATH", db_path)
+        monkeypatch.setattr("pixi.util.SQLITE_MAX_VARIABLES", 2)
+
+        with database() as (conn, cursor):
+            cursor.executemany(
+                "INSERT INTO downloaded (id, path) VALUES (?, ?)",
+                [(1, "/a"), (3, "/a"), (5, "/a")],
+            )
+
+        assert find_downloaded([1, 2, 3, 4, 5]) == {1, 3, 5}